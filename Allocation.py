@@ -0,0 +1,241 @@
+"""
+~~~ Allocation ~~~
+
+Splits a client's wealth between the risk free asset and the risky portfolios,
+for a target sd or a target E(r), when borrowing costs more than lending.
+
+Lending at the risk free rate rf and borrowing at the available borrowing
+interest rate rb > rf give a kinked Capital Allocation Line:
+1. lending segment   : from the risk free asset to the tangency portfolio L
+                       of rf (max Sharpe ratio), part of the wealth is lent at rf
+2. frontier segment  : the efficient frontier from L to the tangency portfolio B
+                       of rb, the whole wealth is invested in risky portfolios
+3. borrowing segment : beyond B, money borrowed at rb is invested in B (leverage)
+With rb = rf, L = B and the kinked line is the CAL extended beyond 100%.
+
+KinkedCAL answers many targets in one vectorized call (no loop over targets):
+the segment of every target is found with masks, the frontier segment is
+interpolated linearly between the weights of its consecutive efficient portfolios.
+E(r) is linear in the weights, the sd is not: between two portfolios w1 and w2,
+the sd of w1 + t (w2 - w1) is the root of a quadratic in t (covariance matrix of
+the universe), solved for every target sd at once. The sd of an allocation is
+always computed from its interpolated weights.
+
+Every rate, E(r) and sd is in %, weights are in % of the wealth: the asset class
+weights sum to the risky share y and the risk free weight is 100 - y (negative
+when borrowing).
+"""
+import PortfolioBuilderObjects as obj
+import numpy as np
+import pandas as pd
+
+# Result labels (besides one weight column per asset class)
+RISK_FREE   = "Risk Free"   # weight lent (> 0) or borrowed (< 0) at the risk free / borrowing rate
+RISKY_SHARE = "Risky Share" # share of the wealth invested in risky portfolios (> 100: leverage)
+ER          = "E(r)"
+SD          = "sd"
+
+# Target kinds
+TARGET_SD = "sd"
+TARGET_ER = "E(r)"
+
+
+def get_efficient_envelope(Er: np.ndarray, sd: np.ndarray) -> np.ndarray:
+    """
+    Returns the rows of the portfolios on the upper envelope of the cloud:
+    sorted by increasing sd, every portfolio has a higher E(r) than the ones
+    with a lower sd
+    """
+    order = np.lexsort((-Er, sd))
+    sorted_er = Er[order]
+    previous_max = np.r_[-np.inf, np.maximum.accumulate(sorted_er)[:-1]]
+    return order[sorted_er > previous_max]
+
+
+class KinkedCAL:
+    """
+    Kinked borrowing / lending Capital Allocation Line (see the module docstring)
+
+    segment_weights, segment_er and segment_sd hold the efficient portfolios
+    from the tangency portfolio of rf (first row) to the tangency portfolio of
+    rb (last row), by increasing sd.
+    """
+    universe = None
+    names = []
+    rf = None
+    rb = None
+    segment_weights = None # (k x n) weights in %
+    segment_er = None
+    segment_sd = None
+    max_leverage = None    # highest risky share in % (None: unlimited)
+
+
+    def __init__(self, universe: obj.AssetUniverse, rf: float, rb: float, weights: np.ndarray, Er: np.ndarray, sd: np.ndarray, max_leverage: float = None):
+        """
+        Builds the kinked CAL on candidate portfolios (cloud or frontier) of universe:
+        (portfolios x n) weights in %, with their E(r) and sd
+        """
+        names = universe.names
+        weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+        Er = np.atleast_1d(np.asarray(Er, dtype=np.float64))
+        sd = np.atleast_1d(np.asarray(sd, dtype=np.float64))
+        if weights.shape != (len(Er), len(names)) or len(Er) != len(sd) or len(Er) == 0:
+            raise ValueError("Weights, E(r) and sd do not describe the same portfolios.")
+        if pd.isna(rb):
+            rb = rf
+        if rb < rf:
+            raise ValueError(f"The borrowing rate ({rb}%) is lower than the risk free rate ({rf}%)")
+
+        rows = get_efficient_envelope(Er, sd)
+        rows = rows[sd[rows] > 0]
+        if len(rows) == 0:
+            raise ValueError("No risky portfolio to allocate to")
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lending = int(np.argmax((Er[rows] - rf) / sd[rows]))
+            borrowing = int(np.argmax((Er[rows] - rb) / sd[rows]))
+        rows = rows[lending:max(lending, borrowing) + 1]
+
+        self.universe = universe
+        self.names = list(names)
+        self.rf = float(rf)
+        self.rb = float(rb)
+        self.segment_weights = weights[rows]
+        self.segment_er = Er[rows]
+        self.segment_sd = sd[rows]
+        self.max_leverage = max_leverage
+
+
+    @classmethod
+    def from_portfolio_set(cls, portfolio_set: obj.PortfolioSet, rf: float, rb: float, max_leverage: float = None):
+        """ Builds the kinked CAL on the portfolios of a PortfolioSet """
+        universe = obj.get_universe(portfolio_set.asset_classes, portfolio_set.corr_matrix)
+        return cls(universe, rf, rb, portfolio_set.weights, portfolio_set.Er, portfolio_set.sd, max_leverage)
+
+
+    @classmethod
+    def from_portfolio(cls, portfolio: obj.Portfolio, rf: float, rb: float, max_leverage: float = None):
+        """ Builds the kinked CAL on a single optimal portfolio (lending and borrowing through it) """
+        return cls(portfolio.universe, rf, rb, portfolio.weights[None, :], [portfolio.Er], [portfolio.sd], max_leverage)
+
+
+    def get_lending_portfolio(self) -> tuple:
+        """ Returns (weights, E(r), sd) of the tangency portfolio of the risk free rate """
+        return self.segment_weights[0], self.segment_er[0], self.segment_sd[0]
+
+
+    def get_borrowing_portfolio(self) -> tuple:
+        """ Returns (weights, E(r), sd) of the tangency portfolio of the borrowing rate """
+        return self.segment_weights[-1], self.segment_er[-1], self.segment_sd[-1]
+
+
+    def compute_risk(self, weights: np.ndarray) -> np.ndarray:
+        """
+        sd of the (portfolios x n) weights in % (the downside deviation with a
+        downside risk measure, see Portfolio.computeSd)
+        """
+        if self.universe.is_exact_downside():
+            return self.universe.compute_exact_risk(weights)
+        variance = np.einsum("ij,ij->i", weights @ self.universe.cov_matrix, weights)
+        return np.sqrt(np.maximum(variance, 0))
+
+
+    def get_segment_fraction(self, targets: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+        """
+        Fractions t in [0, 1] such that the sd of w + t (w' - w) is the target sd,
+        w and w' being the lower and upper efficient portfolios of every target:
+            sd² = a t² + 2 b t + c   with d = w' - w, a = d Σ dᵀ, b = w Σ dᵀ, c = w Σ wᵀ
+        The sd is convex in t and increases from w to w': the larger root is kept
+        """
+        w = self.segment_weights[lower]
+        d = self.segment_weights[upper] - w
+        wc = w @ self.universe.cov_matrix
+        a = np.einsum("ij,ij->i", d @ self.universe.cov_matrix, d)
+        b = np.einsum("ij,ij->i", wc, d)
+        c = np.einsum("ij,ij->i", wc, w)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (-b + np.sqrt(np.maximum(b * b - a * (c - targets * targets), 0))) / a
+        return np.clip(np.nan_to_num(t), 0, 1)
+
+
+    def get_line(self, max_sd: float) -> tuple:
+        """
+        Returns the (sd, E(r)) points of the kinked line from the risk free asset
+        up to max_sd (or the max leverage). The line stops at B when borrowing
+        does not pay (E(r) of B below the borrowing rate)
+        """
+        _, er_b, sd_b = self.get_borrowing_portfolio()
+        end_sd = max(max_sd, sd_b) if er_b > self.rb else sd_b
+        if self.max_leverage is not None:
+            end_sd = min(end_sd, sd_b * self.max_leverage / 100)
+        end_er = self.rb + end_sd / sd_b * (er_b - self.rb)
+
+        sd = np.r_[0, self.segment_sd, end_sd]
+        Er = np.r_[self.rf, self.segment_er, end_er]
+        return sd, Er
+
+
+    def allocate(self, targets, kind: str = TARGET_SD) -> pd.DataFrame:
+        """
+        Allocations reaching every target sd (kind TARGET_SD) or target E(r) (kind TARGET_ER), in %
+
+        Returns a DataFrame indexed by target with the weight of every asset class,
+        the risk free weight, the risky share and the E(r) and sd of the allocation.
+        Unreachable targets (negative risk, E(r) below rf, beyond the max leverage
+        or above B when borrowing does not pay) are NaN rows.
+
+        With the exact downside deviation, target sd are reached through the
+        co-semivariance approximation and the exact downside deviation is reported.
+        """
+        targets = np.atleast_1d(np.asarray(targets, dtype=np.float64))
+        k = len(self.segment_er)
+        positions = np.arange(k, dtype=np.float64)
+        er_l, er_b = self.segment_er[0], self.segment_er[-1]
+        sd_l, sd_b = self.segment_sd[0], self.segment_sd[-1]
+
+        if kind == TARGET_SD:
+            lending = targets <= sd_l
+            borrowing = targets > sd_b
+            with np.errstate(divide="ignore", invalid="ignore"):
+                share = np.where(lending, targets / sd_l, np.where(borrowing, targets / sd_b, 1.0))
+            lower = np.clip(np.searchsorted(self.segment_sd, targets, side="right") - 1, 0, k - 1)
+            valid = targets >= 0
+        elif kind == TARGET_ER:
+            lending = targets <= er_l
+            borrowing = targets > er_b
+            with np.errstate(divide="ignore", invalid="ignore"):
+                lend_share = (targets - self.rf) / (er_l - self.rf)
+                borrow_share = (targets - self.rb) / (er_b - self.rb)
+            share = np.where(lending, lend_share, np.where(borrowing, borrow_share, 1.0))
+            position = np.interp(targets, self.segment_er, positions)
+            lower = np.minimum(np.floor(position).astype(np.int64), k - 1)
+            valid = (targets >= self.rf) & ~(borrowing & (er_b <= self.rb))
+        else:
+            raise ValueError(f"Unknown target kind '{kind}', select from {[TARGET_SD, TARGET_ER]}")
+
+        valid &= np.isfinite(share) & (share >= 0)
+        if self.max_leverage is not None:
+            valid &= share * 100 <= self.max_leverage
+
+        # Risky portfolio of every target: interpolated between two consecutive efficient portfolios
+        upper = np.minimum(lower + 1, k - 1)
+        if kind == TARGET_SD:
+            fraction = np.where(lending | borrowing, 0.0, self.get_segment_fraction(targets, lower, upper))
+        else:
+            fraction = position - lower
+        risky_weights = self.segment_weights[lower] + fraction[:, None] * (self.segment_weights[upper] - self.segment_weights[lower])
+        risky_er = risky_weights @ self.universe.er_vector
+        risky_sd = self.compute_risk(risky_weights)
+
+        rate = np.where(share > 1, self.rb, self.rf)
+        weights = risky_weights * share[:, None]
+        Er = rate + share * (risky_er - rate)
+        sd = share * risky_sd
+
+        df = pd.DataFrame(weights, index=pd.Index(targets, name=f"Target {kind}"), columns=self.names)
+        df[RISK_FREE] = 100 - share * 100
+        df[RISKY_SHARE] = share * 100
+        df[ER] = Er
+        df[SD] = sd
+        df.loc[~valid] = np.nan
+        return df
@@ -0,0 +1,213 @@
+"""
+~~~ Backtest ~~~
+
+Vectorized historical backtest of many portfolios at once.
+
+The E(r) and sd of PortfolioBuilder.py are ex-ante estimates. backtest() replays
+the historical returns matrix (dates x tickers, as resampled by read_excel_input)
+on the weights of many portfolios and reports their realized performance:
+wealth paths, drawdowns, realized return and volatility.
+
+Portfolios are rebalanced to their weights at the start of every rebalancing
+period (calendar day, week, month or year), or never (buy and hold).
+Between two rebalancing dates a portfolio is buy and hold, so its wealth is a
+linear combination of the growth of its asset classes since the last rebalancing:
+    wealth(t) = wealth(rebalancing) * Σ w_i * growth_i(rebalancing -> t)
+Every path is therefore computed with a single (dates x n) @ (n x portfolios)
+product, without any loop over portfolios or dates. Portfolios are processed in
+chunks of PORTFOLIO_CHUNK to bound the (dates x portfolios) temporaries.
+
+Missing returns (asset class not listed yet, holidays) count as 0: the weight
+of the asset class is held as cash until it has returns.
+
+Weights follow the convention of the rest of the program: in % (rows sum to 100).
+Returns and volatilities are annualized and in %.
+"""
+import Returns
+import PortfolioBuilderObjects as obj
+import TimeTracker
+import numpy as np
+import pandas as pd
+
+# Portfolios backtested at once (bounds the (dates x portfolios) temporaries)
+PORTFOLIO_CHUNK = 2_000
+
+# Result labels
+WEALTH       = "Wealth"          # (dates x portfolios) wealth paths, starting from 1
+DRAWDOWN     = "Drawdown"        # (dates x portfolios) drawdowns from the running peak, in %
+TOTAL_RETURN = "Total Return"    # total return over the whole period, in %
+RETURN       = "Realized Return" # annualized (geometric) return, in %
+VOLATILITY   = "Realized sd"     # annualized sd of the period returns, in %
+MAX_DRAWDOWN = "Max Drawdown"    # deepest drawdown, in %
+SHARPE       = "Realized Sharpe" # (realized return - rf) / realized sd
+
+# Rebalancing periods (see PortfolioBuilder.translate_period), None: buy and hold
+REBALANCE_PERIODS = list(Returns.PERIOD_FREQS)
+
+
+def get_growth_matrix(returns: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the (dates x tickers) growth factors (1 + r) of returns, missing returns -> 1
+    """
+    growth = returns.to_numpy(dtype=np.float64) + 1
+    growth[np.isnan(growth)] = 1
+    return growth
+
+
+def get_rebalance_blocks(index: pd.DatetimeIndex, rebalance: str = None) -> np.ndarray:
+    """
+    Returns the first row of every rebalancing period of index (sorted dates):
+    rows of the same calendar period of rebalance ("D", "W", "M" or "Y") are
+    held without rebalancing. None: a single block (buy and hold)
+    """
+    if rebalance is None or len(index) == 0:
+        return np.zeros(1, dtype=np.int64)
+    if rebalance not in REBALANCE_PERIODS:
+        raise ValueError(f"Unknown rebalancing period '{rebalance}', select from {REBALANCE_PERIODS} or None")
+
+    codes, _ = Returns.get_period_codes(pd.DatetimeIndex(index), rebalance)
+    return np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+
+def compute_wealth(growth: np.ndarray, weights: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Wealth paths of portfolios rebalanced at rows starts (first row of every block)
+
+    growth  : (dates x n) growth factors
+    weights : (portfolios x n) weights in %
+    Returns the (dates x portfolios) wealth after every date, starting from 1
+    """
+    num_dates = growth.shape[0]
+    block = np.zeros(num_dates, dtype=np.int64)
+    block[starts[1:]] = 1
+    block = np.cumsum(block)
+
+    # Growth of every asset class since the start of its block
+    cumulative = np.cumprod(growth, axis=0)
+    base = np.ones((len(starts), growth.shape[1]))
+    base[1:] = cumulative[starts[1:] - 1]
+    relative = cumulative / base[block]
+
+    # Wealth relative to the start of the block (buy and hold within the block)
+    paths = relative @ (weights.T / weights.sum(axis=1))
+
+    # Wealth at the start of every block: product of the previous blocks' growth
+    ends = np.r_[starts[1:] - 1, num_dates - 1]
+    start_wealth = np.ones((len(starts), weights.shape[0]))
+    start_wealth[1:] = np.cumprod(paths[ends[:-1]], axis=0)
+
+    paths *= start_wealth[block]
+    return paths
+
+
+def compute_drawdowns(wealth: np.ndarray) -> np.ndarray:
+    """
+    Returns the drawdown of every wealth path from its running peak, in % (<= 0)
+    """
+    peak = np.maximum(np.maximum.accumulate(wealth, axis=0), 1)
+    return (wealth / peak - 1) * 100
+
+
+def compute_metrics(wealth: np.ndarray, drawdowns: np.ndarray, periods_per_year: float, rf: float = 0) -> dict:
+    """
+    Realized performance of the wealth paths (see the result labels)
+    """
+    num_dates = wealth.shape[0]
+    final = wealth[-1]
+
+    previous = np.vstack([np.ones((1, wealth.shape[1])), wealth[:-1]])
+    period_returns = wealth / previous - 1
+    sd = period_returns.std(axis=0, ddof=1) * np.sqrt(periods_per_year) * 100 if num_dates > 1 else np.zeros(wealth.shape[1])
+    annual = (final ** (periods_per_year / num_dates) - 1) * 100
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(sd > 0, (annual - rf) / sd, 0)
+
+    return {
+        TOTAL_RETURN : (final - 1) * 100,
+        RETURN       : annual,
+        VOLATILITY   : sd,
+        MAX_DRAWDOWN : drawdowns.min(axis=0),
+        SHARPE       : sharpe
+    }
+
+
+@TimeTracker.track
+def backtest(returns: pd.DataFrame, weights: np.ndarray, period: str, rebalance: str = None, rf: float = 0, keep_paths: bool = True) -> dict:
+    """
+    Backtests many portfolios at once on historical returns
+
+    returns    : (dates x tickers) period returns in decimal (columns in the order of the weights)
+    weights    : (portfolios x tickers) or (tickers,) weights in % (rescaled to 100%, must not sum to 0)
+    period     : periodicity of returns (annualization)
+    rebalance  : rebalancing period ("D", "W", "M", "Y"), None: buy and hold
+    rf         : risk free rate in % (realized Sharpe ratio)
+    keep_paths : also return the wealth and drawdown paths (dates x portfolios)
+
+    Returns {label : array with one value per portfolio} (see the result labels)
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    if weights.shape[0] == 0:
+        raise ValueError("No portfolio to backtest")
+    if weights.shape[1] != returns.shape[1]:
+        raise ValueError(f"Weights of {weights.shape[1]} asset classes for returns of {returns.shape[1]} asset classes")
+    if len(returns) == 0:
+        raise ValueError("No returns to backtest")
+    empty = np.flatnonzero(~(weights.sum(axis=1) != 0))
+    if len(empty) > 0:
+        raise ValueError(f"The weights of portfolios {empty.tolist()} sum to 0")
+
+    returns = returns.sort_index()
+    growth = get_growth_matrix(returns)
+    starts = get_rebalance_blocks(returns.index, rebalance)
+    periods_per_year = obj.get_num_periods_in_year(period)
+
+    results = {}
+    chunks = []
+    for start in range(0, weights.shape[0], PORTFOLIO_CHUNK):
+        wealth = compute_wealth(growth, weights[start:start + PORTFOLIO_CHUNK], starts)
+        drawdowns = compute_drawdowns(wealth)
+        chunks.append(compute_metrics(wealth, drawdowns, periods_per_year, rf))
+        if keep_paths:
+            results.setdefault(WEALTH, []).append(wealth)
+            results.setdefault(DRAWDOWN, []).append(drawdowns)
+
+    for label in chunks[0]:
+        results[label] = np.concatenate([chunk[label] for chunk in chunks])
+    if keep_paths:
+        results[WEALTH] = pd.DataFrame(np.hstack(results[WEALTH]), index=returns.index)
+        results[DRAWDOWN] = pd.DataFrame(np.hstack(results[DRAWDOWN]), index=returns.index)
+
+    return results
+
+
+def backtest_portfolios(portfolios: list, universe: obj.AssetUniverse, period: str, rebalance: str = None, rf: float = 0) -> pd.DataFrame:
+    """
+    Backtests Portfolio objects on the returns of their AssetUniverse (see read_excel_input)
+
+    Returns a table of realized performance (one row per portfolio), with their
+    ex-ante E(r) and sd for comparison. Portfolios whose weights sum to 0 are
+    left out (with a warning).
+    """
+    if universe.returns is None:
+        raise ValueError("The asset universe does not hold its historical returns")
+    if not portfolios:
+        return pd.DataFrame()
+
+    weights = np.array([p.weights for p in portfolios]).reshape(len(portfolios), len(universe))
+    kept = weights.sum(axis=1) != 0
+    if not kept.all():
+        print(f"\nWARNING : Not backtesting {[p.name for p, keep in zip(portfolios, kept) if not keep]} (weights sum to 0)")
+        portfolios = [p for p, keep in zip(portfolios, kept) if keep]
+        weights = weights[kept]
+        if not portfolios:
+            return pd.DataFrame()
+    results = backtest(universe.returns[universe.names], weights, period, rebalance, rf, keep_paths=False)
+
+    table = pd.DataFrame({
+        "E(r)" : [p.Er for p in portfolios],
+        "sd"   : [p.sd for p in portfolios]
+    }, index=[p.name for p in portfolios])
+    for label in [TOTAL_RETURN, RETURN, VOLATILITY, MAX_DRAWDOWN, SHARPE]:
+        table[label] = results[label]
+    return table
@@ -0,0 +1,326 @@
+"""
+~~~ Batch ~~~
+
+Headless batch mode of PortfolioBuilder.py: runs many input workbooks in one go.
+
+Inputs are either a directory (every .xlsx file in it) or a manifest: a text file
+listing one workbook per line (paths relative to the manifest, blank lines and
+lines starting with # are ignored).
+
+Jobs are spread over a pool of worker processes started once: pandas, plotly and
+the program modules are imported a single time per worker instead of once per
+workbook. Nothing is shown, every job writes into the output directory:
+- <name>.html : efficient frontier figure (plotly.js is written once as plotly.min.js)
+- <name>.json : optimal portfolio, user portfolios, parameters and runtime
+and summary.json lists the status of every job.
+
+Usage:
+    python3 Batch.py [directory or manifest] --output [directory] [--jobs N] [--samples N] [--seed N]
+                     [--solver] [--prune] [--stream] [--best-only] [--period P] [--sampler S] [--no-cache]
+                     [--backtest P] [--resample B]
+"""
+import PortfolioBuilder as pb
+import Samplers
+import Kernels
+
+import os
+import sys
+import json
+import time
+import traceback
+import multiprocessing
+
+# Name of the file listing the status of every job
+SUMMARY_FILE = "summary.json"
+
+# Job status
+OK     = "ok"
+FAILED = "failed"
+
+USAGE = ("python3 Batch.py [directory or manifest] --output [directory] [--jobs N] [--samples N] [--seed N]\n"
+         "                 [--solver] [--prune] [--stream] [--best-only] [--period P] [--sampler S] [--no-cache]\n"
+         "                 [--backtest P] [--resample B]")
+
+# Default settings of a job (same defaults as PortfolioBuilder.py)
+DEFAULT_OPTIONS = {
+    "samples"   : pb.SAMPLE_SIZE,
+    "seed"      : None,
+    "solver"    : False,
+    "use_cache" : True,
+    "period"    : None,
+    "prune"     : False,
+    "sampler"   : None,
+    "stream"    : False,
+    "best_only" : False,
+    "backtest"  : None,
+    "resamples" : 0
+}
+
+
+def get_input_files(source: str) -> list:
+    """
+    Returns the workbooks of a directory (every .xlsx file, sorted by name)
+    or listed in a manifest file
+    """
+    if os.path.isdir(source):
+        names = sorted(os.listdir(source))
+        # Skip the lock files Excel creates next to open workbooks
+        return [os.path.join(source, name) for name in names if name.endswith(".xlsx") and not name.startswith("~$")]
+
+    try:
+        with open(source, "r") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        print(f"ERROR : No such file or directory: '{source}'")
+        exit(1)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    files = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        files.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    return files
+
+
+def get_output_names(files: list) -> list:
+    """
+    Returns the name of the outputs of every file (file name without extension),
+    suffixed when several files share the same name
+    """
+    names = []
+    seen = {}
+    for file_path in files:
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = f"{name}_{seen[name]}"
+        names.append(name)
+    return names
+
+
+def run_job(job: tuple) -> dict:
+    """
+    Runs PortfolioBuilder on one workbook and writes its outputs
+    job = (file_path, output_name, output_dir, options)
+
+    Returns the summary of the job (never raises: failures are reported in the summary)
+    """
+    import Graphs as gr # already imported by build_efficient_frontier
+
+    file_path, name, output_dir, options = job
+    start = time.perf_counter()
+    summary = {"input" : file_path, "name" : name}
+
+    try:
+        eff_frontier, optimal_portfolio, user_portfolios, rf, period, _ = pb.build_efficient_frontier(
+            file_path, "excel", options["samples"], 1, options["seed"], options["solver"], options["use_cache"], options["period"], options["prune"], options["sampler"], options["stream"],
+            best_only=options["best_only"], resamples=options["resamples"])
+
+        html_path = os.path.join(output_dir, f"{name}.html")
+        gr.save_fig_as_html(eff_frontier, html_path, include_plotlyjs="directory")
+
+        optimal = optimal_portfolio.to_dict()
+        optimal["Sharpe"] = max(0, (optimal["E(r)"] - rf) / optimal["sd"]) if optimal["sd"] > 0 else 0
+        result = {
+            "input"             : file_path,
+            "risk_free_rate"    : rf,
+            "periodicity"       : period,
+            "samples"           : options["samples"],
+            "seed"              : options["seed"],
+            "solver"            : options["solver"],
+            "optimal_portfolio" : optimal,
+            "user_portfolios"   : [p.to_dict() for p in user_portfolios]
+        }
+        if options["backtest"] is not None:
+            import Backtest
+            rebalance = pb.get_rebalance_period(options["backtest"])
+            table = Backtest.backtest_portfolios([optimal_portfolio] + user_portfolios, optimal_portfolio.universe, period, rebalance, rf)
+            result["backtest"] = {"rebalancing" : options["backtest"], "portfolios" : table.to_dict(orient="index")}
+        json_path = os.path.join(output_dir, f"{name}.json")
+        with open(json_path, "w") as f:
+            json.dump(result, f, indent=4, default=str)
+
+        summary.update({"status" : OK, "html" : html_path, "json" : json_path})
+
+    # The program exits on invalid inputs (SystemExit): only this job fails
+    except BaseException as e:
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        summary.update({"status" : FAILED, "error" : f"{type(e).__name__}: {e}", "traceback" : traceback.format_exc()})
+
+    summary["runtime"] = time.perf_counter() - start
+    return summary
+
+
+def run_batch(files: list, output_dir: str, options: dict, jobs: int = 1) -> list:
+    """
+    Runs every file over a pool of jobs worker processes
+    Returns the summaries of the jobs (same order as files)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(file_path, name, output_dir, options) for file_path, name in zip(files, get_output_names(files))]
+    jobs = max(1, min(jobs, len(tasks)))
+
+    summaries = [None] * len(tasks)
+    if jobs == 1:
+        results = enumerate(map(run_job, tasks))
+        pool = None
+    else:
+        # The jobs share the cores with the compiled kernels (see Kernels.py) of every worker
+        threads = max(1, (os.cpu_count() or 1) // jobs)
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(threads,))
+        results = pool.imap_unordered(_run_indexed_job, list(enumerate(tasks)))
+
+    try:
+        for done, (i, summary) in enumerate(results, 1):
+            summaries[i] = summary
+            status = "OK" if summary["status"] == OK else f"FAILED ({summary['error']})"
+            print(f"[{done}/{len(tasks)}] {summary['name']} : {status} in {summary['runtime']:.2f} sec")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return summaries
+
+
+def _init_worker(threads: int) -> None:
+    """ Pool initializer: limits the threads of the compiled kernels of the worker """
+    Kernels.set_num_threads(threads)
+
+
+def _run_indexed_job(indexed_task: tuple) -> tuple:
+    """ Pool task: (index, job) -> (index, summary) """
+    i, task = indexed_task
+    return i, run_job(task)
+
+
+def get_args():
+    """
+    Obtains the input from the command line
+
+    returns (source : str, output_dir : str, jobs : int, options : dict)
+    """
+    args = sys.argv
+    if len(args) < 2:
+        print("ERROR : Inavlid input")
+        print(USAGE)
+        exit(1)
+
+    source = args[1]
+    output_dir = None
+    jobs = os.cpu_count() or 1
+    options = dict(DEFAULT_OPTIONS)
+
+    def get_value(flags, i):
+        if i + 1 >= len(flags):
+            print(f"ERROR : Flag '{flags[i]}' must be followed by a value\n")
+            print(USAGE)
+            exit(1)
+        return flags[i + 1]
+
+    def get_int(flags, i, minimum):
+        try:
+            value = int(get_value(flags, i).replace("_", ""))
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            print(f"ERROR : Flag '{flags[i]}' must be followed by an integer >= {minimum}\n")
+            print(USAGE)
+            exit(1)
+        return value
+
+    flags = args[2:]
+    i = 0
+    while i < len(flags):
+        flag = flags[i]
+        if flag == "--output":
+            output_dir = get_value(flags, i)
+            i += 1
+        elif flag == "--jobs":
+            jobs = get_int(flags, i, 1)
+            i += 1
+        elif flag == pb.SAMPLES_FLAG_STR:
+            options["samples"] = get_int(flags, i, 0)
+            i += 1
+        elif flag == pb.SEED_FLAG_STR:
+            options["seed"] = get_int(flags, i, 0)
+            i += 1
+        elif flag == pb.SOLVER_FLAG_STR:
+            options["solver"] = True
+        elif flag == pb.PRUNE_FLAG_STR:
+            options["prune"] = True
+        elif flag == pb.STREAM_FLAG_STR:
+            options["stream"] = True
+        elif flag == pb.BEST_ONLY_FLAG_STR:
+            options["best_only"] = True
+        elif flag == pb.SAMPLER_FLAG_STR:
+            options["sampler"] = Samplers.get_sampler(get_value(flags, i))
+            if options["sampler"] is None:
+                print(f"ERROR : Flag '{flag}' must be followed by a sampler {Samplers.SAMPLERS}\n")
+                print(USAGE)
+                exit(1)
+            i += 1
+        elif flag == pb.NO_CACHE_FLAG_STR:
+            options["use_cache"] = False
+        elif flag == pb.BACKTEST_FLAG_STR:
+            value = get_value(flags, i)
+            pb.get_rebalance_period(value) # validates the value, kept as given in the results
+            options["backtest"] = value
+            i += 1
+        elif flag == pb.RESAMPLE_FLAG_STR:
+            options["resamples"] = get_int(flags, i, 1)
+            i += 1
+        elif flag == pb.PERIOD_FLAG_STR:
+            options["period"] = get_value(flags, i)
+            pb.translate_period(options["period"]) # validation
+            i += 1
+        else:
+            print(f"ERROR : Provided invalid flag '{flag}'\n")
+            print(USAGE)
+            exit(1)
+        i += 1
+
+    if output_dir is None:
+        print("ERROR : Please provide an output directory with '--output'\n")
+        print(USAGE)
+        exit(1)
+
+    if options["samples"] == 0 and not options["solver"] and options["resamples"] == 0:
+        print(f"ERROR : '{pb.SAMPLES_FLAG_STR} 0' can only be used with '{pb.SOLVER_FLAG_STR}' or '{pb.RESAMPLE_FLAG_STR}'\n")
+        exit(1)
+
+    if options["best_only"] and (options["prune"] or options["stream"]):
+        print(f"ERROR : '{pb.BEST_ONLY_FLAG_STR}' cannot be used with '{pb.PRUNE_FLAG_STR}' or '{pb.STREAM_FLAG_STR}'\n")
+        exit(1)
+
+    return source, output_dir, jobs, options
+
+
+def main():
+    source, output_dir, jobs, options = get_args()
+
+    files = get_input_files(source)
+    if not files:
+        print(f"ERROR : No .xlsx file found in '{source}'")
+        exit(1)
+
+    start = time.perf_counter()
+    summaries = run_batch(files, output_dir, options, jobs)
+    runtime = time.perf_counter() - start
+
+    failed = [s for s in summaries if s["status"] != OK]
+    with open(os.path.join(output_dir, SUMMARY_FILE), "w") as f:
+        json.dump({"runtime" : runtime, "jobs" : jobs, "options" : options, "results" : summaries}, f, indent=4, default=str)
+
+    print(f"\n{len(summaries) - len(failed)}/{len(summaries)} workbooks processed in {runtime:.2f} sec ({jobs} worker(s))")
+    print(f"Results saved in {output_dir}")
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+"""
+~~~ Benchmark ~~~
+
+Reproducible benchmark of the PortfolioBuilder.py pipeline.
+
+Synthetic returns matrices (assets x periods) are written to a temporary input
+workbook, then every stage of main() is measured for each combination of asset
+count and sample size:
+- ingestion          : parsing of the workbook (read_excel_sheets)
+- resampling         : compounding of the returns into every periodicity
+- create_portfolios  : random portfolios (E(r), sd)
+- convert_portfolios_into_df : PortfolioSet and DataFrame of the portfolios
+- compute_sharpe
+- add_CAL            : optimal portfolio and Capital Allocation Line
+- plot               : scatter plot and its serialization (what show() sends to the browser)
+
+Startup: the import time of PortfolioBuilder.py is measured in a fresh interpreter
+and checked against an import-time budget. Plotting, Excel and Excel automation
+modules and the optional features (LAZY_MODULES) must not be imported at startup.
+
+Every case runs in its own process, so its peak RSS is its own.
+Results (stage runtimes, throughput, peak RSS) are saved as JSON. When a baseline
+(a previous JSON output) is provided, stages slower than the baseline by more than
+the tolerance are flagged as regressions and the exit code is 1.
+
+Usage:
+    python3 Benchmark.py [--assets 5,15] [--samples 10_000,100_000] [--periods 2520]
+                         [--workers N] [--seed N] [--repeat N] [--output results.json]
+                         [--baseline baseline.json] [--tolerance 0.2] [--import-budget 1.0]
+
+    # Startup check only (exit code 1 when over budget)
+    python3 Benchmark.py --startup-only
+"""
+import PortfolioBuilder as pb
+import PortfolioBuilderObjects as obj
+import Graphs as gr
+import TimeTracker
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# Default benchmark grid
+ASSET_COUNTS = [5, 15]
+SAMPLE_SIZES = [10_000, 100_000, 1_000_000]
+NUM_PERIODS  = 2_520 # ~10 years of daily returns
+
+# Parameters sheet of the synthetic workbooks
+RISK_FREE_RATE = 5.0
+BORROWING_RATE = 6.0
+PERIODICITY    = "Weekly"
+
+# Stages reported, in pipeline order
+INGESTION  = "ingestion"
+RESAMPLING = "resampling"
+CREATE     = "create_portfolios"
+CONVERT    = "convert_portfolios_into_df"
+SHARPE     = "compute_sharpe"
+CAL        = "add_CAL"
+PLOT       = "plot"
+STAGES = [INGESTION, RESAMPLING, CREATE, CONVERT, SHARPE, CAL, PLOT]
+
+# TimeTracker nodes measuring the stages that run inside read_excel_input()
+NESTED_STAGES = {
+    INGESTION  : "read_excel_sheets",
+    RESAMPLING : "resample returns"
+}
+
+# Regressions: relative slowdown allowed and noise floor (seconds)
+TOLERANCE     = 0.20
+MIN_REGRESSION_SEC = 0.05
+
+# Startup: seconds allowed to import PortfolioBuilder (best of STARTUP_RUNS fresh interpreters)
+IMPORT_BUDGET_SEC = 1.0
+STARTUP_RUNS = 3
+
+# Modules that must only be imported on first use
+LAZY_MODULES = ["plotly", "xlwings", "openpyxl", "Backtest", "DownsideRisk", "Resampling", "Allocation"]
+
+# Measures the import in a fresh interpreter, prints {"import_sec" : ..., "modules" : [...]}
+STARTUP_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import PortfolioBuilder
+runtime = time.perf_counter() - start
+print(json.dumps({"import_sec" : runtime, "modules" : sorted(m for m in %r if m in sys.modules)}))
+"""
+
+OUTPUT_FILE = "benchmark_results.json"
+
+USAGE = ("python3 Benchmark.py [--assets 5,15] [--samples 10_000,100_000] [--periods 2520] [--workers N] [--seed N]\n"
+         "                     [--repeat N] [--output results.json] [--baseline baseline.json] [--tolerance 0.2]\n"
+         "                     [--import-budget SEC] [--startup-only]")
+
+
+def get_synthetic_returns(num_assets: int, num_periods: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns a (business days x tickers) DataFrame of daily decimal returns
+
+    Returns are drawn from a one factor model (market + idiosyncratic noise) so the
+    assets are correlated like real asset classes. A given seed always produces
+    the same matrix.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2000-01-03", periods=num_periods)
+
+    betas = rng.uniform(0.3, 1.5, num_assets)
+    drifts = rng.uniform(-0.0001, 0.0008, num_assets)
+    noise_sd = rng.uniform(0.003, 0.015, num_assets)
+
+    market = rng.normal(0.0003, 0.01, num_periods)
+    noise = rng.standard_normal((num_periods, num_assets)) * noise_sd
+    returns = drifts + np.outer(market, betas) + noise
+
+    tickers = [f"ASSET{i + 1}" for i in range(num_assets)]
+    return pd.DataFrame(returns, index=dates, columns=tickers)
+
+
+def write_input_file(file_path: str, returns: pd.DataFrame) -> None:
+    """
+    Writes returns into an input workbook with the layout of input.xlsx
+    (Asset Classes, Portfolios and Parameters sheets)
+    """
+    asset_classes = returns.copy()
+    asset_classes.index.name = "Date"
+
+    # One equally weighted user portfolio (weights in decimals, like input.xlsx)
+    tickers = list(returns.columns)
+    portfolios = pd.DataFrame([["Equal Weights", "orange"] + [1 / len(tickers)] * len(tickers)],
+                              columns=["Portfolio Name", "Color"] + tickers)
+
+    parameters = pd.DataFrame({
+        "Parameter" : ["Risk free rate", "Available borrowing interest rate", "Periodicity"],
+        "Value"     : [RISK_FREE_RATE, BORROWING_RATE, PERIODICITY],
+        "Source (optional)" : [None, None, None]
+    })
+
+    with pd.ExcelWriter(file_path) as writer:
+        asset_classes.to_excel(writer, sheet_name="Asset Classes")
+        portfolios.to_excel(writer, sheet_name="Portfolios", index=False)
+        parameters.to_excel(writer, sheet_name="Parameters", index=False)
+
+
+def get_peak_rss() -> float:
+    """
+    Returns the peak resident set size of the current process in MB
+    (None where the resource module is not available, e.g. Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return peak / 1e6
+    return peak * 1024 / 1e6
+
+
+def find_node(node: TimeTracker.Node, name: str):
+    """
+    Returns the first node called name in the call tree below node (depth first)
+    """
+    for child in node.children.values():
+        if child.name == name:
+            return child
+        found = find_node(child, name)
+        if found is not None:
+            return found
+    return None
+
+
+def run_pipeline(file_path: str, sample_size: int, workers: int, seed: int) -> dict:
+    """
+    Runs the stages of PortfolioBuilder.main() (without opening the browser) on file_path
+    Returns {stage : runtime in seconds}
+    """
+    tt = TimeTracker.get_tracker()
+
+    with tt.section("read_excel_input"):
+        asset_classes, corr_matrix, rf, available_rate, period, user_portfolios, sampler = pb.read_excel_input(file_path, "excel", use_cache=False)
+
+    with tt.section(CREATE):
+        portfolios = pb.create_portfolios(asset_classes, corr_matrix, sample_size, workers, seed)
+
+    with tt.section(CONVERT):
+        portfolio_set = obj.convert_batch_into_portfolio_set(portfolios, asset_classes, corr_matrix)
+        del portfolios
+        cloud_df = portfolio_set.to_df()
+
+    with tt.section(SHARPE):
+        portfolio_set = pb.compute_sharpe(portfolio_set, rf)
+
+    with tt.section(PLOT):
+        figure = gr.get_scatter_plot(cloud_df, title=f"Benchmark : {sample_size} portfolios")
+
+    with tt.section(CAL):
+        figure, optimal_portfolio = gr.add_CAL(figure, portfolio_set, rf)
+
+    with tt.section(PLOT):
+        figure = gr.add_user_portfolios(figure, user_portfolios)
+        figure.to_json()
+
+    runtimes = {}
+    for stage in STAGES:
+        node = find_node(tt.root, NESTED_STAGES.get(stage, stage))
+        runtimes[stage] = node.total_ns / TimeTracker.NS_PER_SEC if node is not None else 0.0
+    return runtimes
+
+
+def _run_case(file_path: str, sample_size: int, workers: int, seed: int, conn) -> None:
+    """
+    Child process of run_case(): sends (runtimes, peak RSS) or the error through conn
+    """
+    try:
+        runtimes = run_pipeline(file_path, sample_size, workers, seed)
+        conn.send((runtimes, get_peak_rss()))
+    except BaseException as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def run_case(file_path: str, sample_size: int, workers: int, seed: int):
+    """
+    Runs the pipeline in a fresh process (own TimeTracker, own peak RSS)
+    Returns (runtimes, peak RSS in MB)
+    """
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case, args=(file_path, sample_size, workers, seed, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = RuntimeError(f"Benchmark process exited with code {process.exitcode}")
+    process.join()
+
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def run_benchmark(asset_counts: list, sample_sizes: list, num_periods: int, workers: int = 1, seed: int = 0, repeat: int = 1) -> list:
+    """
+    Measures every stage for each (asset count, sample size)
+    The best runtime of the repeat runs is kept for every stage
+
+    Returns the list of results (one dict per case)
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_assets in asset_counts:
+            file_path = os.path.join(tmp_dir, f"benchmark_{num_assets}x{num_periods}.xlsx")
+            write_input_file(file_path, get_synthetic_returns(num_assets, num_periods, seed))
+
+            for sample_size in sample_sizes:
+                best = None
+                peak_rss = None
+                for _ in range(repeat):
+                    runtimes, rss = run_case(file_path, sample_size, workers, seed)
+                    if best is None:
+                        best = runtimes
+                    else:
+                        best = {stage : min(best[stage], runtimes[stage]) for stage in STAGES}
+                    if rss is not None:
+                        peak_rss = rss if peak_rss is None else max(peak_rss, rss)
+
+                total = sum(best.values())
+                result = {
+                    "assets"   : num_assets,
+                    "periods"  : num_periods,
+                    "samples"  : sample_size,
+                    "workers"  : workers,
+                    "stages"   : best,
+                    "total"    : total,
+                    "throughput" : sample_size / best[CREATE] if best[CREATE] > 0 else None,
+                    "end_to_end_throughput" : sample_size / total if total > 0 else None,
+                    "peak_rss_mb" : peak_rss
+                }
+                results.append(result)
+                print_result(result)
+
+    return results
+
+
+def measure_startup(runs: int = STARTUP_RUNS) -> dict:
+    """
+    Imports PortfolioBuilder in runs fresh interpreters (cold start of the CLI)
+
+    Returns {"import_sec" : best import time, "modules" : LAZY_MODULES imported at startup}
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    script = STARTUP_SCRIPT % (LAZY_MODULES,)
+
+    best = None
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], cwd=module_dir, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result["import_sec"] < best["import_sec"]:
+            best = result
+    return best
+
+
+def check_startup(startup: dict, budget: float = IMPORT_BUDGET_SEC) -> list:
+    """
+    Returns the startup budget violations (empty list when within budget)
+    """
+    violations = []
+    if startup["import_sec"] > budget:
+        violations.append(f"import PortfolioBuilder took {startup['import_sec']:.3f} sec (budget: {budget:.3f} sec)")
+    for module in startup["modules"]:
+        violations.append(f"'{module}' is imported at startup (must be imported on first use)")
+    return violations
+
+
+def print_startup(startup: dict, violations: list) -> None:
+    """ Prints the startup measurement and its budget violations """
+    print("\n~~~ Startup ~~~")
+    print(f"import PortfolioBuilder : {startup['import_sec']:.3f} sec")
+    if not violations:
+        print("Within the import-time budget")
+    for violation in violations:
+        print(f"OVER BUDGET : {violation}")
+
+
+def get_case_key(result: dict) -> tuple:
+    """ Identifies a case across runs """
+    return result["assets"], result["periods"], result["samples"], result["workers"]
+
+
+def find_regressions(results: list, baseline: list, tolerance: float = TOLERANCE) -> list:
+    """
+    Compares the stage runtimes of results with the matching cases of baseline
+
+    A stage regresses when it is slower than the baseline by more than tolerance
+    (relative) and MIN_REGRESSION_SEC (absolute, ignores timer noise on tiny stages)
+
+    Returns a list of (case key, stage, baseline sec, current sec)
+    """
+    baseline_cases = {get_case_key(result) : result for result in baseline}
+
+    regressions = []
+    for result in results:
+        key = get_case_key(result)
+        if key not in baseline_cases:
+            continue
+        base_stages = baseline_cases[key]["stages"]
+        for stage in STAGES:
+            if stage not in base_stages:
+                continue
+            base, current = base_stages[stage], result["stages"][stage]
+            if current > base * (1 + tolerance) and current - base > MIN_REGRESSION_SEC:
+                regressions.append((key, stage, base, current))
+
+    return regressions
+
+
+def print_result(result: dict) -> None:
+    """ Prints the runtimes of one case """
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+    print(f"\n~~~ {result['assets']} assets x {result['periods']} periods : {result['samples']:_} portfolios ({result['workers']} worker(s)) ~~~")
+    for stage in STAGES:
+        print(f"{stage:<28} {result['stages'][stage]:>10.4f} sec")
+    print(f"{'TOTAL':<28} {result['total']:>10.4f} sec")
+    if result["throughput"] is not None:
+        print(f"Throughput : {result['throughput']:,.0f} portfolios/sec (end to end: {result['end_to_end_throughput']:,.0f})")
+    print(f"Peak RSS   : {rss}")
+
+
+def print_regressions(regressions: list) -> None:
+    """ Prints the regressions found by find_regressions() """
+    if not regressions:
+        print("\nNo regression against the baseline")
+        return
+
+    print("\n~~~ REGRESSIONS ~~~")
+    for (assets, periods, samples, workers), stage, base, current in regressions:
+        print(f"{assets} assets x {periods} periods, {samples:_} portfolios, {workers} worker(s) : "
+              f"{stage} {base:.4f} sec -> {current:.4f} sec (+{(current / base - 1) * 100 if base > 0 else float('inf'):.0f}%)")
+
+
+def get_metadata(args: dict) -> dict:
+    """ Describes the machine and software the benchmark ran on """
+    return {
+        "date"     : time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python"   : platform.python_version(),
+        "numpy"    : np.__version__,
+        "pandas"   : pd.__version__,
+        "platform" : platform.platform(),
+        "cpu_count" : os.cpu_count(),
+        "args"     : args
+    }
+
+
+def parse_int_list(flag: str, value: str) -> list:
+    """ "10_000,100_000" -> [10000, 100000] """
+    try:
+        values = [int(v.replace("_", "")) for v in value.split(",") if v]
+    except ValueError:
+        values = []
+    if not values or min(values) <= 0:
+        print(f"ERROR : Flag '{flag}' must be followed by positive integers separated by commas\n")
+        print(USAGE)
+        exit(1)
+    return values
+
+
+def get_args() -> dict:
+    """
+    Obtains the benchmark settings from the command line
+    """
+    args = {
+        "assets"    : ASSET_COUNTS,
+        "samples"   : SAMPLE_SIZES,
+        "periods"   : NUM_PERIODS,
+        "workers"   : 1,
+        "seed"      : 0,
+        "repeat"    : 1,
+        "output"    : OUTPUT_FILE,
+        "baseline"  : None,
+        "tolerance" : TOLERANCE,
+        "import_budget" : IMPORT_BUDGET_SEC,
+        "startup_only"  : False
+    }
+
+    flags = sys.argv[1:]
+    i = 0
+    while i < len(flags):
+        flag = flags[i]
+        if flag == "--startup-only":
+            args["startup_only"] = True
+            i += 1
+            continue
+        if i + 1 >= len(flags):
+            print(f"ERROR : Flag '{flag}' must be followed by a value\n")
+            print(USAGE)
+            exit(1)
+        value = flags[i + 1]
+
+        if flag in ["--assets", "--samples"]:
+            args[flag[2:]] = parse_int_list(flag, value)
+        elif flag in ["--periods", "--workers", "--repeat"]:
+            args[flag[2:]] = parse_int_list(flag, value)[0]
+        elif flag == "--seed":
+            args["seed"] = int(value)
+        elif flag in ["--output", "--baseline"]:
+            args[flag[2:]] = value
+        elif flag == "--tolerance":
+            args["tolerance"] = float(value)
+        elif flag == "--import-budget":
+            args["import_budget"] = float(value)
+        else:
+            print(f"ERROR : Provided invalid flag '{flag}'\n")
+            print(USAGE)
+            exit(1)
+        i += 2
+
+    return args
+
+
+def main():
+    args = get_args()
+
+    startup = measure_startup()
+    startup_violations = check_startup(startup, args["import_budget"])
+    print_startup(startup, startup_violations)
+    if args["startup_only"]:
+        exit(1 if startup_violations else 0)
+
+    results = run_benchmark(args["assets"], args["samples"], args["periods"], args["workers"], args["seed"], args["repeat"])
+
+    with open(args["output"], "w") as f:
+        json.dump({"metadata" : get_metadata(args), "startup" : startup, "results" : results}, f, indent=4)
+    print(f"\nResults saved in {args['output']}")
+
+    regressions = []
+    if args["baseline"] is not None:
+        with open(args["baseline"], "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = find_regressions(results, baseline, args["tolerance"])
+        print_regressions(regressions)
+
+    if regressions or startup_violations:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+~~~ Cache ~~~
+
+On-disk cache of the work done by PortfolioBuilder.py between runs.
+
+Input cache:
+Parsing input.xlsx with openpyxl is a big share of the startup time.
+Once parsed (and resampled to every periodicity), the content of the workbook is
+stored in binary NPZ sidecars:
+- input_<name>_<key>.npz : Parameters and Portfolios sheets, keyed on the hash and mtime of the file
+- returns_<key>.npz      : resampled returns matrices, keyed on the content of the Asset Classes sheet only
+Repeat runs on an unchanged workbook load straight from the sidecars, whatever
+periodicity they use. When only the Parameters or Portfolios sheets change, only
+these small sheets are parsed again.
+
+Frontier cache:
+The sampled portfolios (weights, E(r), sd) are stored in frontier_<key>.npz and
+the solved efficient frontier in solved_<key>.npz, along with the covariance matrix
+they were computed from. Keys are built on the asset universe: a hash of the
+resampled returns matrix and its periodicity (get_universe_key), plus the sample 
+size, seed, mode and sampler of sampled frontiers. Workbooks sharing the same 
+tickers and returns reuse each other's frontiers, and changing the risk free rate 
+or the user portfolios reuses the frontier of the previous run. Unseeded samples
+are cached too (seed None): only --no-cache draws new portfolios.
+Frontier files are compressed (np.savez_compressed).
+
+Frontier files are evicted least recently used first once they take more than
+FRONTIER_CACHE_SIZE bytes (loading a frontier marks it as recently used).
+"""
+import os
+import json
+import hashlib
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+# Cache location (next to this module)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# Bump when the content of the cache files changes
+CACHE_VERSION = 6
+
+# Disk space taken by the frontier files before the least recently used ones are deleted
+FRONTIER_CACHE_SIZE = 2 * 1024**3
+
+# Kinds (file prefixes) of frontier files
+SAMPLED_FRONTIER = "frontier"
+SOLVED_FRONTIER  = "solved"
+FRONTIER_KINDS   = [SAMPLED_FRONTIER, SOLVED_FRONTIER]
+
+# Size of the blocks read when hashing files
+HASH_BLOCK_SIZE = 1 << 20
+
+# xlsx (Office Open XML) namespaces
+XLSX_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS  = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XLSX_PKG_NS  = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Workbook parts that change how the cells of a sheet are read (strings, date formats)
+XLSX_SHARED_PARTS = ["xl/sharedStrings.xml", "xl/styles.xml"]
+
+
+def get_file_key(file_path: str) -> str:
+    """
+    Returns a key identifying the content and mtime of file_path
+    """
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    h.update(str(os.stat(file_path).st_mtime_ns).encode())
+    h.update(str(CACHE_VERSION).encode())
+    return h.hexdigest()[:32]
+
+
+def get_sheet_key(file_path: str, sheet_name: str) -> str:
+    """
+    Returns a key identifying the content of a single sheet of an xlsx file
+
+    The key is built from the CRC32 and size of the sheet's XML part (and of the
+    shared strings and styles parts) stored in the zip directory, so nothing is
+    decompressed. Falls back to get_file_key() if the sheet cannot be located.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as z:
+            workbook = ET.fromstring(z.read("xl/workbook.xml"))
+            rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+
+            rel_id = None
+            for sheet in workbook.iter(f"{XLSX_MAIN_NS}sheet"):
+                if sheet.get("name") == sheet_name:
+                    rel_id = sheet.get(f"{XLSX_REL_NS}id")
+
+            target = None
+            for rel in rels.iter(f"{XLSX_PKG_NS}Relationship"):
+                if rel.get("Id") == rel_id:
+                    target = rel.get("Target")
+
+            if target is None:
+                return get_file_key(file_path)
+            if target.startswith("/"):
+                part = target.lstrip("/")
+            else:
+                part = posixpath.normpath(posixpath.join("xl", target))
+
+            h = hashlib.sha256()
+            h.update(sheet_name.encode())
+            for name in [part] + XLSX_SHARED_PARTS:
+                try:
+                    info = z.getinfo(name)
+                except KeyError:
+                    continue
+                h.update(f"{name}:{info.CRC}:{info.file_size};".encode())
+            h.update(str(CACHE_VERSION).encode())
+            return h.hexdigest()[:32]
+    except (zipfile.BadZipFile, KeyError, ET.ParseError):
+        return get_file_key(file_path)
+
+
+def get_array_key(*parts) -> str:
+    """
+    Returns a key identifying the provided arrays and values
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(np.ascontiguousarray(part).tobytes())
+            h.update(str(part.shape).encode())
+        else:
+            h.update(repr(part).encode())
+        h.update(b";")
+    h.update(str(CACHE_VERSION).encode())
+    return h.hexdigest()[:32]
+
+
+def get_cache_path(prefix: str, key: str) -> str:
+    """
+    Returns the path of the cache file of the given kind (prefix) and key
+    """
+    return os.path.join(CACHE_DIR, f"{prefix}_{key}.npz")
+
+
+def get_input_cache_path(file_path: str) -> str:
+    """
+    Returns the path of the sidecar of the input file_path
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return get_cache_path(f"input_{name}", get_file_key(file_path))
+
+
+def save_arrays(path: str, arrays: dict, compress: bool = False) -> None:
+    """
+    Writes arrays into the NPZ file at path (deflated when compress is True)
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Unique per process: batch jobs may write the same (shared) returns file concurrently
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    (np.savez_compressed if compress else np.savez)(tmp_path, **arrays)
+    # Atomic replace: a crash never leaves a half written cache file
+    os.replace(tmp_path, path)
+
+
+def df_to_json(df: pd.DataFrame) -> str:
+    """
+    Serializes a small DataFrame (Parameters, Portfolios sheets) as JSON
+    """
+    data = df.astype(object).where(df.notna(), None).values.tolist()
+    return json.dumps({"columns" : [str(c) for c in df.columns], "data" : data}, default=str)
+
+
+def json_to_df(string: str) -> pd.DataFrame:
+    """
+    Inverse of df_to_json()
+    """
+    content = json.loads(string)
+    df = pd.DataFrame(content["data"], columns=content["columns"])
+    return df.infer_objects()
+
+
+def save_returns(key: str, returns: dict) -> None:
+    """
+    Stores {resample period : resampled returns matrix (DatetimeIndex x tickers)}
+    """
+    arrays = {"periods" : np.array(list(returns))}
+    for period, df in returns.items():
+        arrays[f"values_{period}"]  = df.to_numpy(dtype=np.float64)
+        arrays[f"dates_{period}"]   = df.index.to_numpy(dtype="datetime64[ns]")
+        arrays[f"tickers_{period}"] = np.array([str(c) for c in df.columns])
+
+    save_arrays(get_cache_path("returns", key), arrays)
+
+
+def load_returns(key: str):
+    """
+    Loads the returns matrices stored by save_returns()
+    Returns None if they are not cached
+    """
+    path = get_cache_path("returns", key)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as cached:
+            returns = {}
+            for period in cached["periods"]:
+                period = str(period)
+                returns[period] = pd.DataFrame(cached[f"values_{period}"], index=pd.DatetimeIndex(cached[f"dates_{period}"]),
+                                               columns=[str(t) for t in cached[f"tickers_{period}"]])
+    except (OSError, ValueError, KeyError):
+        # Corrupted or outdated cache file
+        return None
+
+    return returns
+
+
+def save_input(file_path: str, returns_key: str, returns: dict, parameters: tuple, portfolios: pd.DataFrame) -> None:
+    """
+    Stores the parsed content of the input file_path:
+    - returns    : {resample period : resampled returns matrix (DatetimeIndex x tickers)}
+                   stored under returns_key (see get_sheet_key)
+    - parameters : (risk_free_rate, available_rate, periodicity, sampler, risk_measure, target)
+    - portfolios : Portfolios sheet
+    """
+    path = get_input_cache_path(file_path)
+
+    # Remove the sidecars of previous versions of the same file
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    prefix = os.path.basename(path).rsplit("_", 1)[0] + "_"
+    for name in os.listdir(CACHE_DIR):
+        old_path = os.path.join(CACHE_DIR, name)
+        if name.startswith(prefix) and name.endswith(".npz") and old_path != path:
+            os.remove(old_path)
+
+    if not os.path.exists(get_cache_path("returns", returns_key)):
+        save_returns(returns_key, returns)
+
+    save_arrays(path, {
+        "returns_key" : np.array(returns_key),
+        "parameters"  : np.array(json.dumps(list(parameters), default=str)),
+        "portfolios"  : np.array(df_to_json(portfolios))
+    })
+
+
+def load_input(file_path: str):
+    """
+    Loads the content of the input file_path stored by save_input()
+
+    Returns (returns, parameters, portfolios) or None if the file is not cached
+    """
+    path = get_input_cache_path(file_path)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as cached:
+            returns_key = str(cached["returns_key"])
+            parameters = tuple(json.loads(str(cached["parameters"])))
+            portfolios = json_to_df(str(cached["portfolios"]))
+    except (OSError, ValueError, KeyError):
+        # Corrupted or outdated cache file, parse the input again
+        return None
+
+    returns = load_returns(returns_key)
+    if returns is None:
+        return None
+
+    return returns, parameters, portfolios
+
+
+def get_universe_key(returns: pd.DataFrame, period: str) -> str:
+    """
+    Returns the key of an asset universe: hash of the resampled returns matrix
+    (dates x tickers) and of its periodicity
+    """
+    return get_array_key([str(c) for c in returns.columns], returns.index.to_numpy(dtype="datetime64[ns]"),
+                         returns.to_numpy(dtype=np.float64), str(period))
+
+
+def get_frontier_key(universe_key: str, *parameters) -> str:
+    """
+    Returns the key of a frontier computed on the universe universe_key
+    with the given parameters (sample size, seed, mode...)
+    """
+    return get_array_key(universe_key, *parameters)
+
+
+def save_frontier(key: str, batch: dict, cov_matrix: np.ndarray, kind: str = SAMPLED_FRONTIER, max_size: int = FRONTIER_CACHE_SIZE) -> None:
+    """
+    Stores a frontier {"Weights" : ..., "E(r)" : ..., "sd" : ...} and the covariance
+    matrix it was computed from, then evicts the least recently used frontiers
+    beyond max_size bytes
+    """
+    path = get_cache_path(kind, key)
+    save_arrays(path, {
+        "weights" : batch["Weights"],
+        "Er"      : batch["E(r)"],
+        "sd"      : batch["sd"],
+        "cov"     : cov_matrix
+    }, compress=True)
+    evict_frontiers(max_size, keep=path)
+
+
+def load_frontier(key: str, cov_matrix: np.ndarray = None, kind: str = SAMPLED_FRONTIER):
+    """
+    Loads a frontier stored by save_frontier() and marks it as recently used
+
+    Returns None if it is not cached, or if it was computed from another
+    covariance matrix than cov_matrix (when provided)
+    """
+    path = get_cache_path(kind, key)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as cached:
+            if cov_matrix is not None and not np.array_equal(cached["cov"], cov_matrix):
+                return None
+            batch = {
+                "Weights" : cached["weights"],
+                "E(r)"    : cached["Er"],
+                "sd"      : cached["sd"]
+            }
+        # Recency of the LRU eviction
+        os.utime(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return batch
+
+
+def get_frontier_files() -> list:
+    """
+    Returns the (path, size, last use) of every frontier file, least recently used first
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return []
+
+    files = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".npz") and name.split("_", 1)[0] in FRONTIER_KINDS:
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue # evicted by another process
+            files.append((path, stat.st_size, stat.st_mtime_ns))
+
+    return sorted(files, key=lambda f: f[2])
+
+
+def evict_frontiers(max_size: int = FRONTIER_CACHE_SIZE, keep: str = None) -> list:
+    """
+    Deletes the least recently used frontier files until they take at most
+    max_size bytes. The file at keep (just written) is never deleted.
+
+    Returns the paths of the deleted files
+    """
+    files = get_frontier_files()
+    total = sum(size for _, size, _ in files)
+
+    evicted = []
+    for path, size, _ in files:
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass # evicted by another process
+        total -= size
+        evicted.append(path)
+
+    return evicted
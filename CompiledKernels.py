@@ -0,0 +1,107 @@
+"""
+~~~ Compiled Kernels ~~~
+
+Numba versions of the kernels of Kernels.py. Only imported by Kernels.get_kernels()
+(Numba is an optional dependency): use the functions of Kernels.py instead.
+
+Compiled functions are cached on disk by Numba (__pycache__), only the first run
+pays for the compilation. The threading layer is selected by Kernels.get_kernels().
+"""
+import numba
+import numpy as np
+
+
+@numba.njit(inline="always", cache=True)
+def mix_scalar(x):
+    """ splitmix64 finalizer (see Kernels.mix) """
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+@numba.njit(inline="always", cache=True)
+def uniform_scalar(key, counter):
+    """ Uniform in (0, 1) of the counter-based generator (see Kernels.get_uniforms) """
+    bits = mix_scalar(key ^ mix_scalar(counter))
+    return (np.float64(bits >> np.uint64(11)) + 0.5) * 2.0**-53
+
+
+@numba.njit(parallel=True, cache=True)
+def find_best_sharpe(er_vector, cov_matrix, rf, start, stop, key, sampler_code, directions, shift, block_size):
+    """
+    Fused sampling, scoring and reduction over the portfolios at positions [start, stop),
+    one parallel block of block_size rows at a time (see Kernels.find_best_sharpe)
+
+    Returns (best Sharpe ratio, position of the best portfolio)
+    """
+    n = er_vector.shape[0]
+    stride = np.uint64(2 * n + 1)
+    num_blocks = (stop - start + block_size - 1) // block_size
+    block_sharpe = np.full(num_blocks, -1.0)
+    block_row = np.full(num_blocks, -1, dtype=np.int64)
+
+    for b in numba.prange(num_blocks):
+        w = np.empty(n)
+        keys = np.empty(n)
+        first = start + b * block_size
+        last = min(first + block_size, stop)
+        for row in range(first, last):
+            base = np.uint64(row) * stride
+
+            if sampler_code == 3:
+                # Sobol point of the row (Gray code)
+                gray = np.uint64(row) ^ (np.uint64(row) >> np.uint64(1))
+                for j in range(n):
+                    x = shift[j]
+                    for bit in range(directions.shape[1]):
+                        if (gray >> np.uint64(bit)) & np.uint64(1):
+                            x ^= directions[j, bit]
+                    w[j] = -np.log((np.float64(x) + 0.5) / 2.0**32)
+            else:
+                for j in range(n):
+                    u = uniform_scalar(key, base + np.uint64(j))
+                    w[j] = u if sampler_code == 0 else -np.log(u)
+                if sampler_code == 2:
+                    k = min(np.int64(uniform_scalar(key, base + np.uint64(n)) * n), n - 1)
+                    for j in range(n):
+                        keys[j] = uniform_scalar(key, base + np.uint64(n + 1 + j))
+                    for j in range(n):
+                        # rank of key j among the keys (keys are distinct)
+                        rank = 0
+                        for m in range(n):
+                            if keys[m] < keys[j]:
+                                rank += 1
+                        if rank > k:
+                            w[j] = 0.0
+
+            total = 0.0
+            for j in range(n):
+                total += w[j]
+            scale = 100.0 / total
+            Er = 0.0
+            for j in range(n):
+                w[j] *= scale
+                Er += w[j] * er_vector[j]
+
+            variance = 0.0
+            for j in range(n):
+                if w[j] == 0.0:
+                    continue
+                partial = 0.0
+                for m in range(n):
+                    partial += cov_matrix[j, m] * w[m]
+                variance += w[j] * partial
+            sd = np.sqrt(max(variance, 0.0))
+            sharpe = max(0.0, (Er - rf) / sd) if sd > 0 else 0.0
+
+            if sharpe > block_sharpe[b]:
+                block_sharpe[b] = sharpe
+                block_row[b] = row
+
+    # First block wins on ties: same result as a sequential scan
+    best = 0
+    for b in range(1, num_blocks):
+        if block_sharpe[b] > block_sharpe[best]:
+            best = b
+    return block_sharpe[best], block_row[best]
@@ -0,0 +1,106 @@
+"""
+~~~ Downside Risk ~~~
+
+Target downside deviation as the measure of risk (instead of sd), selected with
+the 'Risk Measure' row of the Parameters sheet:
+- SD             : standard deviation (default)
+- DOWNSIDE       : downside deviation approximated with the co-semivariance matrix
+- DOWNSIDE_EXACT : exact downside deviation of the portfolio return series
+
+The downside deviation of a portfolio only counts its returns below a target B
+(the 'Target Return' row, the risk free rate by default):
+    DD = sqrt( mean( min(r_p(t) - B, 0)² ) )
+Unlike the variance, it is not a quadratic form of the weights. The co-semivariance
+matrix (Estrada)
+    S(i,j) = mean( min(r_i(t) - B, 0) * min(r_j(t) - B, 0) )
+gives the approximation DD² ≈ w S wᵀ. S replaces the covariance matrix of the
+AssetUniverse, so every optimizer (sampling, pruning, streaming, best-only and
+FrontierSolver) works on downside risk unchanged and at the same speed.
+
+The exact mode computes the return series of every portfolio as one
+(dates x n) @ (n x portfolios) product, in chunks of EXACT_CHUNK_ELEMENTS values
+so the (dates x portfolios) temporaries stay bounded whatever the number of
+portfolios (1M portfolios on 700 periods: a few seconds).
+
+Missing returns count as 0 (same as Backtest.py). Downside deviations are
+annualized (square root of time rule) and in %, like the sd of the rest of the program.
+"""
+import PortfolioBuilderObjects as obj
+import numpy as np
+import pandas as pd
+
+# Risk measures (Parameters sheet)
+SD             = "sd"
+DOWNSIDE       = "downside"
+DOWNSIDE_EXACT = "downside exact"
+RISK_MEASURES  = [SD, DOWNSIDE, DOWNSIDE_EXACT]
+
+DEFAULT_RISK_MEASURE = SD
+
+# (dates x portfolios) values computed at once by compute_batch_downside
+EXACT_CHUNK_ELEMENTS = 4_000_000
+
+
+def get_risk_measure(name: str) -> str:
+    """
+    Validates a risk measure name (case insensitive, '_' and '-' read as spaces)
+    Returns the risk measure or None if it is unknown
+    """
+    name = " ".join(str(name).strip().lower().replace("_", " ").replace("-", " ").split())
+    return name if name in RISK_MEASURES else None
+
+
+def get_period_target(target: float, period: str) -> float:
+    """
+    Converts an annual target return in % into the target return of a period in decimal
+    """
+    m = obj.get_num_periods_in_year(period)
+    return (1 + target / 100) ** (1 / m) - 1
+
+
+def get_returns_matrix(returns: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the (dates x tickers) returns as a float64 array, missing returns -> 0
+    """
+    values = returns.to_numpy(dtype=np.float64)
+    return np.where(np.isnan(values), 0.0, values)
+
+
+def get_cosemivariance_matrix(returns: pd.DataFrame, target: float, period: str) -> np.ndarray:
+    """
+    Annualized co-semivariance matrix of returns (dates x tickers, decimal) below
+    the annual target (in %). Same units as AssetUniverse.cov_matrix
+    """
+    values = get_returns_matrix(returns)
+    shortfall = np.minimum(values - get_period_target(target, period), 0)
+    return (shortfall.T @ shortfall) / max(len(values), 1) * obj.get_num_periods_in_year(period)
+
+
+def compute_batch_downside(weights: np.ndarray, returns: pd.DataFrame, target: float, period: str, out: np.ndarray = None) -> np.ndarray:
+    """
+    Exact downside deviation (in %) of many portfolios at once
+
+    weights : (portfolios x tickers) or (tickers,) weights in %
+    returns : (dates x tickers) period returns in decimal (columns in the order of the weights)
+    target  : annual target return in %
+    """
+    weights = np.atleast_2d(weights)
+    if weights.shape[1] != returns.shape[1]:
+        raise ValueError(f"Weights of {weights.shape[1]} asset classes for returns of {returns.shape[1]} asset classes")
+
+    values = get_returns_matrix(returns)
+    num_dates = max(len(values), 1)
+    period_target = get_period_target(target, period)
+    scale = obj.get_num_periods_in_year(period) / num_dates
+
+    if out is None:
+        out = np.empty(weights.shape[0])
+    chunk = max(1, EXACT_CHUNK_ELEMENTS // num_dates)
+    for start in range(0, weights.shape[0], chunk):
+        stop = min(start + chunk, weights.shape[0])
+        # Return series of the portfolios (dates x chunk), weights in % -> decimal
+        shortfall = values @ (weights[start:stop].T / 100)
+        shortfall -= period_target
+        np.minimum(shortfall, 0, out=shortfall)
+        out[start:stop] = np.sqrt(np.einsum("ij,ij->j", shortfall, shortfall) * scale) * 100
+    return out
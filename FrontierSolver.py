@@ -0,0 +1,215 @@
+"""
+~~~ Frontier Solver ~~~
+
+Deterministic alternative to the Monte Carlo sampling of PortfolioBuilder.py.
+
+Computes the exact (long-only) tangency portfolio and a parametric efficient
+frontier from the AssetClass E(r)/sd and the correlation matrix, by solving the
+mean-variance quadratic programs with a small active-set method:
+
+    minimize    ½ xᵀΣx
+    subject to  A x = b
+                x >= 0   (no short selling)
+
+Solver weights are fractions internally (sum to 1), they are returned in %
+(sum to 100) like every other composition of the program.
+"""
+import PortfolioBuilderObjects as obj
+import TimeTracker
+import numpy as np
+
+# Numerical tolerance of the active-set method
+TOL = 1e-12
+
+# Default number of points on the parametric frontier
+FRONTIER_POINTS = 100
+
+
+def get_nearest_psd(cov_matrix: np.ndarray) -> np.ndarray:
+    """
+    Returns cov_matrix with negative eigenvalues clipped to 0.
+
+    Correlations computed on pairwise complete observations (assets with
+    different history lengths) are not always positive semi-definite, which
+    would make the quadratic programs non convex.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(cov_matrix)
+    if eigenvalues.min() >= 0:
+        return cov_matrix
+    eigenvalues = np.maximum(eigenvalues, 0)
+    return (eigenvectors * eigenvalues) @ eigenvectors.T
+
+
+def solve_long_only_qp(G: np.ndarray, A: np.ndarray, b: np.ndarray, x0: np.ndarray, max_iter: int = 500) -> np.ndarray:
+    """
+    Primal active-set method for:
+        minimize ½ xᵀGx  subject to  A x = b,  x >= 0
+
+    x0 must be feasible. The working set starts with the bounds that are active at x0.
+    """
+    n = len(x0)
+    m = A.shape[0]
+    x = x0.astype(float).copy()
+    free = x > TOL
+
+    for _ in range(max_iter):
+        F = np.flatnonzero(free)
+        k = len(F)
+
+        # Equality constrained sub-problem on the free variables:
+        # G_FF x_F - A_Fᵀ λ = 0
+        # A_F x_F          = b
+        K = np.zeros((k + m, k + m))
+        K[:k, :k] = G[np.ix_(F, F)]
+        K[:k, k:] = -A[:, F].T
+        K[k:, :k] = A[:, F]
+        rhs = np.concatenate([np.zeros(k), b])
+        solution = np.linalg.lstsq(K, rhs, rcond=None)[0]
+        lam = solution[k:]
+
+        step = np.zeros(n)
+        step[F] = solution[:k] - x[F]
+
+        if np.abs(step).max() <= 1e-10:
+            # Lagrange multipliers of the active bounds
+            multipliers = G @ x - A.T @ lam
+            multipliers[F] = 0
+            i = int(np.argmin(multipliers))
+            if multipliers[i] >= -1e-10:
+                break
+            free[i] = True
+            continue
+
+        # Longest feasible step along the direction
+        alpha = 1.0
+        blocking = None
+        for i in F:
+            if step[i] < 0:
+                ratio = -x[i] / step[i]
+                if ratio < alpha:
+                    alpha = ratio
+                    blocking = i
+
+        x += alpha * step
+        if blocking is not None:
+            x[blocking] = 0
+            free[blocking] = False
+
+    x[x < 0] = 0
+    return x
+
+
+def solve_min_variance(cov_matrix: np.ndarray) -> np.ndarray:
+    """
+    Returns the weights (fractions) of the long-only global minimum variance portfolio
+    """
+    n = len(cov_matrix)
+    A = np.ones((1, n))
+    b = np.ones(1)
+    x0 = np.full(n, 1 / n)
+    return solve_long_only_qp(cov_matrix, A, b, x0)
+
+
+def solve_tangency(er_vector: np.ndarray, cov_matrix: np.ndarray, rf: float) -> np.ndarray:
+    """
+    Returns the weights (fractions) of the long-only tangency portfolio (max Sharpe ratio)
+
+    rf is the risk free rate in % (same as the Parameters sheet)
+
+    With z = x / (excessᵀx) the problem becomes convex:
+        minimize ½ zᵀΣz  subject to  excessᵀz = 1,  z >= 0
+    and x = z / Σz
+
+    If no asset class has an E(r) above rf, every Sharpe ratio is 0 and the
+    global minimum variance portfolio is returned instead.
+    """
+    excess = er_vector - rf / 100
+
+    if excess.max() <= 0:
+        return solve_min_variance(cov_matrix)
+
+    best = int(np.argmax(excess))
+    z0 = np.zeros(len(er_vector))
+    z0[best] = 1 / excess[best]
+
+    z = solve_long_only_qp(cov_matrix, excess.reshape(1, -1), np.ones(1), z0)
+    return z / z.sum()
+
+
+def solve_target_return(er_vector: np.ndarray, cov_matrix: np.ndarray, target: float, x_min_var: np.ndarray) -> np.ndarray:
+    """
+    Returns the weights (fractions) of the long-only portfolio with the lowest
+    variance for an E(r) of target (same unit as er_vector)
+
+    target must lie between the E(r) of the minimum variance portfolio (x_min_var)
+    and the highest E(r) of the asset classes
+    """
+    n = len(er_vector)
+    best = int(np.argmax(er_vector))
+    er_min_var = er_vector @ x_min_var
+
+    # Feasible start: mix of the min variance portfolio and the best asset class
+    theta = 0.0
+    if er_vector[best] > er_min_var:
+        theta = (target - er_min_var) / (er_vector[best] - er_min_var)
+    theta = min(max(theta, 0.0), 1.0)
+    x0 = (1 - theta) * x_min_var
+    x0[best] += theta
+
+    A = np.vstack([np.ones(n), er_vector])
+    b = np.array([1.0, target])
+    return solve_long_only_qp(cov_matrix, A, b, x0)
+
+
+def solve_frontier_weights(er_vector: np.ndarray, cov_matrix: np.ndarray, num_points: int = FRONTIER_POINTS) -> np.ndarray:
+    """
+    Returns a (num_points x n) matrix of efficient portfolio weights (fractions),
+    from the minimum variance portfolio to the highest E(r) asset class
+    """
+    x_min_var = solve_min_variance(cov_matrix)
+    targets = np.linspace(er_vector @ x_min_var, er_vector.max(), num_points)
+
+    weights = np.empty((num_points, len(er_vector)))
+    for i, target in enumerate(targets):
+        weights[i] = solve_target_return(er_vector, cov_matrix, target, x_min_var)
+    return weights
+
+
+@TimeTracker.track
+def get_tangency_portfolio(asset_classes: list, corr_matrix: object, rf: float) -> obj.Portfolio:
+    """
+    Solves the exact optimal portfolio (max Sharpe ratio, no short selling)
+    Returns it as a Portfolio object
+    """
+    universe = obj.get_universe(asset_classes, corr_matrix)
+    cov_matrix = get_nearest_psd(universe.cov_matrix)
+
+    x = solve_tangency(universe.er_vector, cov_matrix, rf)
+
+    composition = {}
+    for asset_class, w in zip(universe, x):
+        composition[asset_class] = w * 100
+    return obj.Portfolio("Tangency Portfolio", composition, universe)
+
+
+@TimeTracker.track
+def get_frontier(asset_classes: list, corr_matrix: object, num_points: int = FRONTIER_POINTS) -> obj.PortfolioSet:
+    """
+    Solves num_points portfolios of the long-only efficient frontier
+    Returns them as a PortfolioSet (ordered by increasing E(r))
+
+    With the exact downside risk measure, the frontier is solved on the
+    co-semivariance approximation and "sd" holds the exact downside deviations
+    """
+    universe = obj.get_universe(asset_classes, corr_matrix)
+    er_vector = universe.er_vector
+    cov_matrix = get_nearest_psd(universe.cov_matrix)
+
+    weights = solve_frontier_weights(er_vector, cov_matrix, num_points) * 100
+    Er = weights @ er_vector
+    if universe.is_exact_downside():
+        sd = universe.compute_exact_risk(weights)
+    else:
+        sd = np.sqrt(np.maximum(np.einsum("ij,ij->i", weights @ cov_matrix, weights), 0))
+
+    return obj.PortfolioSet(universe, corr_matrix, weights, Er, sd)
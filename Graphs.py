@@ -1,41 +1,149 @@
 import PortfolioBuilderObjects as obj
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 
+# Rendering modes of the portfolios cloud (get_scatter_plot)
+SVG     = "svg"     # one SVG marker per portfolio
+WEBGL   = "webgl"   # one WebGL marker per portfolio
+DENSITY = "density" # 2D histogram computed here, drawn as a heatmap
+AUTO    = "auto"    # picks one of the above from the number of portfolios
 
+# Thresholds (number of portfolios) of the AUTO mode
+SVG_MAX_POINTS   = 5_000
+WEBGL_MAX_POINTS = 100_000
 
-def get_scatter_plot(df: pd.DataFrame, title = "Scatter Plot"):
+# Resolution of the DENSITY mode (sd bins, E(r) bins)
+DENSITY_BINS = (500, 400)
+
+LABELS = {
+    "sd" : "Standard Deviation",
+    "E(r)" : "Expected Return"
+}
+
+
+def get_render_mode(num_points: int, render_mode: str = AUTO) -> str:
+    """
+    Returns the rendering mode used for a cloud of num_points portfolios
+    """
+    if render_mode != AUTO:
+        return render_mode
+    if num_points <= SVG_MAX_POINTS:
+        return SVG
+    if num_points <= WEBGL_MAX_POINTS:
+        return WEBGL
+    return DENSITY
+
+
+def get_density_trace(sd: np.ndarray, Er: np.ndarray, bins: tuple = DENSITY_BINS):
+    """
+    Bins the portfolios on a (sd, E(r)) grid and returns a heatmap trace of the counts.
+    The size of the trace only depends on bins, not on the number of portfolios.
+    """
+    counts, sd_edges, er_edges = np.histogram2d(sd, Er, bins=bins)
+    return get_histogram_trace(counts, sd_edges, er_edges)
+
+
+def get_histogram_trace(counts: np.ndarray, sd_edges: np.ndarray, er_edges: np.ndarray):
+    """
+    Returns a heatmap trace of counts: (sd bins x E(r) bins) numbers of portfolios
+    binned on the grid defined by sd_edges and er_edges
+    """
+    # Crop the empty margins of the grid
+    rows = np.flatnonzero(counts.any(axis=1))
+    cols = np.flatnonzero(counts.any(axis=0))
+    if len(rows) > 0:
+        counts = counts[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        sd_edges = sd_edges[rows[0]:rows[-1] + 2]
+        er_edges = er_edges[cols[0]:cols[-1] + 2]
+
+    sd_centers = (sd_edges[:-1] + sd_edges[1:]) / 2
+    er_centers = (er_edges[:-1] + er_edges[1:]) / 2
+
+    # Empty bins are transparent, log scale keeps the sparse frontier edge visible
+    z = np.where(counts.T > 0, np.log10(np.maximum(counts.T, 1)) + 1, np.nan).astype(np.float32)
+
+    return go.Heatmap(x=sd_centers.astype(np.float32), y=er_centers.astype(np.float32), z=z, 
+                      colorscale="Greys", showscale=False, name="Portfolios", 
+                      customdata=counts.T.astype(np.int64), hovertemplate="sd: %{x:.2f}<br>E(r): %{y:.2f}<br>portfolios: %{customdata}<extra></extra>")
+
+
+def get_density_plot(counts: np.ndarray, sd_edges: np.ndarray, er_edges: np.ndarray, title = "Density Plot"):
+    """
+    Same figure as get_scatter_plot() in DENSITY mode, drawn from an already
+    binned cloud (e.g. the histogram of PortfolioEngine.StreamSummary)
+
+    Returns the figure object (type from Plotly)
+    """
+    figure = go.Figure(get_histogram_trace(counts, sd_edges, er_edges))
+    figure.update_layout(title=title, xaxis_title=LABELS["sd"], yaxis_title=LABELS["E(r)"])
+    figure.update_layout({'plot_bgcolor': "white"})
+    return figure
+
+
+def get_scatter_plot(df: pd.DataFrame, title = "Scatter Plot", render_mode: str = AUTO):
     """
     Given a pandas DataFrame of portfolios, creates a graph plotting them with:
-    x-axis : E(r)
-    y-axis : sd
+    x-axis : sd
+    y-axis : E(r)
+
+    render_mode (AUTO by default) controls how the portfolios are drawn:
+    - SVG     : one marker per portfolio (small clouds)
+    - WEBGL   : one WebGL marker per portfolio (Scattergl)
+    - DENSITY : 2D histogram binned here. Keeps the figure (and HTML output) 
+                small and responsive for millions of portfolios
+    Traces added afterwards (CAL, optimal and user portfolios) are regular markers.
 
-    Returns the figure object (type from Plotly Express)
+    Returns the figure object (type from Plotly)
     """
-    labels = {
-        "sd" : "Standard Deviation",
-        "E(r)" : "Expected Return"
-    }
-    figure = px.scatter(df, x="sd", y="E(r)", title=title, labels=labels,  color_discrete_sequence=["grey"], opacity=0.5)
+    render_mode = get_render_mode(len(df), render_mode)
+
+    if render_mode == SVG:
+        import plotly.express as px # slow to import, only needed for small clouds
+        figure = px.scatter(df, x="sd", y="E(r)", title=title, labels=LABELS,  color_discrete_sequence=["grey"], opacity=0.5, render_mode=SVG)
+    else:
+        sd = np.asarray(df["sd"], dtype=np.float64)
+        Er = np.asarray(df["E(r)"], dtype=np.float64)
+
+        if render_mode == WEBGL:
+            trace = go.Scattergl(x=sd.astype(np.float32), y=Er.astype(np.float32), mode="markers", name="Portfolios", 
+                                 marker=dict(color="grey", opacity=0.5))
+        elif render_mode == DENSITY:
+            trace = get_density_trace(sd, Er)
+        else:
+            raise ValueError(f"Unknown render mode '{render_mode}'")
+
+        figure = go.Figure(trace)
+        figure.update_layout(title=title, xaxis_title=LABELS["sd"], yaxis_title=LABELS["E(r)"])
+
     figure.update_layout({'plot_bgcolor': "white"})
     return figure
 
 
-def add_CAL(figure, df, rf) -> obj.Portfolio:
+def add_CAL(figure, portfolio_set: obj.PortfolioSet, rf) -> obj.Portfolio:
     """
     Plots the Capital Allocation Line onto the scatter plot provided into the figure parameter
 
+    Only the optimal row of portfolio_set is turned into a Portfolio object
+
     Returns:
     1. The updated figure (scatter plot) object
     2. The optimal portfolio as a Portfolio object
     """
-    SHARPE = "Sharpe"
-    P_OBJ  = "Portfolio Object"
     # 1. Find max Sharpe 
-    max_index = df[SHARPE].idxmax()
-    optimal_portfolio = df.loc[max_index][P_OBJ]
-    
+    max_index = portfolio_set.get_max_sharpe_index()
+    optimal_portfolio = portfolio_set.get_portfolio(max_index)
+
+    figure = draw_CAL(figure, optimal_portfolio, rf)
+
+    return figure, optimal_portfolio
+
+
+def draw_CAL(figure, optimal_portfolio: obj.Portfolio, rf):
+    """
+    Plots the Capital Allocation Line going through the provided optimal portfolio
+    Returns the updated figure
+    """
     # Highlight the optimal portfolio (max sharpe) and Risk Free point
     figure.add_trace(go.Scatter(x = [optimal_portfolio.sd], y = [optimal_portfolio.Er], mode = 'markers', name = 'Optimal Portfolio', marker = dict(size=[25], color = 'green')))
     figure.add_trace(go.Scatter(x = [0], y = [rf], mode = 'markers', name = 'Risk Free Asset', marker = dict(size=[25], color = 'lightblue')))
@@ -47,8 +155,36 @@ def add_CAL(figure, df, rf) -> obj.Portfolio:
     cal.line.width = 3      # Set line width
     figure.add_trace(cal)
 
+    return figure
+
+
+def draw_leveraged_CAL(figure, sd: np.ndarray, Er: np.ndarray):
+    """
+    Plots the part of the kinked Capital Allocation Line beyond the optimal portfolio:
+    efficient frontier up to the tangency portfolio of the borrowing rate, then
+    leverage (see Allocation.KinkedCAL.get_line, the risk free point is skipped)
+    Returns the updated figure
+    """
+    cal = go.Scatter(x = sd[1:], y = Er[1:], mode = 'lines', name = "Leveraged CAL (borrowing)")
+    cal.line.color = 'blue'
+    cal.line.width = 3
+    cal.line.dash = 'dash'
+    figure.add_trace(cal)
+
+    return figure
 
-    return figure, optimal_portfolio
+
+def add_frontier(figure, frontier_set: obj.PortfolioSet, name: str = 'Efficient Frontier'):
+    """
+    Plots the efficient frontier (PortfolioSet ordered by E(r)) as a line
+    Returns the updated figure
+    """
+    frontier = go.Scatter(x = frontier_set.sd, y = frontier_set.Er, mode = 'lines', name = name)
+    frontier.line.color = 'black'
+    frontier.line.width = 3
+    figure.add_trace(frontier)
+
+    return figure
 
 
 def add_user_portfolios(figure, portfolios):
@@ -62,9 +198,31 @@ def add_user_portfolios(figure, portfolios):
     return figure
 
 
-def save_fig_as_html(fig, file_path) -> None:
+def get_walk_forward_plot(df: pd.DataFrame, names: list, title = "Walk Forward"):
+    """
+    Given the optimal portfolios of rolling windows (see WalkForward.walk_forward), creates a graph with:
+    - the weights of the asset classes over time (stacked areas, left axis)
+    - the Sharpe ratio over time (line, right axis)
+
+    Returns the figure object (type from Plotly)
+    """
+    figure = go.Figure()
+    for name in names:
+        figure.add_trace(go.Scatter(x=df.index, y=df[name], name=name, mode="lines", stackgroup="weights"))
+    figure.add_trace(go.Scatter(x=df.index, y=df["Sharpe"], name="Sharpe", mode="lines", yaxis="y2", line=dict(color="black")))
+
+    figure.update_layout(title=title, xaxis_title="Window end", yaxis=dict(title="Weight (%)", range=[0, 100]),
+                         yaxis2=dict(title="Sharpe ratio", overlaying="y", side="right", showgrid=False))
+    figure.update_layout({'plot_bgcolor': "white"})
+    return figure
+
+
+def save_fig_as_html(fig, file_path, include_plotlyjs=True) -> None:
     """
     Saves the figure at the provided path (including the name)
+
+    include_plotlyjs is passed to Plotly: True embeds plotly.js (~4 MB) in the file,
+    "directory" writes it once next to the file and references it
     """
-    fig.write_html(file_path)
+    fig.write_html(file_path, include_plotlyjs=include_plotlyjs)
 
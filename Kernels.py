@@ -0,0 +1,215 @@
+"""
+~~~ Kernels ~~~
+
+Optional compiled (Numba) kernels of PortfolioEngine, each with a pure NumPy twin.
+
+Numba is not required: the compiled versions (CompiledKernels.py) are imported on
+first use and the NumPy versions are used when Numba is not installed (or when
+NUMBA_DISABLE_JIT=1). Compiled kernels run in parallel over the CPU cores and
+never build (rows x n) temporaries.
+
+find_best_sharpe fuses sampling, scoring and reduction: it draws the portfolios,
+computes their E(r), sd and Sharpe ratio and keeps the best one in a single pass,
+without storing any portfolio. (A stand-alone w Σ wᵀ kernel is not worth it: the
+BLAS backed einsum of PortfolioEngine.compute_batch_sd is as fast.)
+
+find_best_sharpe draws its weights from a counter-based generator: the random
+numbers of a portfolio only depend on the seed and its position in the sample.
+Both versions therefore sample the same portfolios whatever the number of
+threads, and the weights of the best one are redrawn from its position at the end.
+These portfolios differ from the ones of create_portfolio_batch_parallel for the
+same seed (different random streams), except for the Sobol sampler.
+"""
+import Samplers
+import numpy as np
+
+# Rows scored at once by the NumPy versions (bounds the temporaries)
+CHUNK_SIZE = 100_000
+
+# Rows per parallel block of the compiled find_best_sharpe
+BLOCK_SIZE = 65_536
+
+# Sampler codes used inside the kernels
+SAMPLER_CODES = {
+    Samplers.UNIFORM   : 0,
+    Samplers.DIRICHLET : 1,
+    Samplers.EDGE      : 2,
+    Samplers.SOBOL     : 3
+}
+
+# splitmix64 constants
+GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+MIX_1  = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2  = np.uint64(0x94D049BB133111EB)
+UNIT   = 2.0**-53
+
+# CompiledKernels module, loaded by get_kernels() (False: Numba is not available)
+_kernels = None
+
+
+def get_stride(n: int) -> int:
+    """ Random numbers drawn per portfolio: n weights, 1 number of asset classes, n keys (EDGE) """
+    return 2 * n + 1
+
+
+def get_key(seed=None) -> np.uint64:
+    """ Returns the key of the counter-based generator for seed (random if None) """
+    return np.random.SeedSequence(seed).generate_state(1, dtype=np.uint64)[0]
+
+
+def mix(x: np.ndarray) -> np.ndarray:
+    """ splitmix64 finalizer: uint64 -> well mixed uint64 (vectorized) """
+    x = x + GOLDEN
+    x = (x ^ (x >> np.uint64(30))) * MIX_1
+    x = (x ^ (x >> np.uint64(27))) * MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+def get_uniforms(key: np.uint64, rows: np.ndarray, columns: int, n: int) -> np.ndarray:
+    """
+    Returns the (len(rows) x columns) uniforms in (0, 1) of the counter-based
+    generator for the portfolios at positions rows
+    """
+    counters = rows.astype(np.uint64)[:, None] * np.uint64(get_stride(n)) + np.arange(columns, dtype=np.uint64)
+    bits = mix(key ^ mix(counters))
+    return ((bits >> np.uint64(11)).astype(np.float64) + 0.5) * UNIT
+
+
+def get_counter_weights(key: np.uint64, rows: np.ndarray, n: int, sampler: str, sobol: tuple = None) -> np.ndarray:
+    """
+    NumPy version of the weights drawn by the compiled find_best_sharpe:
+    (len(rows) x n) weights in % of the portfolios at positions rows
+    """
+    if sampler == Samplers.SOBOL:
+        directions, shift = sobol
+        points = get_sobol_rows(rows, directions, shift)
+        weights = -np.log(points)
+    else:
+        u = get_uniforms(key, rows, get_stride(n), n)
+        if sampler == Samplers.UNIFORM:
+            weights = u[:, :n]
+        else:
+            weights = -np.log(u[:, :n])
+        if sampler == Samplers.EDGE:
+            # Keep the k asset classes with the smallest keys, k uniform in 1..n
+            k = np.minimum((u[:, n] * n).astype(np.int64), n - 1)
+            keys = u[:, n + 1:]
+            thresholds = np.take_along_axis(np.sort(keys, axis=1), k[:, None], axis=1)
+            weights *= keys <= thresholds
+
+    weights *= 100 / weights.sum(axis=1, keepdims=True)
+    return weights
+
+
+def get_sobol_rows(rows: np.ndarray, directions: np.ndarray, shift: np.ndarray) -> np.ndarray:
+    """ Sobol points at positions rows (Gray code order, see Samplers.get_sobol_points) """
+    gray = rows.astype(np.uint64)
+    gray = gray ^ (gray >> np.uint64(1))
+    points = np.tile(shift, (len(rows), 1))
+    for j in range(directions.shape[1]):
+        has_bit = ((gray >> np.uint64(j)) & np.uint64(1)).astype(bool)
+        points[has_bit] ^= directions[:, j]
+    return (points.astype(np.float64) + 0.5) / 2.0**Samplers.SOBOL_BITS
+
+
+def get_sobol_state(n: int, seed=None) -> tuple:
+    """ Scrambled direction numbers and shift of the Sobol sampler for seed """
+    rng = np.random.default_rng(np.random.SeedSequence(np.random.SeedSequence(seed).entropy))
+    directions, shift = Samplers.get_scrambled_directions(n, rng)
+    return directions.astype(np.uint64), shift.astype(np.uint64)
+
+
+def _find_best_sharpe_numpy(er_vector: np.ndarray, cov_matrix: np.ndarray, rf: float, start: int, stop: int, key: np.uint64,
+                            sampler: str, sobol: tuple = None) -> tuple:
+    """ NumPy version of the fused search: returns (best Sharpe ratio, position) over [start, stop) """
+    n = len(er_vector)
+    best_sharpe, best_row = -1.0, -1
+    for chunk_start in range(start, stop, CHUNK_SIZE):
+        rows = np.arange(chunk_start, min(chunk_start + CHUNK_SIZE, stop))
+        w = get_counter_weights(key, rows, n, sampler, sobol)
+        Er = w @ er_vector
+        variance = np.einsum("ij,ij->i", w @ cov_matrix, w)
+        sd = np.sqrt(np.maximum(variance, 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sharpe = np.where(sd > 0, np.maximum(0, (Er - rf) / sd), 0)
+        i = int(np.argmax(sharpe))
+        if sharpe[i] > best_sharpe:
+            best_sharpe, best_row = float(sharpe[i]), int(rows[i])
+    return best_sharpe, best_row
+
+
+def get_kernels():
+    """
+    Returns the CompiledKernels module, or None when Numba is not available
+    (not installed, or disabled with NUMBA_DISABLE_JIT=1)
+
+    Selects the threading layer of Numba before the first kernel is compiled:
+    the process pools of the program fork, and a process forking after a parallel
+    kernel ran on the default TBB layer hangs at exit. The workqueue layer is used
+    unless NUMBA_THREADING_LAYER sets another one.
+    """
+    global _kernels
+    if _kernels is None:
+        try:
+            import CompiledKernels
+        except ImportError:
+            CompiledKernels = None
+
+        if CompiledKernels is None or CompiledKernels.numba.config.DISABLE_JIT:
+            _kernels = False
+        else:
+            if CompiledKernels.numba.config.THREADING_LAYER == "default":
+                CompiledKernels.numba.config.THREADING_LAYER = "workqueue"
+            _kernels = CompiledKernels
+
+    return _kernels or None
+
+
+def is_available() -> bool:
+    """ True when the compiled kernels are used """
+    return get_kernels() is not None
+
+
+def set_num_threads(threads: int) -> None:
+    """
+    Limits the number of threads of the compiled kernels (nothing to do without Numba),
+    e.g. in the workers of a process pool already spread over every core
+    """
+    kernels = get_kernels()
+    if kernels is not None:
+        kernels.numba.set_num_threads(max(1, min(threads, kernels.numba.config.NUMBA_NUM_THREADS)))
+
+
+def find_best_sharpe(er_vector: np.ndarray, cov_matrix: np.ndarray, rf: float, start: int, stop: int, seed=None,
+                     sampler: str = Samplers.DEFAULT_SAMPLER) -> tuple:
+    """
+    Samples the portfolios at positions [start, stop) of the sample and returns
+    (best Sharpe ratio, position of the best portfolio). Ties go to the first one.
+
+    Nothing but the best portfolio is kept (constant memory)
+    """
+    if sampler not in SAMPLER_CODES:
+        raise ValueError(f"Unknown sampler '{sampler}', select from {Samplers.SAMPLERS}")
+
+    n = len(er_vector)
+    key = get_key(seed)
+    sobol = get_sobol_state(n, seed) if sampler == Samplers.SOBOL else None
+
+    kernels = get_kernels()
+    if kernels is None:
+        return _find_best_sharpe_numpy(er_vector, cov_matrix, rf, start, stop, key, sampler, sobol)
+
+    if sobol is None:
+        sobol = (np.zeros((n, Samplers.SOBOL_BITS), dtype=np.uint64), np.zeros(n, dtype=np.uint64))
+    directions, shift = sobol
+    best_sharpe, best_row = kernels.find_best_sharpe(np.ascontiguousarray(er_vector, dtype=np.float64), np.ascontiguousarray(cov_matrix, dtype=np.float64),
+                                                        float(rf), int(start), int(stop), key, SAMPLER_CODES[sampler], directions, shift, BLOCK_SIZE)
+    return float(best_sharpe), int(best_row)
+
+
+def get_weights_at(rows: np.ndarray, n: int, seed=None, sampler: str = Samplers.DEFAULT_SAMPLER) -> np.ndarray:
+    """
+    Redraws the weights of the portfolios at positions rows (same as find_best_sharpe)
+    """
+    sobol = get_sobol_state(n, seed) if sampler == Samplers.SOBOL else None
+    return get_counter_weights(get_key(seed), np.asarray(rows), n, sampler, sobol)
@@ -1,17 +1,20 @@
 # Project modules
 import PortfolioBuilderObjects as obj
+import PortfolioEngine as engine
+import FrontierSolver as solver
+import Cache as cache
+import Returns
+import Samplers
 import TimeTracker
-import Graphs as gr
+# Graphs (plotly), Backtest, DownsideRisk, Resampling and Allocation are imported
+# on first use: argument errors and headless callers do not pay for them
 
 # Other modules
+import os
 import sys
-import itertools
 import time
-import statistics
-import random
 import numpy as np
 import pandas as pd
-import plotly.express as px
 
 """
 GitHub Link:
@@ -22,38 +25,139 @@ https://github.com/willburgir/PortfolioBuilder
 SAMPLE_SIZE = 1_000_000
 
 # csv dialect
-DELIMITER = ";"
+DELIMITER = Returns.DELIMITER
 
 # String resources
 BAD_INPUT_SRT  = "ERROR : Inavlid input"
-CMD_FORMAT     = "Please follow this format:\n\npython3 PortfolioBuilder.py [path to Excel file].xlsx [optional flags]\n"
-CMD_FLAGS      = "Available flags:\n--time : Shows the time tracker report." 
-TIME_FLAG_STR  = "--time"
+CMD_FORMAT     = ("Please follow this format:\n\npython3 PortfolioBuilder.py [path to Excel file].xlsx [optional flags]\n"
+                  "python3 PortfolioBuilder.py [path to returns file].csv|.parquet --params [path to Excel file].xlsx [optional flags]\n")
+CMD_FLAGS      = ("Available flags:\n"
+                  "--time : Shows the time tracker report.\n"
+                  "--params P : Excel file holding the Parameters and Portfolios sheets (required with a .csv or .parquet returns file).\n"
+                  "--workers N : Spreads the portfolio sampling over N processes.\n"
+                  f"--samples N : Number of portfolios generated (default: {SAMPLE_SIZE:_}).\n"
+                  "--seed N : Seed of the random generator (reproducible runs).\n"
+                  "--solver : Solves the exact optimal portfolio and efficient frontier (use --samples 0 to skip the random portfolios).\n"
+                  "--no-cache : Parses the input file again instead of using the cached copy.\n"
+                  "--period P : Overrides the Periodicity parameter [daily, weekly, monthly, yearly].\n"
+                  "--prune : Only keeps the upper envelope and a random sample of the portfolios (bounded memory).\n"
+                  "--stream : Streams the portfolios in chunks, only keeps running aggregates (constant memory, shows progress).\n"
+                  "--best-only : Only searches the optimal portfolio, without drawing the random portfolios (fastest, uses Numba when installed).\n"
+                  "--resample B : Optimal portfolio resampled (Michaud) from B bootstrap samples of the historical returns (spread over --workers).\n"
+                  "--target-sd T : Allocations (optimal portfolio, lending and borrowing) reaching every target sd of T (comma separated list or file).\n"
+                  "--target-er T : Allocations reaching every target E(r) of T (comma separated list or file).\n"
+                  "--backtest P : Backtests the optimal and user portfolios on the historical returns, rebalanced every period P [daily, weekly, monthly, yearly, none].\n"
+                  f"--sampler S : Distribution of the random portfolios {Samplers.SAMPLERS} (overrides the Sampler parameter, default: {Samplers.DEFAULT_SAMPLER}).\n"
+                  "--help : Shows this message.")
+TIME_FLAG_STR    = "--time"
+WORKERS_FLAG_STR = "--workers"
+SAMPLES_FLAG_STR = "--samples"
+SEED_FLAG_STR    = "--seed"
+SOLVER_FLAG_STR  = "--solver"
+NO_CACHE_FLAG_STR = "--no-cache"
+PERIOD_FLAG_STR  = "--period"
+PRUNE_FLAG_STR   = "--prune"
+SAMPLER_FLAG_STR = "--sampler"
+STREAM_FLAG_STR  = "--stream"
+BEST_ONLY_FLAG_STR = "--best-only"
+PARAMS_FLAG_STR  = "--params"
+BACKTEST_FLAG_STR = "--backtest"
+RESAMPLE_FLAG_STR = "--resample"
+TARGET_SD_FLAG_STR = "--target-sd"
+TARGET_ER_FLAG_STR = "--target-er"
+HELP_FLAG_STRS   = ["--help", "-h"]
 
 
 # Input arguments indexes
 ASSET_RETURNS = 0
 FILE_TYPE     = 1
 TIME_FLAG     = 2
+WORKERS       = 3
+SAMPLES       = 4
+SEED          = 5
+SOLVER_FLAG   = 6
+CACHE_FLAG    = 7
+PERIOD        = 8
+PRUNE_FLAG    = 9
+SAMPLER       = 10
+STREAM_FLAG   = 11
+BEST_ONLY_FLAG = 12
+PARAMS_FILE   = 13
+BACKTEST      = 14
+RESAMPLE      = 15
+ALLOCATION    = 16
+
+# --backtest value of buy and hold portfolios (never rebalanced)
+NO_REBALANCE = "none"
+
+# Input file types
+EXCEL   = "excel"
+CSV     = "csv"
+PARQUET = "parquet"
+
+
+def get_int_flag_value(flags: list, index: int) -> int:
+    """
+    Returns the value following the flag at flags[index] as a positive int
+    """
+    flag = flags[index]
+    try:
+        value = int(flags[index + 1].replace("_", ""))
+    except (IndexError, ValueError):
+        print(f"ERROR : Flag '{flag}' must be followed by a positive integer\n")
+        print(CMD_FLAGS+"\n")
+        exit(1)
+
+    if value < 0 or (value == 0 and flag not in [SEED_FLAG_STR, SAMPLES_FLAG_STR]):
+        print(f"ERROR : Flag '{flag}' must be followed by a positive integer\n")
+        print(CMD_FLAGS+"\n")
+        exit(1)
+    return value
 
 
 def get_args() -> list:
     """
     Obtains the input from the command line including:
-    - Path to csv file containing historical returns of asset classes
-    - File type either "csv" or "excel"
+    - Path to the Excel file, or to a csv/parquet file containing historical returns of asset classes
+    - File type either "csv", "parquet" or "excel"
     - Flags
         -> --time : show time tracker report
+        -> --workers N : number of processes used to sample portfolios
+        -> --samples N : number of portfolios generated
+        -> --seed N : seed of the random generator
+        -> --solver : solve the exact optimal portfolio and efficient frontier
+        -> --no-cache : do not use the cached copy of the input file
+        -> --period P : periodicity of the returns (overrides the Parameters sheet)
+        -> --prune : only keep the upper envelope and a reservoir sample of the portfolios
+        -> --sampler S : distribution of the random portfolios (overrides the Parameters sheet)
+        -> --stream : stream the portfolios in chunks and only keep running aggregates
+        -> --best-only : only search the optimal portfolio (fused kernel, no cloud)
+        -> --params P : Excel file with the Parameters and Portfolios sheets (csv/parquet returns file)
+        -> --backtest P : backtest the optimal and user portfolios, rebalanced every period P (or none)
+        -> --resample B : optimal portfolio averaged over B bootstrap samples of the returns (resampled efficiency)
+        -> --target-sd T / --target-er T : allocations on the kinked CAL reaching the target sd / E(r) values of T
         -> ? : More flags could be added in the future     
 
     returns a list of the form:
-    [file_path : str, file_type: str, t : bool]   
+    [file_path : str, file_type: str, t : bool, workers : int, samples : int, seed : int | None, solver : bool, use_cache : bool, period : str | None, prune : bool, sampler : str | None, stream : bool, best_only : bool, params_file : str | None, backtest : str | None, resamples : int, allocation : (kind, targets) | None]   
     """
     args = sys.argv
     file_path = None
     t_flag    = False
-    is_csv    = False
-    is_excel  = False
+    workers   = 1
+    samples   = SAMPLE_SIZE
+    seed      = None
+    s_flag    = False
+    use_cache = True
+    period    = None
+    p_flag    = False
+    sampler   = None
+    st_flag   = False
+    b_flag    = False
+    params_file = None
+    backtest  = None
+    resamples = 0
+    allocation = None
     file_type = None
 
     # No args
@@ -62,6 +166,12 @@ def get_args() -> list:
         print(CMD_FORMAT)
         exit(1)
 
+    # Help
+    if args[1] in HELP_FLAG_STRS:
+        print(CMD_FORMAT)
+        print(CMD_FLAGS)
+        exit(0)
+
     # Invalid file path
     file_path = args[1]
     if len(file_path) < 5 or file_path[-5:] != ".xlsx":
@@ -73,22 +183,142 @@ def get_args() -> list:
             exit(1)
     
     # Valid file path
-    if file_path[-4:] == ".csv":
-        file_type = "csv"
-    elif len(file_path) >= 5 and file_path[-5:] == ".xlsx":
-        file_type = "excel"
+    file_type = get_file_type(file_path)
 
 
     flags = args[2:] # keep flags only
-    for flag in flags:
+    i = 0
+    while i < len(flags):
+        flag = flags[i]
         if flag == TIME_FLAG_STR:
             t_flag = True
+        elif flag == WORKERS_FLAG_STR:
+            workers = get_int_flag_value(flags, i)
+            i += 1
+        elif flag == SAMPLES_FLAG_STR:
+            samples = get_int_flag_value(flags, i)
+            i += 1
+        elif flag == SEED_FLAG_STR:
+            seed = get_int_flag_value(flags, i)
+            i += 1
+        elif flag == SOLVER_FLAG_STR:
+            s_flag = True
+        elif flag == NO_CACHE_FLAG_STR:
+            use_cache = False
+        elif flag == PERIOD_FLAG_STR:
+            if i + 1 >= len(flags):
+                print(f"ERROR : Flag '{flag}' must be followed by a period\n")
+                print(CMD_FLAGS+"\n")
+                exit(1)
+            period = flags[i + 1]
+            translate_period(period) # validation
+            i += 1
+        elif flag == PRUNE_FLAG_STR:
+            p_flag = True
+        elif flag == SAMPLER_FLAG_STR:
+            if i + 1 >= len(flags) or Samplers.get_sampler(flags[i + 1]) is None:
+                print(f"ERROR : Flag '{flag}' must be followed by a sampler {Samplers.SAMPLERS}\n")
+                print(CMD_FLAGS+"\n")
+                exit(1)
+            sampler = Samplers.get_sampler(flags[i + 1])
+            i += 1
+        elif flag == STREAM_FLAG_STR:
+            st_flag = True
+        elif flag == BEST_ONLY_FLAG_STR:
+            b_flag = True
+        elif flag == PARAMS_FLAG_STR:
+            if i + 1 >= len(flags) or get_file_type(flags[i + 1]) != EXCEL:
+                print(f"ERROR : Flag '{flag}' must be followed by an Excel file (.xlsx)\n")
+                print(CMD_FLAGS+"\n")
+                exit(1)
+            params_file = flags[i + 1]
+            i += 1
+        elif flag in [TARGET_SD_FLAG_STR, TARGET_ER_FLAG_STR]:
+            if allocation is not None:
+                print(f"ERROR : '{TARGET_SD_FLAG_STR}' and '{TARGET_ER_FLAG_STR}' can only be used once\n")
+                print(CMD_FLAGS+"\n")
+                exit(1)
+            import Allocation
+            kind = Allocation.TARGET_SD if flag == TARGET_SD_FLAG_STR else Allocation.TARGET_ER
+            allocation = (kind, get_targets(flags, i))
+            i += 1
+        elif flag == RESAMPLE_FLAG_STR:
+            resamples = get_int_flag_value(flags, i)
+            i += 1
+        elif flag == BACKTEST_FLAG_STR:
+            if i + 1 >= len(flags):
+                print(f"ERROR : Flag '{flag}' must be followed by a rebalancing period [daily, weekly, monthly, yearly, none]\n")
+                print(CMD_FLAGS+"\n")
+                exit(1)
+            # Kept as given (printed with the results), validated here
+            backtest = flags[i + 1]
+            get_rebalance_period(backtest)
+            i += 1
         else:
             print(f"ERROR : Provided invalid flag '{flag}'\n")
             print(CMD_FLAGS+"\n")
             exit(1)
+        i += 1
+
+    # Without the solver or resampling, the optimal portfolio comes from the random portfolios
+    if samples == 0 and not s_flag and resamples == 0:
+        print(f"ERROR : '{SAMPLES_FLAG_STR} 0' can only be used with '{SOLVER_FLAG_STR}' or '{RESAMPLE_FLAG_STR}'\n")
+        print(CMD_FLAGS+"\n")
+        exit(1)
+
+    if b_flag and (p_flag or st_flag):
+        print(f"ERROR : '{BEST_ONLY_FLAG_STR}' cannot be used with '{PRUNE_FLAG_STR}' or '{STREAM_FLAG_STR}'\n")
+        print(CMD_FLAGS+"\n")
+        exit(1)
+    
+    # Returns files do not hold the Parameters and Portfolios sheets
+    if file_type in [CSV, PARQUET] and params_file is None:
+        print(f"ERROR : A {file_type} returns file must be used with '{PARAMS_FLAG_STR} [path to Excel file].xlsx'\n")
+        print(CMD_FORMAT)
+        exit(1)
+    if file_type == EXCEL and params_file is not None:
+        print(f"ERROR : '{PARAMS_FLAG_STR}' can only be used with a .csv or .parquet returns file\n")
+        print(CMD_FORMAT)
+        exit(1)
     
-    return [file_path, file_type, t_flag]
+    return [file_path, file_type, t_flag, workers, samples, seed, s_flag, use_cache, period, p_flag, sampler, st_flag, b_flag, params_file, backtest, resamples, allocation]
+
+
+def get_targets(flags: list, index: int) -> list:
+    """
+    Returns the targets following the flag at flags[index]: a comma separated 
+    list of numbers, or a file listing them (one or more per line, ',' or ';' separated)
+    """
+    flag = flags[index]
+    if index + 1 >= len(flags):
+        print(f"ERROR : Flag '{flag}' must be followed by targets (e.g. 5,10,15) or a file listing them\n")
+        print(CMD_FLAGS+"\n")
+        exit(1)
+
+    value = flags[index + 1]
+    if os.path.isfile(value):
+        with open(value, "r") as f:
+            value = f.read()
+
+    try:
+        targets = [float(t) for t in value.replace(";", ",").replace("\n", ",").split(",") if t.strip()]
+    except ValueError:
+        targets = []
+    if not targets:
+        print(f"ERROR : Flag '{flag}' must be followed by targets (e.g. 5,10,15) or a file listing them\n")
+        print(CMD_FLAGS+"\n")
+        exit(1)
+    return targets
+
+
+def get_file_type(file_path: str) -> str:
+    """
+    Returns the type of the input file from its extension:
+    "excel" (.xlsx), "csv" or "parquet" (returns files), None otherwise
+    """
+    if file_path.lower().endswith(".xlsx"):
+        return EXCEL
+    return Returns.get_returns_file_type(file_path)
 
 
 def translate_period(period: str) -> str:
@@ -118,23 +348,45 @@ def translate_period(period: str) -> str:
     return p
 
 
-def read_excel_parameters(file_path: str, sheet_name: str):
+def get_rebalance_period(backtest: str) -> str:
     """
-    Obtains parameters from excel sheet:
+    Translates a --backtest value into the rebalancing period of Backtest.py
+    (None for buy and hold portfolios)
+    """
+    return None if backtest.lower() == NO_REBALANCE else translate_period(backtest)
+
+
+@TimeTracker.track
+def read_excel_sheets(file_path: str, sheet_names: list = None) -> dict:
+    """
+    Parses the sheets of the input Excel file in a single pass (default: every sheet)
+    Returns {sheet name : DataFrame} (first row used as header, no index)
+    """
+    try:
+        sheets = pd.read_excel(file_path, sheet_name=sheet_names, header=0)
+    except PermissionError:
+        print("ERROR : Could not read Excel file.\nThis could be because the file is open. Please close it before running the program.")
+        exit(1)
+
+    return sheets
+
+
+def read_excel_parameters(df: pd.DataFrame):
+    """
+    Obtains parameters from the Parameters sheet (as parsed by read_excel_sheets):
     1. Risk free rate
     2. Available borrowing interest rate
     3. Periodocity of historical returns
+    4. Sampler of the random portfolios (optional 4th row, None when not provided)
+    5. Risk measure (optional 5th row, sd when not provided, see DownsideRisk.py)
+    6. Annual target return in % of the downside risk measures (optional 6th row, None: risk free rate)
     """
     # Params indices
     NAME = 0
     VAL  = 1
     SRC  = 2
     
-    try:
-        df = pd.read_excel(file_path, sheet_name=sheet_name, header=0, index_col=0)
-    except PermissionError:
-        print("ERROR : Could not read Excel file.\nThis could be because the file is open. Please close it before running the program.")
-        exit(1)
+    df = df.set_index(df.columns[NAME])
 
     params = []
     for tp in df.itertuples():
@@ -147,22 +399,74 @@ def read_excel_parameters(file_path: str, sheet_name: str):
     available_rate = params[1][VAL]
     periodicity    = params[2][VAL]
 
-    return risk_free_rate, available_rate,  periodicity
+    sampler = None
+    if len(params) > 3 and not pd.isna(params[3][VAL]):
+        sampler = Samplers.get_sampler(params[3][VAL])
+        if sampler is None:
+            print(f"ERROR : Invalid Sampler parameter '{params[3][VAL]}'")
+            print(f"Select from {Samplers.SAMPLERS}")
+            exit(1)
+
+    import DownsideRisk
+    risk_measure = DownsideRisk.DEFAULT_RISK_MEASURE
+    if len(params) > 4 and not pd.isna(params[4][VAL]):
+        risk_measure = DownsideRisk.get_risk_measure(params[4][VAL])
+        if risk_measure is None:
+            print(f"ERROR : Invalid Risk Measure parameter '{params[4][VAL]}'")
+            print(f"Select from {DownsideRisk.RISK_MEASURES}")
+            exit(1)
+
+    target = None
+    if len(params) > 5 and not pd.isna(params[5][VAL]):
+        try:
+            target = float(params[5][VAL])
+        except (TypeError, ValueError):
+            print(f"ERROR : Invalid Target Return parameter '{params[5][VAL]}' (annual return in %)")
+            exit(1)
+
+    return risk_free_rate, available_rate,  periodicity, sampler, risk_measure, target
+
+
+@TimeTracker.track
+def read_returns_input(file_path : str, file_type : str, use_cache : bool = True) -> dict:
+    """
+    Reads the historical returns of a csv or parquet returns file (see Returns.read_returns_file,
+    e.g. written by YahooDataDownloader.py) and resamples them to every periodicity.
+
+    The result is cached (see Cache.py) under the content and mtime of the file
 
+    Returns {resample period : resampled returns matrix (DatetimeIndex x tickers)}
+    """
+    returns = None
+    if use_cache:
+        returns_key = cache.get_file_key(file_path)
+        returns = cache.load_returns(returns_key)
+
+    if returns is None:
+        try:
+            df = Returns.read_returns_file(file_path, file_type)
+        except (OSError, ValueError, ImportError) as e:
+            print(f"ERROR : Could not read returns file '{file_path}' ({e})")
+            exit(1)
+
+        # Compound returns into every periodicity (D/W/M/Y) in one pass
+        with TimeTracker.get_tracker().section("resample returns"):
+            returns = Returns.compound_resample_all(df)
 
-def read_excel_user_portfolios(file_path: str, sheet_name: str, corr_matrix: object, asset_classes: list) -> list:
+        if use_cache:
+            cache.save_returns(returns_key, returns)
+
+    return returns
+
+
+@TimeTracker.track
+def read_excel_user_portfolios(df: pd.DataFrame, corr_matrix: object, asset_classes: list) -> list:
     """
-    Returns a list of user defined Portfolio objects from the input Excel file
+    Returns a list of user defined Portfolio objects from the Portfolios sheet (as parsed by read_excel_sheets)
     """
     NAME  = 'Portfolio Name'
     COLOR = 'Color'
 
-    try:
-        df = pd.read_excel(file_path, sheet_name=sheet_name, header=0)
-    except PermissionError:
-        print("ERROR : Could not read Excel file.\nThis could be because the file is open. Please close it before running the program.")
-        exit(1)
-
     portfolios = []
     for _, row in df.iterrows():
         name = row[NAME]
@@ -172,27 +476,44 @@ def read_excel_user_portfolios(file_path: str, sheet_name: str, corr_matrix: obj
 
         composition = obj.convert_tickers_to_AssetClass_obj(composition, asset_classes)
 
-        portfolio = obj.Portfolio(name, composition, corr_matrix)
+        portfolio = obj.Portfolio(name, composition, obj.get_universe(asset_classes, corr_matrix))
         portfolio.set_color(color)
         portfolios.append(portfolio)
     
     return portfolios
 
 
-def read_excel_input(file_path : str, file_type : str):
+@TimeTracker.track
+def read_excel_input(file_path : str, file_type : str, use_cache : bool = True, period : str = None, params_file : str = None):
     """
     Reads the input excel containing:
     1. Asset Classes historical returns
     2. Rates (risk free & available borrowing interest rate)
     3. Portfolios with compositions
 
+    With a csv or parquet file_type, the historical returns are read from file_path
+    (see read_returns_input) and the Parameters and Portfolios sheets from the
+    Excel file params_file.
+
+    The workbook is parsed once (all sheets in a single pass) and its returns are
+    resampled to every periodicity at once (see Returns.py). The result is cached 
+    (see Cache.py): repeat runs on an unchanged workbook skip the parsing, even when
+    they switch periodicity. When only the Parameters or Portfolios sheets changed, 
+    the Asset Classes sheet is not parsed again.
+
+    period overrides the Periodicity parameter of the workbook when provided
+
     Returns:
-    1. List of AssetClass objects
+    1. AssetUniverse (list of AssetClass objects with their E(r), sd and covariance arrays)
     2. Correlation matrix
     3. Risk free rate
     4. Available borrowing interest rate
     5. Periodicity of historical returns
     6. List of User Portfolio objects to be highlighted 
+    7. Sampler of the random portfolios (None when the Parameters sheet does not set it)
+
+    With a downside Risk Measure parameter, the universe measures risk with the
+    downside deviation below the Target Return parameter (see DownsideRisk.py)
     """
     DATE_DF_LABEL = "Date"
     ASSET_CLASSES_SHEET = "Asset Classes"
@@ -202,101 +523,259 @@ def read_excel_input(file_path : str, file_type : str):
 
     asset_class_list = []
 
-    if file_type != "excel":
-        print("ERROR : Invalid file type. Please use Excel")
+    if file_type not in [EXCEL, CSV, PARQUET]:
+        print("ERROR : Invalid file type. Please use Excel (.xlsx), csv (.csv) or parquet (.parquet)")
         exit(1)
 
-    try:
-        rf, available_rate, period = read_excel_parameters(file_path, PARAMETERS_SHEET)
-        df = pd.read_excel(file_path, sheet_name="Asset Classes", header=0, index_col=0)
-    except PermissionError:
-        print("ERROR : Could not read Excel file.\nThis could be because the file is open. Please close it before running the program.")
-        exit(1)
+    if file_type != EXCEL:
+        if params_file is None:
+            print(f"ERROR : A {file_type} returns file must be used with an Excel file holding the Parameters and Portfolios sheets")
+            exit(1)
+
+        returns = read_returns_input(file_path, file_type, use_cache)
+
+        # Only the small sheets are read from Excel
+        sheets = read_excel_sheets(params_file, [PARAMETERS_SHEET, PORTFOLIOS_SHEET])
+        parameters = read_excel_parameters(sheets[PARAMETERS_SHEET])
+        portfolios_df = sheets[PORTFOLIOS_SHEET]
+    else:
+        cached = None
+        if use_cache:
+            cached = cache.load_input(file_path)
+
+        if cached is not None:
+            returns, parameters, portfolios_df = cached
+        else:
+            returns = None
+            if use_cache:
+                returns_key = cache.get_sheet_key(file_path, ASSET_CLASSES_SHEET)
+                returns = cache.load_returns(returns_key)
+
+            if returns is None:
+                sheets = read_excel_sheets(file_path)
+
+                # Assuming 'Date' is the first column with datetime values
+                df = sheets[ASSET_CLASSES_SHEET]
+                df = df.set_index(df.columns[0])
 
+                # Compound returns into every periodicity (D/W/M/Y) in one pass
+                with TimeTracker.get_tracker().section("resample returns"):
+                    returns = Returns.compound_resample_all(df)
+            else:
+                # Asset Classes are unchanged: only parse the small sheets
+                sheets = read_excel_sheets(file_path, [PARAMETERS_SHEET, PORTFOLIOS_SHEET])
+
+            parameters = read_excel_parameters(sheets[PARAMETERS_SHEET])
+            portfolios_df = sheets[PORTFOLIOS_SHEET]
+
+            if use_cache:
+                cache.save_input(file_path, returns_key, returns, parameters, portfolios_df)
+
+    rf, available_rate, sheet_period, sampler, risk_measure, target = parameters
+
+    if period is None:
+        period = sheet_period
     resample_period = translate_period(period)
 
-    # Assuming 'Date' is the column with datetime values
-    df = df.resample(resample_period).apply(lambda x: (1 + x).prod() - 1)
+    df = returns[resample_period]
     df = df.T
     
     # create list of AssetClass objects for each row in the df
-    for tp in df.itertuples():
-        name = tp[0]
-        row  = pd.Series(tp[1:])
-        asset_class = obj.AssetClass(name=name, historical_returns=row, period=period)
-        asset_class_list.append(asset_class)
+    with TimeTracker.get_tracker().section("create AssetClass objects"):
+        for tp in df.itertuples():
+            name = tp[0]
+            row  = pd.Series(tp[1:])
+            asset_class = obj.AssetClass(name=name, historical_returns=row, period=period)
+            asset_class_list.append(asset_class)
 
     # Get corr_matrix
-    corr_matrix = df.T.corr()
+    with TimeTracker.get_tracker().section("correlation matrix"):
+        corr_matrix = df.T.corr()
+
+    # E(r), sd and covariance arrays of the asset classes, shared by every portfolio and optimizer
+    # The universe is keyed on its returns: workbooks on the same returns share their frontiers (see Cache.py)
+    universe_key = cache.get_universe_key(returns[resample_period], resample_period)
+    if target is None:
+        target = rf
+    import DownsideRisk
+    if risk_measure != DownsideRisk.SD:
+        universe_key = cache.get_array_key(universe_key, risk_measure, float(target))
+    asset_class_list = obj.AssetUniverse(asset_class_list, corr_matrix, universe_key, returns[resample_period])
+    asset_class_list.use_downside_risk(risk_measure, target, period)
     
     # Get user portfolios
-    user_portfolios = read_excel_user_portfolios(file_path, PORTFOLIOS_SHEET, corr_matrix, asset_class_list)
+    user_portfolios = read_excel_user_portfolios(portfolios_df, corr_matrix, asset_class_list)
 
-    return asset_class_list, corr_matrix, rf, available_rate, period, user_portfolios
+    return asset_class_list, corr_matrix, rf, available_rate, period, user_portfolios, sampler
 
 
-def get_random_weights(n):
+@TimeTracker.track
+def load_or_create_portfolios(asset_classes : list, corr_matrix : object, sample_size : int, workers : int = 1, seed : int = None, use_cache : bool = True, prune : bool = False, 
+                              sampler : str = Samplers.DEFAULT_SAMPLER) -> dict:
     """
-    Creates a list of n random weights which sum up to 1
+    Same as create_portfolios(), but reuses the portfolios sampled by a previous run
+    on the same asset universe (returns and periodicity, see get_universe_key), 
+    sample size, seed, mode and sampler. The previous run may have used another workbook.
+    Unseeded runs reuse the portfolios of the previous unseeded run (use_cache=False
+    draws new ones).
+
+    Changing the risk free rate or the user portfolios does not change the sampled 
+    frontier: only the Sharpe ratios, CAL and highlighted portfolios need to be recomputed.
     """
-    weights = []
-    
-    for i in range(n):
-        weights.append(random.random())
-    
-    # Scale to 1
-    weights = weights/np.sum(weights)*100
-    return weights
+    if not use_cache:
+        return create_portfolios(asset_classes, corr_matrix, sample_size, workers, seed, prune, sampler)
+
+    cov_matrix = obj.get_covariance_matrix(asset_classes, corr_matrix)
+    key = cache.get_frontier_key(get_universe_key(asset_classes, corr_matrix), sample_size, seed, prune, sampler)
 
+    portfolios = cache.load_frontier(key, cov_matrix)
+    if portfolios is None:
+        portfolios = create_portfolios(asset_classes, corr_matrix, sample_size, workers, seed, prune, sampler)
+        cache.save_frontier(key, portfolios, cov_matrix)
+
+    return portfolios
 
-def create_portfolios(asset_classes : list, corr_matrix : object, sample_size : int) -> list:
+
+def load_or_solve_frontier(asset_classes : list, corr_matrix : object, use_cache : bool = True) -> obj.PortfolioSet:
+    """
+    Same as FrontierSolver.get_frontier(), but reuses the frontier solved by a previous
+    run on the same asset universe (see load_or_create_portfolios)
+    """
+    if not use_cache:
+        return solver.get_frontier(asset_classes, corr_matrix)
+
+    cov_matrix = obj.get_covariance_matrix(asset_classes, corr_matrix)
+    key = cache.get_frontier_key(get_universe_key(asset_classes, corr_matrix), solver.FRONTIER_POINTS)
+
+    frontier = cache.load_frontier(key, cov_matrix, kind=cache.SOLVED_FRONTIER)
+    if frontier is not None:
+        return obj.convert_batch_into_portfolio_set(frontier, asset_classes, corr_matrix)
+
+    frontier_set = solver.get_frontier(asset_classes, corr_matrix)
+    batch = {"Weights" : frontier_set.weights, "E(r)" : frontier_set.Er, "sd" : frontier_set.sd}
+    cache.save_frontier(key, batch, cov_matrix, kind=cache.SOLVED_FRONTIER)
+    return frontier_set
+
+
+def get_universe_key(asset_classes : list, corr_matrix : object) -> str:
     """
-    Creates all possible portfolios based on different weighing 
-    of asset classes in increments of 1% 
+    Returns the cache key of the asset universe: the key of the returns it was
+    computed from, or a hash of its names, E(r) and covariance matrix when unknown
+    """
+    universe = obj.get_universe(asset_classes, corr_matrix)
+    if universe.returns_key is not None:
+        return universe.returns_key
+    return cache.get_array_key(universe.names, universe.er_vector, universe.cov_matrix)
+
 
-    returns a list of Portfolio objects
+@TimeTracker.track
+def create_portfolios(asset_classes : list, corr_matrix : object, sample_size : int, workers : int = 1, seed : int = None, prune : bool = False, 
+                      sampler : str = Samplers.DEFAULT_SAMPLER) -> dict:
     """
-    # TODO
-    # Add multithreading to this function
-    BIG_NUMBER = 1_000_000
+    Creates sample_size random portfolios based on different weighing 
+    of asset classes
 
+    The weight matrix is drawn in shards and every E(r) and sd is computed
+    with matrix operations (see PortfolioEngine). 
+    With workers > 1, shards are spread over a process pool. 
+    A given seed always produces the same portfolios, whatever the number of workers.
+
+    With prune, only the upper envelope of the portfolios and a random sample 
+    of them are returned (bounded memory, see PortfolioEngine.FrontierPruner)
+
+    sampler sets the distribution of the weights (see Samplers.py). The edge/corner
+    biased sampler reaches the frontier with far fewer portfolios than the default
+    normalized uniforms, which cluster around equal weights.
+
+    With the exact downside risk measure, the portfolios are sampled (and pruned)
+    on the co-semivariance approximation, then their exact downside deviation
+    replaces "sd" (see DownsideRisk.compute_batch_downside)
+
+    returns a dict of columnar arrays {"Weights" : ..., "E(r)" : ..., "sd" : ...}
+    """
     n = len(asset_classes)
     
     if n == 0:
         print("ERROR : Passed an empty list to create_portfolios")
         exit(1)
 
-    portfolios = []
-    portfolio_num = 1
-
-    for observation in range(sample_size):
-        # pick n ints, one for each asset class
-        # TODO
-        # check random distribution 
-        random_weights = get_random_weights(n)
-
-        # combine into {AssetClass : weight}
-        composition = {}
-        index = 0
-        for asset_class in asset_classes:
-            composition[asset_class] = random_weights[index]
-            index += 1
-        
-        # create portfolio
-        portfolio = obj.Portfolio(f"Portfolio{portfolio_num}", composition, corr_matrix)
-        portfolios.append(portfolio)
-        portfolio_num += 1
+    er_vector  = obj.get_er_vector(asset_classes)
+    cov_matrix = obj.get_covariance_matrix(asset_classes, corr_matrix)
 
-    return portfolios
+    if prune:
+        batch = engine.create_pruned_portfolio_batch(er_vector, cov_matrix, sample_size, workers, seed, sampler)
+    else:
+        batch = engine.create_portfolio_batch_parallel(er_vector, cov_matrix, sample_size, workers, seed, sampler)
 
+    universe = obj.get_universe(asset_classes, corr_matrix)
+    if universe.is_exact_downside():
+        with TimeTracker.get_tracker().section("exact downside deviation"):
+            batch[engine.SD] = universe.compute_exact_risk(batch[engine.WEIGHTS])
+    return batch
 
+
+def print_progress(done : int, total : int, start_time : float) -> None:
+    """
+    Prints (on a single line) how many portfolios were sampled so far
+    """
+    elapsed = time.perf_counter() - start_time
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else 0
+    end = "\n" if done >= total else ""
+    print(f"\rSampled {done:,} / {total:,} portfolios ({done / total * 100:.0f}%) - {rate:,.0f} portfolios/sec - ETA {eta:.0f} sec   ", end=end, flush=True)
+
+
+@TimeTracker.track
+def stream_portfolios(asset_classes : list, corr_matrix : object, sample_size : int, rf : float, workers : int = 1, seed : int = None, 
+                      sampler : str = Samplers.DEFAULT_SAMPLER, show_progress : bool = True) -> engine.StreamSummary:
+    """
+    Streaming alternative to create_portfolios() for very large sample sizes:
+    portfolios are generated in chunks, every chunk updates running aggregates
+    (best Sharpe ratio, upper envelope, histogram of the cloud) and is discarded.
+    Memory stays constant whatever sample_size.
+
+    With show_progress, the number of portfolios sampled so far is printed as they go
+
+    Returns the PortfolioEngine.StreamSummary of every portfolio
+    """
+    er_vector  = obj.get_er_vector(asset_classes)
+    cov_matrix = obj.get_covariance_matrix(asset_classes, corr_matrix)
+
+    progress = None
+    if show_progress:
+        start_time = time.perf_counter()
+        done = [0]
+        def progress(count):
+            done[0] += count
+            print_progress(done[0], sample_size, start_time)
+
+    return engine.stream_portfolios(er_vector, cov_matrix, sample_size, rf, workers, seed, sampler, progress)
+
+
+def find_best_portfolio(asset_classes : list, corr_matrix : object, sample_size : int, rf : float, workers : int = 1, seed : int = None, 
+                        sampler : str = Samplers.DEFAULT_SAMPLER) -> obj.Portfolio:
+    """
+    Best-only alternative to create_portfolios(): samples sample_size portfolios
+    but only keeps the one with the best Sharpe ratio (see PortfolioEngine.find_best_portfolio)
+
+    Returns the optimal portfolio as a Portfolio object
+    """
+    er_vector  = obj.get_er_vector(asset_classes)
+    cov_matrix = obj.get_covariance_matrix(asset_classes, corr_matrix)
+
+    best = engine.find_best_portfolio(er_vector, cov_matrix, sample_size, rf, workers, seed, sampler)
+    best_set = obj.PortfolioSet(asset_classes, corr_matrix, best[engine.WEIGHTS], best[engine.ER], best[engine.SD])
+    return best_set.get_portfolio(0, name="Optimal Portfolio")
+
+
+@TimeTracker.track
 def compute_sharpe(df: pd.DataFrame, rf: float) -> pd.DataFrame:
     """
     Input: 
-        - df : pandas DataFrame containing portfolios
+        - df : pandas DataFrame or PortfolioSet containing portfolios
         - rf : Risk free rate in %
 
-    Returns a df with additional column "Sharpe Ratio"
+    Returns the df with additional column "Sharpe Ratio"
 
     Requirement:
     The df passed into this function must have columns named exactly 
@@ -310,55 +789,215 @@ def compute_sharpe(df: pd.DataFrame, rf: float) -> pd.DataFrame:
 
 
 
+def get_kinked_cal(optimal_portfolio : obj.Portfolio, rf : float, available_rate : float, candidates : obj.PortfolioSet = None) -> "Allocation.KinkedCAL":
+    """
+    Builds the kinked Capital Allocation Line of the optimal portfolio: lending at rf
+    up to the optimal portfolio, borrowing at available_rate beyond (see Allocation.py)
+
+    candidates (cloud or frontier of the run) give the efficient portfolios between the
+    optimal portfolio and the tangency portfolio of available_rate. Without them,
+    money is borrowed to invest in the optimal portfolio.
+    """
+    import Allocation
+    if pd.isna(available_rate):
+        # No borrowing rate: borrow at the risk free rate
+        available_rate = rf
+    elif available_rate < rf:
+        print(f"\nWARNING : The available borrowing interest rate ({available_rate:g}%) is below the risk free rate ({rf:g}%), "
+              "borrowing at the risk free rate instead")
+        available_rate = rf
+
+    weights = optimal_portfolio.weights[None, :]
+    Er = [optimal_portfolio.Er]
+    sd = [optimal_portfolio.sd]
+    if candidates is not None and len(candidates) > 0:
+        rows = Allocation.get_efficient_envelope(candidates.Er, candidates.sd)
+        weights = np.vstack([weights, candidates.weights[rows]])
+        Er = np.r_[Er, candidates.Er[rows]]
+        sd = np.r_[sd, candidates.sd[rows]]
+
+    return Allocation.KinkedCAL(optimal_portfolio.universe, rf, available_rate, weights, Er, sd)
+
+
+def build_efficient_frontier(returns_file : str, file_type : str, sample_size : int, workers : int = 1, seed : int = None, solver_flag : bool = False, 
+                             use_cache : bool = True, period_override : str = None, prune : bool = False, sampler : str = None, 
+                             stream : bool = False, show_progress : bool = False, best_only : bool = False, params_file : str = None, 
+                             resamples : int = 0):
+    """
+    Runs the whole program on one input file without showing anything:
+    reads the input, finds the optimal portfolio and draws the efficient frontier
+
+    sampler overrides the Sampler parameter of the input (default: Samplers.DEFAULT_SAMPLER)
+    stream only keeps running aggregates of the portfolios (see stream_portfolios),
+    the cloud is then drawn from their histogram
+    best_only only searches the optimal portfolio (see find_best_portfolio): no cloud is drawn
+    params_file is the Excel file holding the Parameters and Portfolios sheets of a csv or parquet returns_file
+    resamples > 0 replaces the optimal portfolio with the resampled one: the mean of the tangency 
+    portfolios of resamples bootstrap samples of the returns (see Resampling.py)
+
+    Returns:
+    1. The efficient frontier figure (Plotly)
+    2. The optimal portfolio as a Portfolio object
+    3. List of User Portfolio objects
+    4. Risk free rate
+    5. Periodicity of historical returns
+    6. Kinked Capital Allocation Line (lending at rf, borrowing at the available rate, see get_kinked_cal)
+    """
+    import Graphs as gr
+
+    tt = TimeTracker.get_tracker()
+
+    with tt.section("Read input data"):
+        # Create AssetClass objects from .csv file
+        asset_classes, corr_matrix, risk_free_rate, available_rate, period, user_portfolios, sheet_sampler = read_excel_input(returns_file, file_type, use_cache, period_override, params_file)
+
+    if sampler is None:
+        sampler = sheet_sampler if sheet_sampler is not None else Samplers.DEFAULT_SAMPLER
+
+    if solver_flag:
+        with tt.section("solve_frontier"):
+            # Exact optimal portfolio and efficient frontier
+            optimal_portfolio = solver.get_tangency_portfolio(asset_classes, corr_matrix, risk_free_rate)
+            frontier_set = load_or_solve_frontier(asset_classes, corr_matrix, use_cache)
+
+    resampled_portfolio = None
+    if resamples > 0:
+        import Resampling
+        with tt.section("resample optimal portfolio"):
+            resampled_portfolio = Resampling.get_resampled_portfolio(asset_classes, corr_matrix, risk_free_rate, resamples, workers, seed)
+
+    # Random portfolios (only needed for visualization when using the solver or resampling)
+    portfolio_set = None
+    summary = None
+    best_portfolio = None
+    if sample_size > 0 and best_only:
+        if not solver_flag and resampled_portfolio is None:
+            with tt.section("Find optimal portfolio"):
+                best_portfolio = find_best_portfolio(asset_classes, corr_matrix, sample_size, risk_free_rate, workers, seed, sampler)
+    elif sample_size > 0 and stream:
+        summary = stream_portfolios(asset_classes, corr_matrix, sample_size, risk_free_rate, workers, seed, sampler, show_progress)
+    elif sample_size > 0:
+        with tt.section("Generate portfolios"):
+            portfolios = load_or_create_portfolios(asset_classes, corr_matrix, sample_size, workers, seed, use_cache, prune, sampler)
+
+        with tt.section("portfolios_df_conversion"):
+            portfolio_set = obj.convert_batch_into_portfolio_set(portfolios, asset_classes, corr_matrix)
+            del portfolios
+
+        portfolio_set = compute_sharpe(portfolio_set, risk_free_rate)
+
+    with tt.section("get_scatter_plot"):
+        candidates = portfolio_set
+        title = f"Efficient Frontier based on {period.lower()} returns : {sample_size} portfolios"
+        universe = obj.get_universe(asset_classes, corr_matrix)
+        import DownsideRisk
+        if universe.risk_measure != DownsideRisk.SD:
+            title += f" (risk : downside deviation below {universe.target:g}%)"
+        if summary is not None:
+            eff_frontier = gr.get_density_plot(summary.histogram, summary.sd_edges, summary.er_edges, title=title)
+            mask = summary.get_envelope_mask()
+            envelope_set = obj.PortfolioSet(asset_classes, corr_matrix, summary.envelope_weights[mask], summary.envelope_er[mask], summary.envelope_sd[mask])
+            eff_frontier = gr.add_frontier(eff_frontier, envelope_set, name="Sampled Frontier")
+            candidates = envelope_set
+        else:
+            if portfolio_set is not None:
+                cloud_df = portfolio_set.to_df()
+            else:
+                cloud_df = pd.DataFrame({"E(r)" : [], "sd" : []})
+            eff_frontier = gr.get_scatter_plot(cloud_df, title=title)
+
+        if solver_flag:
+            eff_frontier = gr.add_frontier(eff_frontier, frontier_set)
+
+        if resampled_portfolio is not None:
+            optimal_portfolio = resampled_portfolio
+            eff_frontier = gr.draw_CAL(eff_frontier, optimal_portfolio, risk_free_rate)
+        elif solver_flag:
+            eff_frontier = gr.draw_CAL(eff_frontier, optimal_portfolio, risk_free_rate)
+        elif best_portfolio is not None:
+            optimal_portfolio = best_portfolio
+            eff_frontier = gr.draw_CAL(eff_frontier, optimal_portfolio, risk_free_rate)
+        elif summary is not None:
+            best_set = obj.PortfolioSet(asset_classes, corr_matrix, summary.best_weights[None, :], [summary.best_er], [summary.best_sd])
+            optimal_portfolio = best_set.get_portfolio(0, name="Optimal Portfolio")
+            eff_frontier = gr.draw_CAL(eff_frontier, optimal_portfolio, risk_free_rate)
+        else:
+            eff_frontier, optimal_portfolio = gr.add_CAL(eff_frontier, portfolio_set, risk_free_rate)
+
+        # Kinked CAL beyond the optimal portfolio (the resampled portfolio is not on the frontier of the run)
+        if resampled_portfolio is not None:
+            candidates = None
+        elif solver_flag:
+            candidates = frontier_set
+        cal = get_kinked_cal(optimal_portfolio, risk_free_rate, available_rate, candidates)
+        cal_sd, cal_er = cal.get_line(1.5 * cal.segment_sd[-1])
+        eff_frontier = gr.draw_leveraged_CAL(eff_frontier, cal_sd, cal_er)
+
+        eff_frontier = gr.add_user_portfolios(eff_frontier, user_portfolios)
+
+    return eff_frontier, optimal_portfolio, user_portfolios, risk_free_rate, period, cal
+
+
 def main():
-    # Prepare TimeTracker
-    tt = TimeTracker.TimeTracker()
-
-    func_name = "Read command line arguments"
-    tt.start(func_name)
-    # Get command line arguments
-    user_input = get_args()
-    returns_file  = user_input[ASSET_RETURNS]
-    file_type = user_input[FILE_TYPE]
-    time_flag = user_input[TIME_FLAG]
-    tt.end(func_name)
-
-    func_name = "Read input data"
-    tt.start(func_name)
-    # Create AssetClass objects from .csv file
-    asset_classes, corr_matrix, risk_free_rate, available_rate, period, user_portfolios = read_excel_input(returns_file, file_type)
-    tt.end(func_name)
+    # Prepare TimeTracker (shared with the @TimeTracker.track decorated functions)
+    tt = TimeTracker.get_tracker()
+
+    with tt.section("Read command line arguments"):
+        # Get command line arguments
+        user_input = get_args()
+        returns_file  = user_input[ASSET_RETURNS]
+        file_type = user_input[FILE_TYPE]
+        time_flag = user_input[TIME_FLAG]
+        workers   = user_input[WORKERS]
+        sample_size = user_input[SAMPLES]
+        seed      = user_input[SEED]
+        solver_flag = user_input[SOLVER_FLAG]
+        use_cache = user_input[CACHE_FLAG]
+        period_override = user_input[PERIOD]
+        prune     = user_input[PRUNE_FLAG]
+        sampler   = user_input[SAMPLER]
+        stream    = user_input[STREAM_FLAG]
+        best_only = user_input[BEST_ONLY_FLAG]
+        params_file = user_input[PARAMS_FILE]
+        backtest  = user_input[BACKTEST]
+        resamples = user_input[RESAMPLE]
+        allocation = user_input[ALLOCATION]
+
+    # Memory deltas are only recorded for the report (tracemalloc slows down allocations)
+    if time_flag:
+        tt.start_memory_tracking()
+
+    eff_frontier, optimal_portfolio, user_portfolios, risk_free_rate, period, cal = build_efficient_frontier(
+        returns_file, file_type, sample_size, workers, seed, solver_flag, use_cache, period_override, prune, sampler, stream, show_progress=True, best_only=best_only, params_file=params_file, resamples=resamples)
 
     for p in user_portfolios:
         print(p)
 
-    func_name = "create_portfolios"
-    tt.start(func_name)
-    # Generate portfolios
-    portfolios = create_portfolios(asset_classes, corr_matrix, SAMPLE_SIZE)
-    tt.end(func_name)
-
-    func_name = "portfolios_df_conversion"
-    tt.start(func_name)
-    portfolios_df = obj.convert_portfolios_into_df(portfolios)
-    tt.end(func_name)
-
-    func_name = "compute_sharpe"
-    tt.start(func_name)
-    portfolios_df = compute_sharpe(portfolios_df, risk_free_rate)
-    tt.end(func_name)
-
-    func_name = "get_scatter_plot"
-    tt.start(func_name)
-    eff_frontier = gr.get_scatter_plot(portfolios_df, title=f"Efficient Frontier based on {period.lower()} returns : {SAMPLE_SIZE} portfolios")
-    eff_frontier, optimal_portfolio = gr.add_CAL(eff_frontier, portfolios_df, risk_free_rate)
-    eff_frontier = gr.add_user_portfolios(eff_frontier, user_portfolios)
-    eff_frontier.show()
-    tt.end(func_name)
+    with tt.section("show"):
+        eff_frontier.show()
 
     print("\n~~~ Optimal Portfolio (with given asset classes) ~~~\n")
     print(optimal_portfolio)
 
+    if backtest is not None:
+        import Backtest
+        with tt.section("backtest"):
+            rebalance = get_rebalance_period(backtest)
+            table = Backtest.backtest_portfolios([optimal_portfolio] + user_portfolios, optimal_portfolio.universe, period, rebalance, risk_free_rate)
+        print(f"\n~~~ Backtest ({period.lower()} returns, rebalancing : {backtest}) ~~~\n")
+        print(table.round(2).to_string())
+
+    if allocation is not None:
+        kind, targets = allocation
+        with tt.section("allocate"):
+            table = cal.allocate(targets, kind)
+        print(f"\n~~~ Allocations (lending at {cal.rf:g}%, borrowing at {cal.rb:g}%) ~~~\n")
+        print(table.round(2).to_string())
+        unreachable = table.index[table.isna().all(axis=1)]
+        if len(unreachable) > 0:
+            print(f"\nWARNING : Unreachable target {kind} {[float(t) for t in unreachable]} (negative risk, E(r) below the risk free rate "
+                  "or above the borrowing portfolio when borrowing does not pay)")
+
     
     
 
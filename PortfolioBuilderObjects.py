@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from xlwings import view
 
 DAYS_IN_YEAR   = 365
 WEEKS_IN_YEAR  = 52
@@ -95,6 +94,33 @@ def convert_tickers_to_AssetClass_obj(composition: dict, asset_classes: list) ->
     return new_dict
 
 
+def get_er_vector(asset_classes: list) -> np.ndarray:
+    """
+    Returns the E(r) of every AssetClass as a NumPy array (same order as asset_classes)
+    """
+    if isinstance(asset_classes, AssetUniverse):
+        return asset_classes.er_vector
+    return np.array([a.getEr() for a in asset_classes], dtype=float)
+
+
+def get_covariance_matrix(asset_classes: list, corr_matrix: object) -> np.ndarray:
+    """
+    Precomputes the covariance matrix of the asset classes as a NumPy array:
+    cov(i,j) = sd(i) * sd(j) * p(i,j)
+
+    Rows and columns follow the order of asset_classes
+    (an AssetUniverse returns the matrix it computed once)
+    """
+    if isinstance(asset_classes, AssetUniverse):
+        return asset_classes.cov_matrix
+
+    names = [a.getName() for a in asset_classes]
+    sd = np.array([a.getSd() for a in asset_classes], dtype=float)
+    corr = corr_matrix.loc[names, names].to_numpy(dtype=float)
+
+    return corr * np.outer(sd, sd)
+
+
 class AssetClass:
     """
     Risky asset classes with:
@@ -196,18 +222,142 @@ class AssetClass:
         return f"AssetClass = [{self.name}, E(r) = {(self.Er)*100:.2f}%, sd = {self.sd:.2f}]"
 
 
+class AssetUniverse:
+    """
+    The set of asset classes of a run, built once (read_excel_input) and shared
+    by the Portfolio objects and the optimizers.
+
+    Holds, as NumPy arrays following the asset class order:
+    - er_vector  : E(r) of every asset class
+    - sd_vector  : sd of every asset class
+    - cov_matrix : annualized covariance matrix, cov(i,j) = sd(i) * sd(j) * p(i,j)
+    and a name -> index map, so portfolio E(r) and sd are computed from integer
+    indexed arrays (no dict or pandas lookups).
+
+    Behaves like the list of AssetClass objects (len, iteration, indexing).
+
+    returns is the historical returns matrix (dates x tickers) the universe was
+    computed from (see Backtest.py) and returns_key identifies it (see 
+    Cache.get_universe_key). Both are None when unknown.
+
+    With a downside risk measure (see use_downside_risk), cov_matrix holds the
+    co-semivariance matrix and sd_vector the downside deviations: portfolio "sd"
+    are then downside deviations.
+    """
+    asset_classes = []
+    corr_matrix = None # Correlation between asset classes' returns (Pandas DataFrame)
+    names = []
+    index = {}         # { name : position }
+    er_vector = None
+    sd_vector = None
+    cov_matrix = None
+    returns = None
+    returns_key = None
+    risk_measure = "sd" # see DownsideRisk.RISK_MEASURES
+    target = None       # annual target return (in %) of the downside risk measures
+    period = None       # periodicity of returns
+
+
+    def __init__(self, asset_classes: list, corr_matrix: object, returns_key: str = None, returns: pd.DataFrame = None):
+        self.asset_classes = list(asset_classes)
+        self.corr_matrix = corr_matrix
+        self.returns = returns
+        self.returns_key = returns_key
+        self.names = [a.getName() for a in self.asset_classes]
+        self.index = {name : i for i, name in enumerate(self.names)}
+
+        self.er_vector = np.array([a.getEr() for a in self.asset_classes], dtype=float)
+        self.sd_vector = np.array([a.getSd() for a in self.asset_classes], dtype=float)
+        corr = corr_matrix.loc[self.names, self.names].to_numpy(dtype=float)
+        self.cov_matrix = corr * np.outer(self.sd_vector, self.sd_vector)
+
+
+    def use_downside_risk(self, risk_measure: str, target: float, period: str) -> None:
+        """
+        Measures risk with the downside deviation below the annual target return (in %)
+        instead of the sd (see DownsideRisk.py). Requires the historical returns.
+        """
+        import DownsideRisk
+
+        if risk_measure == DownsideRisk.SD:
+            return
+        if self.returns is None:
+            raise ValueError("The asset universe does not hold its historical returns")
+
+        self.risk_measure = risk_measure
+        self.target = target
+        self.period = period
+        self.cov_matrix = DownsideRisk.get_cosemivariance_matrix(self.returns[self.names], target, period)
+        self.sd_vector = np.sqrt(np.diag(self.cov_matrix))
+
+
+    def is_exact_downside(self) -> bool:
+        """ True when the exact downside deviation replaces the co-semivariance approximation """
+        import DownsideRisk
+        return self.risk_measure == DownsideRisk.DOWNSIDE_EXACT
+
+
+    def compute_exact_risk(self, weights: np.ndarray) -> np.ndarray:
+        """
+        Exact downside deviation of the (portfolios x n) weights in % (see DownsideRisk.compute_batch_downside)
+        """
+        import DownsideRisk
+        return DownsideRisk.compute_batch_downside(weights, self.returns[self.names], self.target, self.period)
+
+
+    def __len__(self):
+        return len(self.asset_classes)
+
+
+    def __iter__(self):
+        return iter(self.asset_classes)
+
+
+    def __getitem__(self, i):
+        return self.asset_classes[i]
+
+
+    def get_index(self, asset_class) -> int:
+        """ Returns the position of an AssetClass (or ticker) """
+        name = asset_class.getName() if isinstance(asset_class, AssetClass) else asset_class
+        return self.index[name]
+
+
+    def get_weights(self, composition: dict) -> np.ndarray:
+        """
+        Turns a composition dict {AssetClass or ticker : weight} into a weight vector
+        (asset classes missing from the composition weigh 0)
+        """
+        weights = np.zeros(len(self))
+        for asset_class, w in composition.items():
+            weights[self.get_index(asset_class)] += w
+        return weights
+
+
+def get_universe(asset_classes: list, corr_matrix: object) -> AssetUniverse:
+    """
+    Returns asset_classes if it already is an AssetUniverse, builds one otherwise
+    """
+    if isinstance(asset_classes, AssetUniverse):
+        return asset_classes
+    return AssetUniverse(asset_classes, corr_matrix)
+
+
 class Portfolio:
     """
     Portfolios of financial products. 
     Can hold risk free assets, other portfolios or asset classes. 
 
-    TODO
-    OPTIMIZE USING PANDAS !!!!!!
+    E(r) and sd are computed on the integer indexed arrays of an AssetUniverse:
+    pass the universe of the run as corr_matrix (a correlation DataFrame also 
+    works, a universe of the composition's asset classes is then built).
     """
     name = None 
     color = None
     composition = {}
     corr_matrix = None # Correlation between asset classes' returns (Pandas DataFrame)
+    universe = None    # AssetUniverse the weights refer to
+    weights = None     # weight vector (in %) following the universe order
     Er = None # E(r) Expected Return 
     sd = None # standard deviation
 
@@ -215,7 +365,12 @@ class Portfolio:
     def __init__(self, name : str, composition : dict, corr_matrix : object):
         self.name = name
         self.composition = composition
-        self.corr_matrix = corr_matrix
+        if isinstance(corr_matrix, AssetUniverse):
+            self.universe = corr_matrix
+        else:
+            self.universe = AssetUniverse(list(composition), corr_matrix)
+        self.corr_matrix = self.universe.corr_matrix
+        self.weights = self.universe.get_weights(composition)
         self.Er = self.computeEr()
         self.sd = self.computeSd()
 
@@ -233,11 +388,7 @@ class Portfolio:
         w_i  is the weight of asset class i
         Er_i is the expected return of asset class i
         """
-        Er_p = 0
-        for a, w_i in self.composition.items():
-            Er_i = a.getEr()
-            Er_p += w_i * Er_i
-        return Er_p
+        return float(self.weights @ self.universe.er_vector)
 
 
     def computePandasEr():
@@ -250,23 +401,14 @@ class Portfolio:
     def computeSd(self):
         """
         Calculates and returns portfolio standard deviation as:
-        sqrt( ΣΣw(i)w(j)sd(i)sd(j)p(i,j) )
-        """
-        variance = 0
-        n = len(self.composition)
-
-        for asset_i, w_i in self.composition.items():
-            for asset_j, w_j in self.composition.items():
-                name_i = asset_i.getName()
-                name_j = asset_j.getName()
-                corr = self.corr_matrix[name_i][name_j]
-                sd_i = asset_i.getSd()
-                sd_j = asset_j.getSd()
-
-                variance += w_i * w_j * corr * sd_i * sd_j
+        sqrt( ΣΣw(i)w(j)sd(i)sd(j)p(i,j) ) = sqrt( w Σ wᵀ )
 
-        sd = variance ** 0.5
-        return sd
+        (the downside deviation with a downside risk measure, see AssetUniverse.use_downside_risk)
+        """
+        if self.universe.is_exact_downside():
+            return float(self.universe.compute_exact_risk(self.weights)[0])
+        variance = self.weights @ self.universe.cov_matrix @ self.weights
+        return float(max(variance, 0) ** 0.5)
 
 
     def computePandasSd():
@@ -293,6 +435,17 @@ class Portfolio:
         return f"Portfolio = [{self.name}, composition = {self.reprComposition()},\nE(r) = {self.Er}\nsd   = {self.sd}]"
 
 
+    def to_dict(self) -> dict:
+        """
+        Returns the portfolio as a JSON serializable dict (weights in %, keyed by ticker)
+        """
+        composition = {}
+        for asset_class, w in self.composition.items():
+            name = asset_class.getName() if isinstance(asset_class, AssetClass) else str(asset_class)
+            composition[name] = float(w)
+        return {"name" : str(self.name), "composition" : composition, "E(r)" : float(self.Er), "sd" : float(self.sd)}
+
+
 def convert_portfolios_into_df(portfolios: list) -> pd.DataFrame:
     """
     Input:  A list of Portfolio objects
@@ -307,5 +460,114 @@ def convert_portfolios_into_df(portfolios: list) -> pd.DataFrame:
         tuples.append(portfolio_as_tuple)
 
     df = pd.DataFrame(tuples, columns=labels)
-    
+
     return df
+
+
+class PortfolioSet:
+    """
+    Compact columnar store of many portfolios.
+
+    Holds one contiguous (N x n) weight matrix plus the E(r), sd and Sharpe arrays 
+    instead of N Portfolio objects. Memory stays proportional to N x n floats.
+
+    Portfolio objects are only built on demand (get_portfolio) for the few rows 
+    that get printed or highlighted.
+
+    Supports df-like column access so it can be passed to compute_sharpe():
+    portfolio_set["E(r)"], portfolio_set["sd"], portfolio_set["Sharpe"]
+    """
+    asset_classes = []
+    corr_matrix = None
+    weights = None # (N x n) weight matrix in %, columns follow asset_classes
+    Er = None      # E(r) of each portfolio 
+    sd = None      # standard deviation of each portfolio
+    sharpe = None  # Sharpe ratio of each portfolio (None until computed)
+
+    ER     = "E(r)"
+    SD     = "sd"
+    SHARPE = "Sharpe"
+
+
+    def __init__(self, asset_classes: list, corr_matrix: object, weights: np.ndarray, Er: np.ndarray, sd: np.ndarray):
+        if weights.shape != (len(Er), len(asset_classes)) or len(Er) != len(sd):
+            raise ValueError("Weights, E(r) and sd do not describe the same portfolios.")
+
+        self.asset_classes = asset_classes
+        self.corr_matrix = corr_matrix
+        self.universe = None # built on first use (get_portfolio)
+        self.weights = np.ascontiguousarray(weights, dtype=np.float64)
+        self.Er = np.asarray(Er, dtype=np.float64)
+        self.sd = np.asarray(sd, dtype=np.float64)
+        self.sharpe = None
+
+
+    def __len__(self):
+        return len(self.Er)
+
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        if column == self.ER:
+            return self.Er
+        if column == self.SD:
+            return self.sd
+        if column == self.SHARPE and self.sharpe is not None:
+            return self.sharpe
+        raise KeyError(column)
+
+
+    def __setitem__(self, column: str, values: np.ndarray) -> None:
+        if column != self.SHARPE:
+            raise KeyError(f"Only the '{self.SHARPE}' column can be assigned")
+        self.sharpe = np.asarray(values, dtype=np.float64)
+
+
+    def nbytes(self) -> int:
+        """ Returns the memory used by the arrays of the set in bytes """
+        total = self.weights.nbytes + self.Er.nbytes + self.sd.nbytes
+        if self.sharpe is not None:
+            total += self.sharpe.nbytes
+        return total
+
+
+    def get_portfolio(self, index: int, name: str = None) -> Portfolio:
+        """
+        Builds the Portfolio object of a single row (named Portfolio<row number> by default)
+        """
+        composition = {}
+        for j, asset_class in enumerate(self.asset_classes):
+            composition[asset_class] = float(self.weights[index, j])
+
+        if name is None:
+            name = f"Portfolio{index + 1}"
+        if self.universe is None:
+            self.universe = get_universe(self.asset_classes, self.corr_matrix)
+        return Portfolio(name, composition, self.universe)
+
+
+    def get_max_sharpe_index(self) -> int:
+        """
+        Returns the row index of the portfolio with the highest Sharpe ratio
+        """
+        if self.sharpe is None:
+            raise ValueError("Sharpe ratios have not been computed yet. Use compute_sharpe() first.")
+        return int(np.argmax(self.sharpe))
+
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame with the "E(r)", "sd" (and "Sharpe") columns only.
+        Used for plotting, no Portfolio object is created.
+        """
+        columns = {self.ER: self.Er, self.SD: self.sd}
+        if self.sharpe is not None:
+            columns[self.SHARPE] = self.sharpe
+        return pd.DataFrame(columns, copy=False)
+
+
+def convert_batch_into_portfolio_set(batch: dict, asset_classes: list, corr_matrix: object) -> PortfolioSet:
+    """
+    Input:  A dict of columnar arrays (see PortfolioEngine.create_portfolio_batch)
+    Output: A PortfolioSet holding the same portfolios
+    """
+    return PortfolioSet(asset_classes, corr_matrix, batch["Weights"], batch["E(r)"], batch["sd"])
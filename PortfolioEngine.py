@@ -0,0 +1,655 @@
+"""
+~~~ Portfolio Engine ~~~
+
+Vectorized computations for large batches of portfolios.
+
+Instead of building one Portfolio object per sample (and looking up the
+correlation matrix in pandas for every pair of asset classes), the engine draws
+the whole weight matrix as one NumPy array and computes every E(r) and sd as
+matrix operations on a precomputed covariance matrix.
+
+Weights follow the same convention as Portfolio compositions: in % (rows sum to 100)
+
+Large samples can be split into shards and spread over a process pool
+(create_portfolio_batch_parallel). Every shard gets its own RNG stream spawned
+from a single seed, and workers write their results straight into shared memory.
+
+Pruned mode (create_pruned_portfolio_batch) streams the shards through a
+FrontierPruner instead of keeping every portfolio: only the upper envelope of
+the cloud (best E(r) per sd bucket) and a fixed-size reservoir sample (background
+of the plot) are kept. Memory stays bounded whatever the sample size.
+
+Streaming mode (stream_portfolios) goes further for samples of 100M+ portfolios: 
+chunks produced by a generator (iter_portfolio_chunks) update running aggregates 
+(StreamSummary: best Sharpe ratio, upper envelope, 2D histogram of the cloud for 
+the plot) and are discarded right away. Progress is reported after every chunk.
+
+Weights are drawn by one of the samplers of Samplers.py (uniform, Dirichlet,
+Sobol, edge/corner biased).
+
+Best-only mode (find_best_portfolio) only looks for the portfolio with the best
+Sharpe ratio: sampling, scoring and reduction are fused in one kernel (Kernels.py),
+compiled with Numba when it is installed and in NumPy otherwise.
+"""
+import Kernels
+import Samplers
+import TimeTracker
+import numpy as np
+import functools
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Batch column labels (same labels as the portfolios DataFrame)
+WEIGHTS = "Weights"
+ER      = "E(r)"
+SD      = "sd"
+
+# Number of rows processed at once when computing variances.
+# Bounds the size of the temporary (rows x n) arrays.
+CHUNK_SIZE = 100_000
+
+# Number of portfolios in each shard of a parallel run.
+# Shards (and their RNG streams) only depend on the sample size, so a given seed 
+# produces the same portfolios no matter how many workers are used.
+SHARD_SIZE = 100_000
+
+# Pruned mode
+ENVELOPE_BUCKETS = 10_000 # number of sd buckets of the upper envelope
+RESERVOIR_SIZE   = 20_000 # number of random portfolios kept for the background cloud
+SHARDS_PER_TASK  = 10     # shards pruned by a worker before sending its results back
+
+# Streaming mode: resolution of the histogram of the cloud (sd bins, E(r) bins)
+HISTOGRAM_BINS = (500, 400)
+
+
+@TimeTracker.track
+def get_random_weights_batch(sample_size: int, n: int, rng=None, out=None, sampler: str = Samplers.DEFAULT_SAMPLER, start: int = 0, seed_seq=None) -> np.ndarray:
+    """
+    Creates a (sample_size x n) matrix of random weights drawn by sampler (see Samplers.py).
+    Each row sums up to 100 (%)
+
+    Samplers.UNIFORM gives the distribution of the original per-portfolio sampling:
+    i.i.d. uniforms scaled to 100
+
+    If out is provided (float64, C-contiguous), the weights are written into it
+    start and seed_seq place the rows in the whole sample (Sobol sequence)
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed_seq)
+
+    if out is None:
+        out = np.empty((sample_size, n))
+
+    return Samplers.fill_weights(out, sampler, rng, start, seed_seq)
+
+
+@TimeTracker.track
+def compute_batch_er(weights: np.ndarray, er_vector: np.ndarray) -> np.ndarray:
+    """
+    Computes the expected return of every portfolio (row) in weights:
+    Er_p = W @ Er
+    """
+    return weights @ er_vector
+
+
+@TimeTracker.track
+def compute_batch_sd(weights: np.ndarray, cov_matrix: np.ndarray) -> np.ndarray:
+    """
+    Computes the standard deviation of every portfolio (row) in weights:
+    sd_p = sqrt( w Σ wᵀ )
+
+    Rows are processed in chunks of CHUNK_SIZE to avoid large temporaries
+    """
+    sample_size = weights.shape[0]
+    variance = np.empty(sample_size)
+
+    for start in range(0, sample_size, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, sample_size)
+        w = weights[start:stop]
+        variance[start:stop] = np.einsum("ij,ij->i", w @ cov_matrix, w)
+
+    # Guard against tiny negative values caused by floating point errors
+    np.maximum(variance, 0, out=variance)
+    return np.sqrt(variance)
+
+
+@TimeTracker.track
+def create_portfolio_batch(er_vector: np.ndarray, cov_matrix: np.ndarray, sample_size: int, rng=None, sampler: str = Samplers.DEFAULT_SAMPLER) -> dict:
+    """
+    Samples sample_size random portfolios at once
+
+    Returns a dict of columnar arrays:
+    {
+        "Weights" : (sample_size x n) weight matrix (in %), columns in asset class order
+        "E(r)"    : expected returns,
+        "sd"      : standard deviations
+    }
+    The dict can be passed to compute_sharpe() directly
+    """
+    n = len(er_vector)
+    weights = get_random_weights_batch(sample_size, n, rng, sampler=sampler)
+
+    batch = {
+        WEIGHTS : weights,
+        ER      : compute_batch_er(weights, er_vector),
+        SD      : compute_batch_sd(weights, cov_matrix)
+    }
+    return batch
+
+
+def _fill_shard(weights: np.ndarray, Er: np.ndarray, sd: np.ndarray, er_vector: np.ndarray, cov_matrix: np.ndarray, seed_seq, 
+                start: int = 0, sampler: str = Samplers.DEFAULT_SAMPLER) -> None:
+    """
+    Samples one shard of portfolios (rows start to start + len(Er) of the sample)
+    into the provided (views of the) output arrays
+    """
+    rng = np.random.default_rng(seed_seq)
+    get_random_weights_batch(weights.shape[0], weights.shape[1], rng, out=weights, sampler=sampler, start=start, seed_seq=seed_seq)
+    Er[:] = compute_batch_er(weights, er_vector)
+    sd[:] = compute_batch_sd(weights, cov_matrix)
+
+
+def _attach_shared_array(name: str, shape: tuple):
+    """
+    Attaches to an existing shared memory block and returns (block, ndarray view)
+    """
+    # The parent process owns (and unlinks) the block. Pool workers share the
+    # parent's resource tracker, so attaching does not transfer ownership.
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+
+# State of a pool worker, set once by _init_worker
+_worker = {}
+
+def _init_worker(weights_name: str, er_name: str, sd_name: str, sample_size: int, n: int, er_vector: np.ndarray, cov_matrix: np.ndarray, sampler: str) -> None:
+    """ Pool initializer: attaches the worker to the shared output arrays """
+    _worker["blocks"] = []
+    for key, name, shape in ((WEIGHTS, weights_name, (sample_size, n)), (ER, er_name, (sample_size,)), (SD, sd_name, (sample_size,))):
+        block, array = _attach_shared_array(name, shape)
+        _worker["blocks"].append(block)
+        _worker[key] = array
+    _worker["er_vector"] = er_vector
+    _worker["cov_matrix"] = cov_matrix
+    _worker["sampler"] = sampler
+
+
+def _sample_shard(task: tuple) -> int:
+    """ Pool task: samples rows [start, stop) into the shared output arrays """
+    start, stop, seed_seq = task
+    _fill_shard(_worker[WEIGHTS][start:stop], _worker[ER][start:stop], _worker[SD][start:stop],
+                _worker["er_vector"], _worker["cov_matrix"], seed_seq, start, _worker["sampler"])
+    return stop - start
+
+
+def get_shards(sample_size: int, seed=None) -> list:
+    """
+    Splits sample_size into shards of SHARD_SIZE portfolios
+
+    Returns a list of (start, stop, seed_sequence) tuples. 
+    Each shard gets an independent RNG stream spawned from seed.
+    """
+    bounds = list(range(0, sample_size, SHARD_SIZE)) + [sample_size]
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(bounds) - 1)
+
+    shards = []
+    for i, seed_seq in enumerate(seed_seqs):
+        shards.append((bounds[i], bounds[i + 1], seed_seq))
+    return shards
+
+
+def iter_portfolio_chunks(er_vector: np.ndarray, cov_matrix: np.ndarray, shards: list, sampler: str = Samplers.DEFAULT_SAMPLER):
+    """
+    Generator sampling the shards one after the other
+
+    Yields (weights, Er, sd) of every shard. The arrays are views of buffers
+    reused by the next shard: only one shard is in memory at any time.
+    """
+    n = len(er_vector)
+    size = max((stop - start for start, stop, _ in shards), default=0)
+    weights = np.empty((size, n))
+    Er = np.empty(size)
+    sd = np.empty(size)
+
+    for start, stop, seed_seq in shards:
+        size = stop - start
+        _fill_shard(weights[:size], Er[:size], sd[:size], er_vector, cov_matrix, seed_seq, start, sampler)
+        yield weights[:size], Er[:size], sd[:size]
+
+
+@TimeTracker.track
+def create_portfolio_batch_parallel(er_vector: np.ndarray, cov_matrix: np.ndarray, sample_size: int, workers: int, seed=None, sampler: str = Samplers.DEFAULT_SAMPLER) -> dict:
+    """
+    Same output as create_portfolio_batch(), but the sample is split into shards 
+    spread over a pool of workers processes.
+
+    Workers write their shards straight into shared memory arrays (nothing but 
+    the shard bounds and seeds is pickled). Once every shard is done, the 
+    shared arrays are copied into regular arrays forming a single frontier.
+
+    With workers <= 1 the shards are sampled in this process (same result for a given seed).
+    """
+    n = len(er_vector)
+    shards = get_shards(sample_size, seed)
+
+    if workers <= 1:
+        weights = np.empty((sample_size, n))
+        Er = np.empty(sample_size)
+        sd = np.empty(sample_size)
+        for start, stop, seed_seq in shards:
+            _fill_shard(weights[start:stop], Er[start:stop], sd[start:stop], er_vector, cov_matrix, seed_seq, start, sampler)
+        return {WEIGHTS : weights, ER : Er, SD : sd}
+
+    item_size = np.dtype(np.float64).itemsize
+    blocks = []
+    try:
+        weights_block = shared_memory.SharedMemory(create=True, size=max(1, sample_size * n * item_size))
+        blocks.append(weights_block)
+        er_block = shared_memory.SharedMemory(create=True, size=max(1, sample_size * item_size))
+        blocks.append(er_block)
+        sd_block = shared_memory.SharedMemory(create=True, size=max(1, sample_size * item_size))
+        blocks.append(sd_block)
+
+        init_args = (weights_block.name, er_block.name, sd_block.name, sample_size, n, er_vector, cov_matrix, sampler)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+            for _ in pool.imap_unordered(_sample_shard, shards):
+                pass
+
+        batch = {
+            WEIGHTS : np.ndarray((sample_size, n), dtype=np.float64, buffer=weights_block.buf).copy(),
+            ER      : np.ndarray((sample_size,), dtype=np.float64, buffer=er_block.buf).copy(),
+            SD      : np.ndarray((sample_size,), dtype=np.float64, buffer=sd_block.buf).copy()
+        }
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return batch
+
+
+class FrontierPruner:
+    """
+    Bounded-memory summary of a stream of portfolios:
+    1. Upper envelope: the portfolio with the highest E(r) in each of the 
+       buckets splitting [0, max_sd] (sd axis)
+    2. Reservoir: a uniform random sample of reservoir_size portfolios
+
+    The max Sharpe portfolio of the stream always falls in the envelope bucket 
+    of its sd, so the optimum found among the kept portfolios is within one
+    bucket width (max_sd / buckets) of the true one.
+    """
+    def __init__(self, n: int, max_sd: float, buckets: int = ENVELOPE_BUCKETS, reservoir_size: int = RESERVOIR_SIZE, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+
+        self.n = n
+        self.max_sd = max_sd
+        self.buckets = buckets
+        self.rng = rng
+        self.count = 0 # number of portfolios seen
+
+        self.envelope_er = np.full(buckets, -np.inf)
+        self.envelope_sd = np.zeros(buckets)
+        self.envelope_weights = np.zeros((buckets, n))
+
+        self.reservoir_size = reservoir_size
+        self.reservoir_filled = 0
+        self.reservoir_er = np.zeros(reservoir_size)
+        self.reservoir_sd = np.zeros(reservoir_size)
+        self.reservoir_weights = np.zeros((reservoir_size, n))
+
+
+    def get_buckets(self, sd: np.ndarray) -> np.ndarray:
+        """ Returns the envelope bucket of each sd """
+        buckets = (sd * (self.buckets / self.max_sd)).astype(np.int64)
+        return np.clip(buckets, 0, self.buckets - 1)
+
+
+    def update_envelope(self, weights: np.ndarray, Er: np.ndarray, sd: np.ndarray) -> None:
+        """ Keeps the best E(r) of each sd bucket """
+        buckets = self.get_buckets(sd)
+
+        # Only rows beating the current best of their bucket can change the envelope
+        candidates = np.flatnonzero(Er > self.envelope_er[buckets])
+        if len(candidates) == 0:
+            return
+
+        # Best candidate of every bucket
+        order = candidates[np.lexsort((Er[candidates], buckets[candidates]))]
+        last = np.r_[buckets[order][1:] != buckets[order][:-1], True]
+        best_rows = order[last]
+        best_buckets = buckets[best_rows]
+
+        better = Er[best_rows] > self.envelope_er[best_buckets]
+        rows = best_rows[better]
+        targets = best_buckets[better]
+        self.envelope_er[targets] = Er[rows]
+        self.envelope_sd[targets] = sd[rows]
+        self.envelope_weights[targets] = weights[rows]
+
+
+    def update_reservoir(self, weights: np.ndarray, Er: np.ndarray, sd: np.ndarray) -> None:
+        """ Vectorized reservoir sampling (algorithm R) """
+        size = len(Er)
+
+        # Fill the free slots first
+        free = min(self.reservoir_size - self.reservoir_filled, size)
+        if free > 0:
+            slots = np.arange(self.reservoir_filled, self.reservoir_filled + free)
+            self.reservoir_er[slots] = Er[:free]
+            self.reservoir_sd[slots] = sd[:free]
+            self.reservoir_weights[slots] = weights[:free]
+            self.reservoir_filled += free
+
+        # Row i (stream position t) replaces a random slot with probability k / (t + 1)
+        if free < size:
+            positions = self.count + np.arange(free, size)
+            slots = (self.rng.random(size - free) * (positions + 1)).astype(np.int64)
+            kept = np.flatnonzero(slots < self.reservoir_size)
+            rows = kept + free
+            # Repeated slots: the last row wins, same as a sequential reservoir
+            self.reservoir_er[slots[kept]] = Er[rows]
+            self.reservoir_sd[slots[kept]] = sd[rows]
+            self.reservoir_weights[slots[kept]] = weights[rows]
+
+
+    @TimeTracker.track(name="FrontierPruner.update")
+    def update(self, weights: np.ndarray, Er: np.ndarray, sd: np.ndarray) -> None:
+        """ Adds a chunk of portfolios to the summary """
+        if len(Er) == 0:
+            return
+        self.update_envelope(weights, Er, sd)
+        self.update_reservoir(weights, Er, sd)
+        self.count += len(Er)
+
+
+    def merge(self, other) -> None:
+        """
+        Merges the summary of another (disjoint) stream of portfolios into this one
+        """
+        # Envelope: best of both in each bucket
+        better = other.envelope_er > self.envelope_er
+        self.envelope_er[better] = other.envelope_er[better]
+        self.envelope_sd[better] = other.envelope_sd[better]
+        self.envelope_weights[better] = other.envelope_weights[better]
+
+        # Reservoir: draw from each side in proportion to the number of portfolios it has seen
+        total = self.count + other.count
+        k = min(self.reservoir_size, self.reservoir_filled + other.reservoir_filled)
+        if total > 0 and k > 0:
+            from_self, from_other = self.rng.multivariate_hypergeometric([self.count, other.count], k)
+            from_self = min(from_self, self.reservoir_filled)
+            from_other = k - from_self
+            mine = self.rng.choice(self.reservoir_filled, from_self, replace=False)
+            theirs = self.rng.choice(other.reservoir_filled, from_other, replace=False)
+
+            self.reservoir_er[:k] = np.concatenate([self.reservoir_er[mine], other.reservoir_er[theirs]])
+            self.reservoir_sd[:k] = np.concatenate([self.reservoir_sd[mine], other.reservoir_sd[theirs]])
+            self.reservoir_weights[:k] = np.concatenate([self.reservoir_weights[mine], other.reservoir_weights[theirs]])
+            self.reservoir_filled = k
+
+        self.count = total
+
+
+    def get_envelope_mask(self) -> np.ndarray:
+        """
+        Returns the mask of the buckets on the Pareto upper envelope:
+        non empty and with a higher E(r) than every bucket of lower sd
+        """
+        filled = np.isfinite(self.envelope_er)
+        running_max = np.maximum.accumulate(np.where(filled, self.envelope_er, -np.inf))
+        previous_max = np.r_[-np.inf, running_max[:-1]]
+        return filled & (self.envelope_er > previous_max)
+
+
+    def get_batch(self) -> dict:
+        """
+        Returns the kept portfolios (envelope first, then reservoir) as a batch
+        {"Weights" : ..., "E(r)" : ..., "sd" : ...}
+        """
+        mask = self.get_envelope_mask()
+        k = self.reservoir_filled
+        return {
+            WEIGHTS : np.concatenate([self.envelope_weights[mask], self.reservoir_weights[:k]]),
+            ER      : np.concatenate([self.envelope_er[mask], self.reservoir_er[:k]]),
+            SD      : np.concatenate([self.envelope_sd[mask], self.reservoir_sd[:k]])
+        }
+
+
+def get_max_sd(cov_matrix: np.ndarray) -> float:
+    """
+    Upper bound of the sd of any long-only portfolio (weights in %):
+    sd_p <= Σ w_i sd_i <= 100 * max(sd_i)
+    """
+    return 100 * float(np.sqrt(np.max(np.diag(cov_matrix))))
+
+
+def _prune_shards(task: tuple, progress=None) -> FrontierPruner:
+    """
+    Samples a group of shards and returns their summary, created by
+    new_summary(rng=...) with the RNG stream of the task (seed_seq)
+    Used in process and as a pool task
+
+    progress(count) is called after every shard
+    """
+    shards, er_vector, cov_matrix, sampler, new_summary, seed_seq = task
+    # Created here rather than by the caller: only the summaries being filled are in memory
+    pruner = new_summary(rng=np.random.default_rng(seed_seq))
+
+    for weights, Er, sd in iter_portfolio_chunks(er_vector, cov_matrix, shards, sampler):
+        pruner.update(weights, Er, sd)
+        if progress is not None:
+            progress(len(Er))
+
+    return pruner
+
+
+def _run_pruned_tasks(tasks: list, pruner: FrontierPruner, workers: int = 1, progress=None) -> FrontierPruner:
+    """
+    Runs the _prune_shards tasks in process or over a pool of workers processes
+    and merges their summaries into pruner, in order (same result for any number of workers)
+
+    progress(count) is called after every shard (in process) or every task (pool)
+    """
+    if workers <= 1:
+        for task in tasks:
+            pruner.merge(_prune_shards(task, progress))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for task_pruner in pool.imap(_prune_shards, tasks):
+                pruner.merge(task_pruner)
+                if progress is not None:
+                    progress(task_pruner.count)
+
+    return pruner
+
+
+def get_task_seeds(shards: list, seed=None) -> tuple:
+    """
+    Groups the shards into tasks of SHARDS_PER_TASK shards
+
+    Returns (groups, seed sequences of the tasks, seed sequence of the final merge).
+    Their RNG streams are independent from the ones of the shards
+    """
+    groups = [shards[i:i + SHARDS_PER_TASK] for i in range(0, len(shards), SHARDS_PER_TASK)]
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(shards) + len(groups) + 1)[len(shards):]
+    return groups, seed_seqs[:-1], seed_seqs[-1]
+
+
+@TimeTracker.track
+def create_pruned_portfolio_batch(er_vector: np.ndarray, cov_matrix: np.ndarray, sample_size: int, workers: int = 1, seed=None, sampler: str = Samplers.DEFAULT_SAMPLER) -> dict:
+    """
+    Samples sample_size portfolios (same portfolios as create_portfolio_batch_parallel
+    for a given seed) but only keeps the upper envelope and a reservoir sample of them.
+
+    Groups of SHARDS_PER_TASK shards are pruned in process or over a pool of workers
+    processes, then merged in order. Memory is bounded by the size of a few shards
+    and summaries, whatever the sample size.
+
+    Returns a batch {"Weights" : ..., "E(r)" : ..., "sd" : ...} of a few thousand portfolios
+    """
+    n = len(er_vector)
+    max_sd = get_max_sd(cov_matrix)
+    shards = get_shards(sample_size, seed)
+
+    # Reservoir RNG streams
+    groups, seed_seqs, merge_seed_seq = get_task_seeds(shards, seed)
+    new_summary = functools.partial(FrontierPruner, n, max_sd)
+    tasks = [(group, er_vector, cov_matrix, sampler, new_summary, seed_seqs[i]) for i, group in enumerate(groups)]
+
+    pruner = FrontierPruner(n, max_sd, rng=np.random.default_rng(merge_seed_seq))
+    pruner = _run_pruned_tasks(tasks, pruner, workers)
+    return pruner.get_batch()
+
+
+class StreamSummary(FrontierPruner):
+    """
+    Running aggregates of a stream of portfolios (streaming mode), on top of
+    the envelope and reservoir of FrontierPruner:
+    1. Best Sharpe ratio: the exact max Sharpe portfolio of the stream
+    2. Histogram: number of portfolios in each cell of a fixed (sd, E(r)) grid,
+       enough to draw the whole cloud as a density plot
+
+    Memory does not depend on the number of portfolios seen. Summaries of 
+    disjoint streams can be merged (workers).
+    """
+    def __init__(self, n: int, max_sd: float, er_range: tuple, rf: float, bins: tuple = HISTOGRAM_BINS, 
+                 buckets: int = ENVELOPE_BUCKETS, reservoir_size: int = RESERVOIR_SIZE, rng=None):
+        super().__init__(n, max_sd, buckets, reservoir_size, rng)
+        self.rf = rf
+
+        self.best_sharpe = -np.inf
+        self.best_er = 0.0
+        self.best_sd = 0.0
+        self.best_weights = np.zeros(n)
+
+        # Fixed edges: every summary of the same run shares the same grid
+        self.bins = bins
+        er_min, er_max = er_range
+        if er_max <= er_min:
+            er_max = er_min + 1
+        self.sd_edges = np.linspace(0, max_sd, bins[0] + 1)
+        self.er_edges = np.linspace(er_min, er_max, bins[1] + 1)
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+
+    def update_best_sharpe(self, weights: np.ndarray, Er: np.ndarray, sd: np.ndarray) -> None:
+        """ Keeps the portfolio with the highest Sharpe ratio (first one on ties) """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sharpe = np.maximum(0, (Er - self.rf) / sd)
+        sharpe[np.isnan(sharpe)] = 0
+        i = int(np.argmax(sharpe))
+        if sharpe[i] > self.best_sharpe:
+            self.best_sharpe = float(sharpe[i])
+            self.best_er = float(Er[i])
+            self.best_sd = float(sd[i])
+            self.best_weights = weights[i].copy()
+
+
+    def update_histogram(self, Er: np.ndarray, sd: np.ndarray) -> None:
+        """ Counts the portfolios of every (sd, E(r)) cell """
+        sd_bins, er_bins = self.bins
+        x = ((sd - self.sd_edges[0]) * (sd_bins / (self.sd_edges[-1] - self.sd_edges[0]))).astype(np.int64)
+        y = ((Er - self.er_edges[0]) * (er_bins / (self.er_edges[-1] - self.er_edges[0]))).astype(np.int64)
+        np.clip(x, 0, sd_bins - 1, out=x)
+        np.clip(y, 0, er_bins - 1, out=y)
+        self.histogram += np.bincount(x * er_bins + y, minlength=sd_bins * er_bins).reshape(self.bins)
+
+
+    def update(self, weights: np.ndarray, Er: np.ndarray, sd: np.ndarray) -> None:
+        """ Adds a chunk of portfolios to the summary """
+        if len(Er) == 0:
+            return
+        self.update_best_sharpe(weights, Er, sd)
+        self.update_histogram(Er, sd)
+        super().update(weights, Er, sd)
+
+
+    def merge(self, other) -> None:
+        """
+        Merges the summary of another (disjoint, later) stream of portfolios into this one
+        """
+        if other.best_sharpe > self.best_sharpe:
+            self.best_sharpe = other.best_sharpe
+            self.best_er = other.best_er
+            self.best_sd = other.best_sd
+            self.best_weights = other.best_weights
+        self.histogram += other.histogram
+        super().merge(other)
+
+
+def get_er_range(er_vector: np.ndarray) -> tuple:
+    """
+    Range of the E(r) of any long-only portfolio (weights in %):
+    100 * min(E(r)_i) <= E(r)_p <= 100 * max(E(r)_i)
+    """
+    return 100 * float(np.min(er_vector)), 100 * float(np.max(er_vector))
+
+
+@TimeTracker.track(name="PortfolioEngine.stream_portfolios")
+def stream_portfolios(er_vector: np.ndarray, cov_matrix: np.ndarray, sample_size: int, rf: float, workers: int = 1, seed=None, 
+                      sampler: str = Samplers.DEFAULT_SAMPLER, progress=None) -> StreamSummary:
+    """
+    Streaming mode: samples sample_size portfolios (same portfolios as 
+    create_portfolio_batch_parallel for a given seed) chunk by chunk and only 
+    keeps their running aggregates (see StreamSummary).
+
+    Memory stays constant whatever the sample size. progress(count) is called
+    with the number of portfolios sampled since the previous call.
+
+    Returns the StreamSummary of the whole sample
+    """
+    n = len(er_vector)
+    max_sd = get_max_sd(cov_matrix)
+    er_range = get_er_range(er_vector)
+    shards = get_shards(sample_size, seed)
+
+    groups, seed_seqs, merge_seed_seq = get_task_seeds(shards, seed)
+    new_summary = functools.partial(StreamSummary, n, max_sd, er_range, rf)
+    tasks = [(group, er_vector, cov_matrix, sampler, new_summary, seed_seqs[i]) for i, group in enumerate(groups)]
+
+    summary = StreamSummary(n, max_sd, er_range, rf, rng=np.random.default_rng(merge_seed_seq))
+    return _run_pruned_tasks(tasks, summary, workers, progress)
+
+
+def _find_best_in_range(task: tuple) -> tuple:
+    """ Pool task: best Sharpe ratio of the portfolios at positions [start, stop) """
+    er_vector, cov_matrix, rf, start, stop, seed, sampler = task
+    return Kernels.find_best_sharpe(er_vector, cov_matrix, rf, start, stop, seed, sampler)
+
+
+@TimeTracker.track(name="PortfolioEngine.find_best_portfolio")
+def find_best_portfolio(er_vector: np.ndarray, cov_matrix: np.ndarray, sample_size: int, rf: float, workers: int = 1, seed=None,
+                        sampler: str = Samplers.DEFAULT_SAMPLER) -> dict:
+    """
+    Best-only mode: samples sample_size portfolios and only keeps the one with the
+    best Sharpe ratio (fused kernel of Kernels.py, no portfolio is stored).
+
+    The compiled kernel runs on every core by itself; without Numba the sample is
+    split over a pool of workers processes. Either way the result only depends on
+    the seed (ties go to the first portfolio of the sample).
+
+    Returns a batch of one portfolio (same format as create_portfolio_batch)
+    """
+    # The weights of the best portfolio are redrawn from the seed: fix it
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    if Kernels.is_available() or workers <= 1:
+        _, best_row = Kernels.find_best_sharpe(er_vector, cov_matrix, rf, 0, sample_size, seed, sampler)
+    else:
+        bounds = np.linspace(0, sample_size, workers * SHARDS_PER_TASK + 1).astype(np.int64)
+        tasks = [(er_vector, cov_matrix, rf, int(start), int(stop), seed, sampler) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        best_sharpe, best_row = -1.0, -1
+        with multiprocessing.Pool(workers) as pool:
+            for sharpe, row in pool.imap(_find_best_in_range, tasks):
+                if sharpe > best_sharpe:
+                    best_sharpe, best_row = sharpe, row
+
+    weights = Kernels.get_weights_at([best_row], len(er_vector), seed, sampler)
+    return {
+        WEIGHTS : weights,
+        ER      : compute_batch_er(weights, er_vector),
+        SD      : compute_batch_sd(weights, cov_matrix)
+    }
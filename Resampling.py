@@ -0,0 +1,182 @@
+"""
+~~~ Resampling ~~~
+
+Resampled efficiency (Michaud): the tangency portfolio solved on the historical
+E(r) and covariance matrix is very sensitive to their estimation errors (above
+all the E(r)). Resampling averages it over many plausible histories:
+1. draw num_resamples bootstrap samples of the historical returns (dates drawn
+   with replacement, the returns of a date are kept together)
+2. estimate the E(r) and covariance matrix of every sample
+3. solve the tangency portfolio of every sample (FrontierSolver)
+4. average their weights
+
+A bootstrap sample is fully described by how many times it draws every date, so
+the estimation step is vectorized: the sums of a block of samples are weighted
+sums of the returns, computed for the whole block with a few matrix products
+(no resampled returns matrix is built). E(r), sd and correlations follow the
+same formulas as AssetClass and df.corr() (NaN returns skipped pairwise).
+With a downside risk measure (see DownsideRisk.py), the co-semivariance matrix
+is estimated instead of the covariance matrix.
+
+Samples are split into tasks of RESAMPLES_PER_TASK spread over a process pool.
+The returns matrix is copied once into shared memory and read by every worker
+(only the task sizes and seeds are pickled). Every task gets its own RNG stream
+spawned from a single seed: a given seed gives the same portfolio whatever the
+number of workers.
+"""
+import PortfolioBuilderObjects as obj
+import FrontierSolver as solver
+import DownsideRisk
+import TimeTracker
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Bootstrap samples estimated (vectorized) and solved per task
+RESAMPLES_PER_TASK = 50
+
+
+def get_bootstrap_counts(num_resamples: int, num_dates: int, rng) -> np.ndarray:
+    """
+    Draws num_resamples bootstrap samples of num_dates dates (with replacement)
+    Returns the (num_resamples x num_dates) number of times every date is drawn
+    """
+    draws = rng.integers(0, num_dates, size=(num_resamples, num_dates))
+    draws += np.arange(num_resamples)[:, None] * num_dates
+    return np.bincount(draws.ravel(), minlength=num_resamples * num_dates).reshape(num_resamples, num_dates).astype(np.float64)
+
+
+def estimate_moments(values: np.ndarray, counts: np.ndarray, period: str, target: float = None) -> tuple:
+    """
+    Estimates the E(r) vectors and covariance matrices of bootstrap samples at once
+
+    values : (dates x n) returns in decimal (NaN = no return)
+    counts : (samples x dates) number of times every date is drawn (see get_bootstrap_counts)
+    target : annual target return in % of a downside risk measure, co-semivariance
+             matrices are then returned instead of covariance matrices
+
+    Returns ((samples x n) E(r), (samples x n x n) covariance matrices)
+    """
+    mask = (~np.isnan(values)).astype(np.float64)
+    returns = np.where(mask > 0, values, 0.0)
+
+    # Weighted sums of every sample, pairwise over the dates where both asset classes have a return
+    weighted_mask = counts[:, :, None] * mask
+    weighted_returns = counts[:, :, None] * returns
+    N = np.matmul(weighted_mask.transpose(0, 2, 1), mask)
+    S = np.matmul(weighted_returns.transpose(0, 2, 1), mask)
+    Q = np.matmul((weighted_returns * returns).transpose(0, 2, 1), mask)
+
+    n_i = np.diagonal(N, axis1=1, axis2=2)
+    s_i = np.diagonal(S, axis1=1, axis2=2)
+    er_vectors = obj.period_to_annual_rate(s_i / n_i / 100, period)
+
+    if target is not None:
+        shortfall = np.minimum(returns - DownsideRisk.get_period_target(target, period), 0)
+        weighted_shortfall = counts[:, :, None] * shortfall
+        cov_matrices = np.matmul(weighted_shortfall.transpose(0, 2, 1), shortfall) / len(values) * obj.get_num_periods_in_year(period)
+        return er_vectors, cov_matrices
+
+    P = np.matmul(weighted_returns.transpose(0, 2, 1), returns)
+    ST = S.transpose(0, 2, 1)
+    QT = Q.transpose(0, 2, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = (N * P - S * ST) / np.sqrt(np.maximum((N * Q - S * S) * (N * QT - ST * ST), 0))
+        variance = (np.diagonal(Q, axis1=1, axis2=2) - s_i * s_i / n_i) / (n_i - 1)
+    corr = np.clip(np.nan_to_num(corr), -1, 1)
+    diagonal = np.arange(values.shape[1])
+    corr[:, diagonal, diagonal] = 1
+
+    sd_vectors = obj.period_to_annual_sd(np.sqrt(np.maximum(variance, 0)), period)
+    cov_matrices = corr * sd_vectors[:, :, None] * sd_vectors[:, None, :]
+    return er_vectors, cov_matrices
+
+
+def solve_resamples(values: np.ndarray, num_resamples: int, seed_seq, period: str, rf: float, target: float = None) -> np.ndarray:
+    """
+    Draws num_resamples bootstrap samples of values and solves their tangency portfolios
+    Returns their (num_resamples x n) weights in %
+    """
+    rng = np.random.default_rng(seed_seq)
+    counts = get_bootstrap_counts(num_resamples, values.shape[0], rng)
+    er_vectors, cov_matrices = estimate_moments(values, counts, period, target)
+
+    weights = np.empty((num_resamples, values.shape[1]))
+    for i in range(num_resamples):
+        weights[i] = solver.solve_tangency(er_vectors[i], solver.get_nearest_psd(cov_matrices[i]), rf) * 100
+    return weights
+
+
+# State of a pool worker, set once by _init_worker
+_worker = {}
+
+def _init_worker(name: str, shape: tuple, period: str, rf: float, target: float) -> None:
+    """ Pool initializer: attaches the worker to the shared (read-only) returns matrix """
+    # The parent process owns (and unlinks) the block
+    _worker["block"] = shared_memory.SharedMemory(name=name)
+    _worker["values"] = np.ndarray(shape, dtype=np.float64, buffer=_worker["block"].buf)
+    _worker["settings"] = (period, rf, target)
+
+
+def _solve_task(task: tuple) -> np.ndarray:
+    """ Pool task: weights of the tangency portfolios of a block of bootstrap samples """
+    num_resamples, seed_seq = task
+    return solve_resamples(_worker["values"], num_resamples, seed_seq, *_worker["settings"])
+
+
+def get_tasks(num_resamples: int, seed=None) -> list:
+    """
+    Splits num_resamples into tasks of RESAMPLES_PER_TASK samples
+    Returns a list of (number of samples, seed sequence) tuples with independent RNG streams
+    """
+    sizes = [min(RESAMPLES_PER_TASK, num_resamples - start) for start in range(0, num_resamples, RESAMPLES_PER_TASK)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+@TimeTracker.track
+def resample_tangency_weights(values: np.ndarray, period: str, rf: float, num_resamples: int, workers: int = 1, seed=None,
+                              target: float = None) -> np.ndarray:
+    """
+    Solves the tangency portfolios of num_resamples bootstrap samples of values
+    (dates x n returns in decimal), over a pool of workers processes
+
+    Returns their (num_resamples x n) weights in % (the resampled portfolio is their mean)
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    tasks = get_tasks(num_resamples, seed)
+
+    if workers <= 1:
+        return np.vstack([solve_resamples(values, size, seed_seq, period, rf, target) for size, seed_seq in tasks])
+
+    block = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=block.buf)[:] = values
+        init_args = (block.name, values.shape, period, rf, target)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+            weights = np.vstack(pool.map(_solve_task, tasks))
+    finally:
+        block.close()
+        block.unlink()
+    return weights
+
+
+def get_resampled_portfolio(asset_classes: list, corr_matrix: object, rf: float, num_resamples: int, workers: int = 1, seed=None) -> obj.Portfolio:
+    """
+    Returns the resampled (Michaud) optimal portfolio of the universe as a Portfolio
+    object: the mean of the tangency portfolios of num_resamples bootstrap samples
+    of its historical returns (see read_excel_input)
+    """
+    universe = obj.get_universe(asset_classes, corr_matrix)
+    if universe.returns is None:
+        raise ValueError("The asset universe does not hold its historical returns")
+    if num_resamples <= 0:
+        raise ValueError("The number of resamples must be positive")
+
+    target = universe.target if universe.risk_measure != DownsideRisk.SD else None
+    period = universe.period if universe.period is not None else universe[0].period
+    weights = resample_tangency_weights(universe.returns[universe.names].to_numpy(dtype=np.float64), period, rf, num_resamples, workers, seed, target)
+
+    composition = {}
+    for asset_class, w in zip(universe, weights.mean(axis=0)):
+        composition[asset_class] = float(w)
+    return obj.Portfolio("Resampled Portfolio", composition, universe)
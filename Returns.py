@@ -0,0 +1,164 @@
+"""
+~~~ Returns ~~~
+
+Processing of historical returns matrices (dates x tickers).
+
+compound_resample() replaces:
+    df.resample(period).apply(lambda x: (1 + x).prod() - 1)
+with grouped products on the raw NumPy array. Same output, including NaN handling:
+NaN returns are skipped and periods without any return compound to 0.
+
+Returns files:
+Returns matrices are exchanged between YahooDataDownloader.py and PortfolioBuilder.py
+as CSV or Parquet files (write_returns_file / read_returns_file): one row per date,
+one column per ticker, decimal returns. Parquet files keep the exact values and
+are the fastest to read (requires pyarrow).
+"""
+import os
+import numpy as np
+import pandas as pd
+
+# csv dialect of returns files
+DELIMITER = ";"
+
+# Returns file extensions -> file types
+RETURNS_FILE_TYPES = {
+    ".csv"     : "csv",
+    ".parquet" : "parquet"
+}
+
+# Label of the date column
+DATE_LABEL = "Date"
+
+# Resample codes (see PortfolioBuilder.translate_period) -> pandas Period frequencies
+# matching the bins of df.resample(code): weeks end on Sunday, months and years at their end
+PERIOD_FREQS = {
+    "D" : "D",
+    "W" : "W-SUN",
+    "M" : "M",
+    "Y" : "Y"
+}
+
+
+def get_period_codes(index: pd.DatetimeIndex, resample_period: str):
+    """
+    Maps every date of index to the number of its period (0 = first period)
+
+    Returns (codes, periods) where periods is the PeriodIndex of every period
+    between the first and the last date (including periods without any date)
+    """
+    freq = PERIOD_FREQS[resample_period]
+    ordinals = index.to_period(freq).asi8
+    first = ordinals.min()
+    periods = pd.period_range(pd.Period(ordinal=first, freq=freq), periods=ordinals.max() - first + 1, freq=freq)
+    return ordinals - first, periods
+
+
+def compound_growth(growth: np.ndarray, codes: np.ndarray, num_periods: int) -> np.ndarray:
+    """
+    Multiplies the growth factors (1 + r) of every row sharing the same period code
+
+    growth : (rows x tickers) growth factors with NaN replaced by 1
+    codes  : period code of every row
+    Returns a (num_periods x tickers) matrix of compounded returns (empty periods -> 0)
+    """
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    growth = growth[order]
+
+    # First row of every non empty period
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+    compounded = np.ones((num_periods, growth.shape[1]))
+    compounded[codes[starts]] = np.multiply.reduceat(growth, starts, axis=0)
+    return compounded - 1
+
+
+def get_period_labels(periods: pd.PeriodIndex) -> pd.DatetimeIndex:
+    """
+    Labels every period by its last day (same labels as df.resample())
+    """
+    return periods.end_time.normalize()
+
+
+def compound_resample(df: pd.DataFrame, resample_period: str) -> pd.DataFrame:
+    """
+    Compounds the returns of df (DatetimeIndex x tickers, decimal returns) into
+    resample_period returns ("D", "W", "M" or "Y")
+    """
+    return compound_resample_all(df, [resample_period])[resample_period]
+
+
+def compound_resample_all(df: pd.DataFrame, resample_periods: list = None) -> dict:
+    """
+    Compounds the returns of df into every period of resample_periods in one pass
+    over the data (default: all of "D", "W", "M" and "Y")
+
+    Returns {resample_period : resampled DataFrame}
+    """
+    if resample_periods is None:
+        resample_periods = list(PERIOD_FREQS)
+
+    index = pd.DatetimeIndex(df.index)
+    growth = df.to_numpy(dtype=np.float64) + 1
+    growth[np.isnan(growth)] = 1
+
+    resampled = {}
+    for resample_period in resample_periods:
+        codes, periods = get_period_codes(index, resample_period)
+        values = compound_growth(growth, codes, len(periods))
+        resampled[resample_period] = pd.DataFrame(values, index=get_period_labels(periods), columns=df.columns)
+
+    return resampled
+
+
+def get_returns_file_type(file_path: str) -> str:
+    """
+    Returns the type of the returns file at file_path ("csv" or "parquet"),
+    None when its extension is not a returns file one
+    """
+    return RETURNS_FILE_TYPES.get(os.path.splitext(file_path)[1].lower())
+
+
+def write_returns_file(df: pd.DataFrame, file_path: str) -> None:
+    """
+    Writes a returns matrix (DatetimeIndex x tickers) into a CSV or Parquet file
+    (type given by the extension of file_path)
+    """
+    file_type = get_returns_file_type(file_path)
+    if file_type is None:
+        raise ValueError(f"Unknown returns file type '{file_path}', use one of {list(RETURNS_FILE_TYPES)}")
+
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    df.index = pd.DatetimeIndex(df.index, name=DATE_LABEL)
+
+    if file_type == "csv":
+        df.to_csv(file_path, sep=DELIMITER)
+    else:
+        df.to_parquet(file_path)
+
+
+def read_returns_file(file_path: str, file_type: str = None) -> pd.DataFrame:
+    """
+    Reads a returns matrix written by write_returns_file (or any CSV with the
+    dates in the first column and one column of decimal returns per ticker)
+
+    Returns a DataFrame (DatetimeIndex x tickers) of float returns
+    """
+    if file_type is None:
+        file_type = get_returns_file_type(file_path)
+
+    if file_type == "csv":
+        df = pd.read_csv(file_path, sep=DELIMITER, index_col=0)
+    elif file_type == "parquet":
+        df = pd.read_parquet(file_path)
+        # Files written by other tools may hold the dates in a column
+        if not isinstance(df.index, pd.DatetimeIndex) and DATE_LABEL in df.columns:
+            df = df.set_index(DATE_LABEL)
+    else:
+        raise ValueError(f"Unknown returns file type '{file_type}', use one of {list(RETURNS_FILE_TYPES.values())}")
+
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index), name=DATE_LABEL)
+    df.columns = [str(c) for c in df.columns]
+    return df.astype(np.float64).sort_index()
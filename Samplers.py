@@ -0,0 +1,221 @@
+"""
+~~~ Samplers ~~~
+
+Random portfolio weights (rows on the simplex: non negative, summing to 100 %).
+
+Normalizing i.i.d. uniforms (the original sampling) does not sample
+the simplex uniformly: portfolios cluster around equal weights and rarely reach
+the corner and edge portfolios that form the upper part of the frontier.
+Samplers:
+- UNIFORM   : i.i.d. uniforms scaled to 100 (original behaviour, default)
+- DIRICHLET : exact uniform distribution on the simplex (Dirichlet(1, ..., 1))
+- SOBOL     : scrambled Sobol low-discrepancy points mapped to the simplex,
+              covers the simplex more evenly than random points
+- EDGE      : edge/corner biased: every portfolio only holds a random number of
+              random asset classes (uniform weights among them), so corners,
+              edges and faces of the simplex are sampled as often as its interior
+
+Every sampler fills a whole (rows x n) matrix at once. Samplers are deterministic
+for a given RNG / seed sequence, and SOBOL rows only depend on their position in
+the sequence (start), so shards drawn by different workers form a single sequence.
+"""
+import functools
+import numpy as np
+
+UNIFORM   = "uniform"
+DIRICHLET = "dirichlet"
+SOBOL     = "sobol"
+EDGE      = "edge"
+SAMPLERS  = [UNIFORM, DIRICHLET, SOBOL, EDGE]
+
+DEFAULT_SAMPLER = UNIFORM
+
+# Sobol sequence: bits of precision and direction numbers (Joe & Kuo, new-joe-kuo-6.21201)
+# One (primitive polynomial, initial direction numbers m_1..m_s) per dimension
+SOBOL_BITS = 32
+SOBOL_DIRECTIONS = [
+    (1, [1]), (3, [1]), (7, [1, 3]), (11, [1, 3, 1]),
+    (13, [1, 1, 1]), (19, [1, 1, 3, 3]), (25, [1, 3, 5, 13]), (37, [1, 1, 5, 5, 17]),
+    (41, [1, 1, 5, 5, 5]), (47, [1, 1, 7, 11, 19]), (55, [1, 1, 5, 1, 1]), (59, [1, 1, 1, 3, 11]),
+    (61, [1, 3, 5, 5, 31]), (67, [1, 3, 3, 9, 7, 49]), (91, [1, 1, 1, 15, 21, 21]), (97, [1, 3, 1, 13, 27, 49]),
+    (103, [1, 1, 1, 15, 7, 5]), (109, [1, 3, 1, 15, 13, 25]), (115, [1, 1, 5, 5, 19, 61]), (131, [1, 3, 7, 11, 23, 15, 103]),
+    (137, [1, 3, 7, 13, 13, 15, 69]), (143, [1, 1, 3, 13, 7, 35, 63]), (145, [1, 3, 5, 9, 1, 25, 53]), (157, [1, 3, 1, 13, 9, 35, 107]),
+    (167, [1, 3, 1, 5, 27, 61, 31]), (171, [1, 1, 5, 11, 19, 41, 61]), (185, [1, 3, 5, 3, 3, 13, 69]), (191, [1, 1, 7, 13, 1, 19, 1]),
+    (193, [1, 3, 7, 5, 13, 19, 59]), (203, [1, 1, 3, 9, 25, 29, 41]), (211, [1, 3, 5, 13, 23, 1, 55]), (213, [1, 3, 7, 3, 13, 59, 17]),
+    (229, [1, 3, 1, 3, 5, 53, 69]), (239, [1, 1, 5, 5, 23, 33, 13]), (241, [1, 1, 7, 7, 1, 61, 123]), (247, [1, 1, 7, 9, 13, 61, 49]),
+    (253, [1, 3, 3, 5, 3, 55, 33]), (285, [1, 3, 1, 15, 31, 13, 49, 245]), (299, [1, 3, 5, 15, 31, 59, 63, 97]), (301, [1, 3, 1, 11, 11, 11, 77, 249]),
+    (333, [1, 3, 1, 11, 27, 43, 71, 9]), (351, [1, 1, 7, 15, 21, 11, 81, 45]), (355, [1, 3, 7, 3, 25, 31, 65, 79]), (357, [1, 3, 1, 1, 19, 11, 3, 205]),
+    (361, [1, 1, 5, 9, 19, 21, 29, 157]), (369, [1, 3, 7, 11, 1, 33, 89, 185]), (391, [1, 3, 3, 3, 15, 9, 79, 71]), (397, [1, 3, 7, 11, 15, 39, 119, 27]),
+    (425, [1, 1, 3, 1, 11, 31, 97, 225]), (451, [1, 1, 1, 3, 23, 43, 57, 177]), (463, [1, 3, 7, 7, 17, 17, 37, 71]), (487, [1, 3, 1, 5, 27, 63, 123, 213]),
+    (501, [1, 1, 3, 5, 11, 43, 53, 133]), (529, [1, 3, 5, 5, 29, 17, 47, 173, 479]), (539, [1, 3, 3, 11, 3, 1, 109, 9, 69]), (545, [1, 1, 1, 5, 17, 39, 23, 5, 343]),
+    (557, [1, 3, 1, 5, 25, 15, 31, 103, 499]), (563, [1, 1, 1, 11, 11, 17, 63, 105, 183]), (601, [1, 1, 5, 11, 9, 29, 97, 231, 363]), (607, [1, 1, 5, 15, 19, 45, 41, 7, 383]),
+    (617, [1, 3, 7, 7, 31, 19, 83, 137, 221]), (623, [1, 1, 1, 3, 23, 15, 111, 223, 83]), (631, [1, 1, 5, 13, 31, 15, 55, 25, 161]), (637, [1, 1, 3, 13, 25, 47, 39, 87, 257]),
+]
+SOBOL_MAX_DIM = len(SOBOL_DIRECTIONS)
+
+
+def get_sampler(name: str) -> str:
+    """
+    Validates a sampler name (case insensitive)
+    Returns the sampler or None if it is unknown
+    """
+    name = str(name).strip().lower()
+    return name if name in SAMPLERS else None
+
+
+@functools.lru_cache(maxsize=None)
+def get_sobol_directions(dims: int) -> np.ndarray:
+    """
+    Returns the (dims x SOBOL_BITS) direction numbers of the Sobol sequence
+    (v_j = m_j / 2^j stored as SOBOL_BITS bit integers)
+    """
+    if dims > SOBOL_MAX_DIM:
+        raise ValueError(f"The Sobol sampler supports up to {SOBOL_MAX_DIM} asset classes")
+
+    directions = np.zeros((dims, SOBOL_BITS), dtype=np.uint64)
+    for d in range(dims):
+        poly, m_init = SOBOL_DIRECTIONS[d]
+        degree = poly.bit_length() - 1
+        m = list(m_init)
+
+        if degree == 0:
+            # First dimension: van der Corput sequence
+            m = [1] * SOBOL_BITS
+        else:
+            # m_j = 2^s m_(j-s) ^ m_(j-s) ^ Σ 2^k a_k m_(j-k)
+            for j in range(degree, SOBOL_BITS):
+                value = m[j - degree] ^ (m[j - degree] << degree)
+                for k in range(1, degree):
+                    if (poly >> (degree - k)) & 1:
+                        value ^= m[j - k] << k
+                m.append(value)
+
+        for j in range(SOBOL_BITS):
+            directions[d, j] = m[j] << (SOBOL_BITS - 1 - j)
+
+    return directions
+
+
+def get_scrambled_directions(dims: int, rng) -> tuple:
+    """
+    Random linear matrix scrambling and digital shift of the Sobol sequence
+
+    Returns (scrambled direction numbers, shift)
+    """
+    directions = get_sobol_directions(dims)
+
+    # Bits of the direction numbers, most significant first: (dims x j x bit)
+    shifts = np.arange(SOBOL_BITS - 1, -1, -1, dtype=np.uint64)
+    bits = ((directions[:, :, None] >> shifts) & 1).astype(np.int64)
+
+    # Lower triangular random binary matrix with unit diagonal, per dimension
+    scramble = np.tril(rng.integers(0, 2, (dims, SOBOL_BITS, SOBOL_BITS)), -1) + np.eye(SOBOL_BITS, dtype=np.int64)
+    scrambled_bits = np.einsum("dik,djk->dji", scramble, bits) % 2
+
+    scrambled = (scrambled_bits.astype(np.uint64) << shifts).sum(axis=2).astype(np.uint64)
+    shift = rng.integers(0, 2**SOBOL_BITS, dims, dtype=np.uint64)
+    return scrambled, shift
+
+
+def get_sobol_points(start: int, size: int, dims: int, seed_seq=None) -> np.ndarray:
+    """
+    Returns the points start to start + size - 1 of the scrambled Sobol sequence
+    in [0, 1)^dims as a (size x dims) matrix
+
+    The scrambling is drawn from the root of seed_seq (shared by every shard spawned
+    from the same seed), None gives the unscrambled sequence
+    """
+    if seed_seq is None:
+        directions = get_sobol_directions(dims)
+        shift = np.zeros(dims, dtype=np.uint64)
+    else:
+        rng = np.random.default_rng(np.random.SeedSequence(seed_seq.entropy))
+        directions, shift = get_scrambled_directions(dims, rng)
+
+    if size == 0:
+        return np.empty((0, dims))
+
+    # 32 bit integers: half the memory traffic of the accumulation
+    directions = directions.astype(np.uint32)
+    shift = shift.astype(np.uint32)
+
+    # Gray code order: point k+1 = point k ^ v_c, c = index of the lowest set bit of k+1
+    steps = np.empty((size, dims), dtype=np.uint32)
+
+    gray = start ^ (start >> 1)
+    first = shift.copy()
+    for j in range(SOBOL_BITS):
+        if (gray >> j) & 1:
+            first ^= directions[:, j]
+    steps[0] = first
+
+    if size > 1:
+        k = np.arange(start + 1, start + size, dtype=np.int64)
+        lowest_bit = np.log2(k & -k).astype(np.int64)
+        steps[1:] = directions[:, lowest_bit].T
+
+    points = np.bitwise_xor.accumulate(steps, axis=0)
+    return (points.astype(np.float64) + 0.5) / 2.0**SOBOL_BITS
+
+
+def fill_uniform(out: np.ndarray, rng, start: int = 0, seed_seq=None) -> np.ndarray:
+    """ i.i.d. uniforms (original sampler, biased towards equal weights) """
+    rng.random(out=out)
+    return out
+
+
+def fill_dirichlet(out: np.ndarray, rng, start: int = 0, seed_seq=None) -> np.ndarray:
+    """ Normalized exponentials: exact uniform distribution on the simplex """
+    rng.standard_exponential(out=out)
+    return out
+
+
+def fill_sobol(out: np.ndarray, rng, start: int = 0, seed_seq=None) -> np.ndarray:
+    """ Sobol points mapped to exponentials (uniform on the simplex once normalized) """
+    points = get_sobol_points(start, out.shape[0], out.shape[1], seed_seq)
+    np.log(points, out=out)
+    np.negative(out, out=out)
+    return out
+
+
+def fill_edge(out: np.ndarray, rng, start: int = 0, seed_seq=None) -> np.ndarray:
+    """
+    Uniform weights on a random face of the simplex: every row holds k random
+    asset classes, k uniform between 1 and n
+    """
+    size, n = out.shape
+    keys = rng.random((size, n))
+    k = rng.integers(1, n + 1, size)
+
+    # Keep the k asset classes with the smallest keys
+    thresholds = np.take_along_axis(np.sort(keys, axis=1), (k - 1)[:, None], axis=1)
+
+    rng.standard_exponential(out=out)
+    out *= keys <= thresholds
+    return out
+
+
+FILL_FUNCTIONS = {
+    UNIFORM   : fill_uniform,
+    DIRICHLET : fill_dirichlet,
+    SOBOL     : fill_sobol,
+    EDGE      : fill_edge
+}
+
+
+def fill_weights(out: np.ndarray, sampler: str = DEFAULT_SAMPLER, rng=None, start: int = 0, seed_seq=None) -> np.ndarray:
+    """
+    Fills out (rows x n, float64) with random weights drawn by sampler, rows summing to 100
+
+    rng      : random generator of the random samplers
+    start    : position of the first row in the whole sample (Sobol sequence)
+    seed_seq : SeedSequence the Sobol scrambling is derived from
+    """
+    if sampler not in FILL_FUNCTIONS:
+        raise ValueError(f"Unknown sampler '{sampler}', select from {SAMPLERS}")
+    if rng is None:
+        rng = np.random.default_rng(seed_seq)
+
+    FILL_FUNCTIONS[sampler](out, rng, start, seed_seq)
+    out *= 100 / out.sum(axis=1, keepdims=True)
+    return out
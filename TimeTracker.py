@@ -14,103 +14,252 @@ This module takes inspiration from the iconic Tag Heuer Formula 1 Mario Kart
 The Time Tracker is helpful to measure performance within other programs. 
 It helps us reduce our functions' time complexity and maximize computation efficiency.
 
-TODO
-Look into decorators and wrappers
+Usage:
+    tt = TimeTracker.get_tracker()
+
+    @TimeTracker.track                  # or @tt.track, @tt.track("custom name")
+    def my_function(): ...
+
+    with tt.section("my section"):      # nested sections build a call tree
+        ...
+
+    tt.start("name") ... tt.end("name") # same as a section
+
+    tt.report()
+
+Runtimes are measured with time.perf_counter_ns(). Every node of the call tree 
+records its number of calls and total/min/mean/max runtimes. With memory 
+tracking enabled (tracemalloc), it also records the memory allocated (delta) 
+and the peak memory above its starting point.
 """
 import time 
-import cProfile
-import random
+import functools
+import tracemalloc
+from contextlib import contextmanager
 
 # func_times = { "function name" : [START, END, RUNTIME] }
+# (seconds since the creation of the tracker, RUNTIME is the total of every call)
 START   = 0
 END     = 1
 RUNTIME = 2
 
+NS_PER_SEC = 1_000_000_000
+
+
+class Node:
+    """
+    Node of the call tree: one function / section in a given call path
+    """
+    def __init__(self, name: str, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = {} # { name : Node } in first call order
+        self.calls = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.mem_delta = 0 # bytes allocated (and not freed) by all calls
+        self.mem_peak = 0  # highest peak above the starting point of a call (bytes)
+
+
+    def get_child(self, name: str):
+        if name not in self.children:
+            self.children[name] = Node(name, self)
+        return self.children[name]
+
+
+    def record(self, runtime_ns: int, mem_delta: int = 0, mem_peak: int = 0) -> None:
+        self.calls += 1
+        self.total_ns += runtime_ns
+        self.min_ns = runtime_ns if self.min_ns is None else min(self.min_ns, runtime_ns)
+        self.max_ns = max(self.max_ns, runtime_ns)
+        self.mem_delta += mem_delta
+        self.mem_peak = max(self.mem_peak, mem_peak)
+
+
+    def mean_ns(self) -> float:
+        return self.total_ns / self.calls if self.calls else 0
+
+
+class Frame:
+    """
+    An active (started, not ended yet) call of a Node
+    """
+    def __init__(self, node: Node, start_ns: int, mem_start: int):
+        self.node = node
+        self.start_ns = start_ns
+        self.mem_start = mem_start
+        self.mem_peak = mem_start # highest traced memory seen during the call
+
+
 class TimeTracker:
     func_times = {} 
     time_zero  = 0
 
-    def __init__(self):
+    def __init__(self, track_memory : bool = False):
         """ Constructor """
         self.func_times = {}
-        self.time_zero  = time.time()
+        self.time_zero  = time.perf_counter_ns()
+        self.root  = Node("TOTAL")
+        self.stack = []
+        self.track_memory = False
+        if track_memory:
+            self.start_memory_tracking()
+
+
+    def start_memory_tracking(self) -> None:
+        """ Starts recording memory deltas (tracemalloc, slows down allocations) """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.track_memory = True
+
+
+    def _now(self) -> float:
+        """ Seconds since the creation of the tracker """
+        return (time.perf_counter_ns() - self.time_zero) / NS_PER_SEC
+
+
+    def _push(self, name : str) -> None:
+        """ Opens a call of name under the current call """
+        parent = self.stack[-1].node if self.stack else self.root
+        node = parent.get_child(name)
+
+        mem_start = 0
+        if self.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1].mem_peak = max(self.stack[-1].mem_peak, peak)
+            tracemalloc.reset_peak()
+            mem_start = current
+
+        self.stack.append(Frame(node, time.perf_counter_ns(), mem_start))
+
+
+    def _pop(self) -> Node:
+        """ Closes the current call and records it """
+        end_ns = time.perf_counter_ns()
+        frame = self.stack.pop()
+
+        mem_delta = 0
+        mem_peak = 0
+        if self.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            frame.mem_peak = max(frame.mem_peak, peak)
+            mem_delta = current - frame.mem_start
+            mem_peak = frame.mem_peak - frame.mem_start
+            if self.stack:
+                self.stack[-1].mem_peak = max(self.stack[-1].mem_peak, frame.mem_peak)
+            tracemalloc.reset_peak()
+
+        runtime_ns = end_ns - frame.start_ns
+        frame.node.record(runtime_ns, mem_delta, mem_peak)
+
+        # Flat view (used by compare)
+        name = frame.node.name
+        start = (frame.start_ns - self.time_zero) / NS_PER_SEC
+        end = (end_ns - self.time_zero) / NS_PER_SEC
+        total = runtime_ns / NS_PER_SEC
+        if name in self.func_times and self.func_times[name][RUNTIME] is not None:
+            total += self.func_times[name][RUNTIME]
+        self.func_times[name] = [start, end, total]
+
+        return frame.node
+
+
+    @contextmanager
+    def section(self, name : str):
+        """ Context manager recording the runtime of its block as name """
+        self._push(name)
+        try:
+            yield self
+        finally:
+            self._pop()
+
+
+    def track(self, func=None, name : str = None):
+        """
+        Decorator recording the runtime of every call of the function
+        Usage: @tt.track or @tt.track(name="custom name")
+        """
+        if func is None or isinstance(func, str):
+            if isinstance(func, str):
+                name = func
+            return lambda f: self.track(f, name=name)
+
+        label = name if name is not None else func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._push(label)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._pop()
+
+        return wrapper
 
     
     def start(self, func_name : str) -> None:
         """ Records function start time """
-        now = time.time() - self.time_zero
-        self.func_times[func_name] = [now, None, None]
+        self._push(func_name)
     
 
     def end(self, func_name : str) -> None:
         """ Records function end time """
-        now = time.time() - self.time_zero
-        try:
-            this = self.func_times[func_name]
-            this[END] = now
-            this[RUNTIME] = this[END] - this[START]
-        except KeyError:
-            print("ERROR - Invalid function name passed to func_end.\nFunction name does not exist in func_times.\nMake sure to use func_start first")
+        if not self.stack or self.stack[-1].node.name != func_name:
+            print("ERROR - Invalid function name passed to func_end.\nFunction name is not the last started function.\nMake sure to use func_start first")
             exit(1)
+        self._pop()
+
+
+    def _get_rows(self, node : Node, depth : int, rows : list) -> list:
+        """ Flattens the call tree (depth first, children by decreasing runtime) """
+        children = sorted(node.children.values(), key=lambda n: n.total_ns, reverse=True)
+        for child in children:
+            rows.append((depth, child))
+            self._get_rows(child, depth + 1, rows)
+        return rows
+
 
-    
     def report(self) -> None:
-        """ Creates and prints a report of all registered functions' runtimes """
-        TUP_RUNTIME = 0
-        TUP_NAME    = 1
-        # runtimes = [(runtime_1, func_1), (runtime_2, func_2), etc.]
-        runtimes    = [] 
-        total       = 0
-
-        # Get info from each function
-        for f, times in self.func_times.items():
-            # Skip incomplete functions
-            if times[RUNTIME] is None:
-                continue
-
-            # For complete functions
-            this_runtime = times[RUNTIME]
-            total += this_runtime
-            runtimes.append((this_runtime, f))
-        
-        # Prepare report
-        REPORT_WIDTH = 70
-        sep_line = "-" * REPORT_WIDTH
-        mid_sep_line = "|" + "-" * 32 + "+" + "-" * 12 + "+" + "-" * 22 + "|"
+        """ Creates and prints a report of all registered functions' runtimes (call tree) """
+        rows = self._get_rows(self.root, 0, [])
+        total = sum(child.total_ns for child in self.root.children.values())
+        if total == 0:
+            total = 1
+
+        NAME_WIDTH = 40
+        columns = f"| {'FUNCTION NAME':^{NAME_WIDTH}} | {'CALLS':>7} | {'WEIGHT (%)':>10} | {'TOTAL (sec)':>11} | {'MEAN (sec)':>11} | {'MIN (sec)':>11} | {'MAX (sec)':>11} |"
+        if self.track_memory:
+            columns += f" {'MEM Δ (MB)':>10} | {'PEAK (MB)':>10} |"
+        sep_line = "-" * len(columns)
+        mid_sep_line = "|" + "".join("-" if c != "|" else "+" for c in columns[1:-1]) + "|"
+
         # print title
         print("\n~~~ Time Tracker Report ~~~\n")
         # print header
-        name_header = "FUNCTION NAME"
-        weight_header = "WEIGHT (%)"
-        runtime_header = "RUNTIME (sec)"
         print(sep_line)
-        print(f"| {name_header:^30} | {weight_header:^9} | {runtime_header:^20} |")
+        print(columns)
         print(mid_sep_line)
 
+        # print elements (indented by depth in the call tree)
+        for depth, node in rows:
+            name = "  " * depth + node.name
+            if len(name) > NAME_WIDTH:
+                name = name[:NAME_WIDTH - 3] + "..."
+            weight = node.total_ns / total * 100
+            line = (f"| {name:<{NAME_WIDTH}} | {node.calls:>7} | {weight:>10.1f} | {node.total_ns / NS_PER_SEC:>11.4f} | "
+                    f"{node.mean_ns() / NS_PER_SEC:>11.4f} | {node.min_ns / NS_PER_SEC:>11.4f} | {node.max_ns / NS_PER_SEC:>11.4f} |")
+            if self.track_memory:
+                line += f" {node.mem_delta / 1e6:>10.2f} | {node.mem_peak / 1e6:>10.2f} |"
+            print(line)
 
-        # print elements
-        runtimes.sort(reverse = True)
-        for tup in runtimes:
-            # get and format name
-            name = tup[TUP_NAME]
-            if len(name) > 30:
-                name = name[:27] + "..."
-            # get and format runtime
-            runtime = tup[TUP_RUNTIME]
-            runtime = int(round(runtime, 0))
-            # get weight of total time in %
-            if total == 0:
-                total = 1
-            weight = tup[TUP_RUNTIME] / total * 100
-            weight = int(round(weight, 0))
-            # print row
-            print(f"| {name:<30} |  {weight:^9} | {runtime:20} |")
-        
         # print total row
-        total_header = "TOTAL"
-        total = int(round(total, 0))
         print(mid_sep_line)
-        print(f"| {total_header:>30} | {100:^10} | {total:>20} |")
+        line = f"| {'TOTAL':>{NAME_WIDTH}} | {'':>7} | {100:>10.1f} | {total / NS_PER_SEC:>11.4f} | {'':>11} | {'':>11} | {'':>11} |"
+        if self.track_memory:
+            line += f" {'':>10} | {'':>10} |"
+        print(line)
         print(sep_line)
 
 
@@ -172,14 +321,15 @@ class TimeTracker:
         print(f"{slow} is {percent_slower}% slower\n")
 
 
-            
-        
-
-        
+# Default tracker shared by the modules of the program
+_tracker = TimeTracker()
 
 
-        
-
-        
+def get_tracker() -> TimeTracker:
+    """ Returns the default tracker """
+    return _tracker
 
 
+def track(func=None, name : str = None):
+    """ Decorator recording every call of the function in the default tracker """
+    return _tracker.track(func, name=name)
@@ -0,0 +1,405 @@
+"""
+~~~ Walk Forward ~~~
+
+Shows how the optimal portfolio drifts over time: the optimal portfolio is
+computed again on rolling windows of the historical returns (e.g. 5 year windows
+stepped monthly) and the weights, E(r), sd and Sharpe ratio of every window are
+written as a time series.
+
+Rebuilding the AssetClass objects and df.corr() of every window would redo the
+whole work for every step. Instead, RollingMoments keeps running sums of the
+returns (count, sums, sums of squares and cross products, pairwise over the dates
+where both asset classes have a return) and updates them by adding the periods
+entering the window and removing the ones leaving it. Each step costs
+O(periods per step x n²) whatever the window length. E(r), sd and correlations
+are derived from the sums with the same formulas as AssetClass and df.corr()
+(NaN returns skipped, pairwise correlations).
+
+Windows are solved (exact tangency portfolio, FrontierSolver) or sampled
+(best-only search, PortfolioEngine.find_best_portfolio) over a pool of workers
+processes. Windows where an asset class has less than MIN_OBSERVATIONS returns
+are skipped.
+
+With a downside Risk Measure parameter (see DownsideRisk.py), every window is
+optimized on the co-semivariance matrix of its own returns instead of its
+covariance matrix, and the sd of the results is the downside deviation.
+
+Usage:
+    python3 WalkForward.py [input file] [--params P] --output [file].csv [--window YEARS] [--step P]
+                           [--period P] [--workers N] [--samples N] [--seed N] [--sampler S] [--plot [file].html]
+"""
+import PortfolioBuilder as pb
+import PortfolioBuilderObjects as obj
+import PortfolioEngine as engine
+import FrontierSolver as solver
+import DownsideRisk
+import Kernels
+import Returns
+import Samplers
+import TimeTracker
+
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# Default window length (years) and step between windows (period code)
+WINDOW_YEARS = 5
+STEP = "M"
+
+# Returns an asset class needs in a window for the window to be computed
+MIN_OBSERVATIONS = 10
+
+# The running sums are computed again from scratch every RESYNC_STEPS steps
+# (bounds the floating point drift of the additions and removals)
+RESYNC_STEPS = 100
+
+# Windows sent to a worker at once
+WINDOWS_PER_TASK = 8
+
+# Result labels (besides one weight column per asset class)
+ER     = "E(r)"
+SD     = "sd"
+SHARPE = "Sharpe"
+
+USAGE = ("python3 WalkForward.py [input file] [--params P] --output [file].csv [--window YEARS] [--step P]\n"
+         "                       [--period P] [--workers N] [--samples N] [--seed N] [--sampler S] [--plot [file].html]")
+
+
+class RollingMoments:
+    """
+    Running sums of a window of returns (rows = periods, columns = asset classes),
+    pairwise over the rows where both asset classes have a return:
+    - count     : N[i, j]   = number of rows where i and j have a return
+    - sums      : S[i, j]   = Σ r_i over these rows
+    - squares   : Q[i, j]   = Σ r_i² over these rows
+    - products  : P[i, j]   = Σ r_i r_j
+    The diagonals hold the statistics of every asset class on its own.
+    """
+    count = None
+    sums = None
+    squares = None
+    products = None
+
+
+    def __init__(self, n: int):
+        self.count = np.zeros((n, n))
+        self.sums = np.zeros((n, n))
+        self.squares = np.zeros((n, n))
+        self.products = np.zeros((n, n))
+
+
+    def update(self, rows: np.ndarray, sign: float = 1.0) -> None:
+        """
+        Adds (sign = 1) or removes (sign = -1) rows of returns (NaN = no return)
+        """
+        if len(rows) == 0:
+            return
+        mask = (~np.isnan(rows)).astype(np.float64)
+        values = np.where(mask > 0, rows, 0.0)
+
+        self.count += sign * (mask.T @ mask)
+        self.sums += sign * (values.T @ mask)
+        self.squares += sign * ((values * values).T @ mask)
+        self.products += sign * (values.T @ values)
+
+
+    def reset(self, rows: np.ndarray) -> None:
+        """
+        Computes the sums of rows from scratch
+        """
+        for matrix in [self.count, self.sums, self.squares, self.products]:
+            matrix.fill(0)
+        self.update(rows)
+
+
+    def get_observations(self) -> np.ndarray:
+        """ Number of returns of every asset class """
+        return np.diag(self.count)
+
+
+    def get_er_vector(self, period: str) -> np.ndarray:
+        """
+        E(r) of every asset class (same as AssetClass.getPandasExpReturn)
+        """
+        mean = np.diag(self.sums) / np.diag(self.count)
+        return obj.period_to_annual_rate(mean / 100, period)
+
+
+    def get_sd_vector(self, period: str) -> np.ndarray:
+        """
+        sd of every asset class (same as AssetClass.getPandasSD)
+        """
+        n = np.diag(self.count)
+        s = np.diag(self.sums)
+        variance = (np.diag(self.squares) - s * s / n) / (n - 1)
+        return obj.period_to_annual_sd(np.sqrt(np.maximum(variance, 0)), period)
+
+
+    def get_corr_matrix(self) -> np.ndarray:
+        """
+        Pairwise correlation matrix (same as df.corr())
+        """
+        N = self.count
+        S = self.sums
+        Q = self.squares
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = N * self.products - S * S.T
+            variance = (N * Q - S * S) * (N * Q.T - S.T * S.T)
+            corr = covariance / np.sqrt(np.maximum(variance, 0))
+        corr = np.clip(corr, -1, 1)
+        np.fill_diagonal(corr, 1)
+        return corr
+
+
+    def get_cov_matrix(self, period: str) -> np.ndarray:
+        """
+        Covariance matrix (same as AssetUniverse.cov_matrix)
+        """
+        sd = self.get_sd_vector(period)
+        return self.get_corr_matrix() * np.outer(sd, sd)
+
+
+def get_windows(index: pd.DatetimeIndex, window_years: float = WINDOW_YEARS, step: str = STEP) -> list:
+    """
+    Returns the rolling windows of index (sorted dates) as (first row, last row + 1):
+    one window per step period (e.g. month), ending on the last date of the period
+    and covering the window_years years before it. Windows shorter than
+    window_years (start of the data) are left out.
+    """
+    index = pd.DatetimeIndex(index)
+    codes, _ = Returns.get_period_codes(index, step)
+    stops = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True]) + 1
+
+    offset = pd.DateOffset(months=int(round(window_years * 12)))
+    windows = []
+    for stop in stops:
+        window_start = index[stop - 1] - offset
+        if window_start < index[0]:
+            continue
+        start = int(np.searchsorted(index.values, window_start.to_datetime64(), side="right"))
+        windows.append((start, int(stop)))
+    return windows
+
+
+def iter_window_moments(returns: np.ndarray, windows: list, period: str):
+    """
+    Yields (window, E(r) vector, covariance matrix) of every window, None vectors
+    when an asset class has less than MIN_OBSERVATIONS returns in the window.
+
+    The running sums are updated with the rows entering and leaving the window
+    (windows must move forward: increasing first and last rows)
+    """
+    moments = RollingMoments(returns.shape[1])
+    start, stop = 0, 0
+
+    for i, (new_start, new_stop) in enumerate(windows):
+        if i % RESYNC_STEPS == 0 or new_start >= stop:
+            moments.reset(returns[new_start:new_stop])
+        else:
+            moments.update(returns[stop:new_stop])
+            moments.update(returns[start:new_start], sign=-1.0)
+        start, stop = new_start, new_stop
+
+        if moments.get_observations().min() < MIN_OBSERVATIONS:
+            yield (start, stop), None, None
+        else:
+            yield (start, stop), moments.get_er_vector(period), moments.get_cov_matrix(period)
+
+
+def solve_window(er_vector: np.ndarray, cov_matrix: np.ndarray, rf: float, sample_size: int = 0, seed=None,
+                 sampler: str = Samplers.DEFAULT_SAMPLER) -> np.ndarray:
+    """
+    Returns the weights (in %) of the optimal portfolio of a window:
+    exact tangency portfolio when sample_size is 0, best of sample_size random
+    portfolios otherwise
+    """
+    if sample_size == 0:
+        return solver.solve_tangency(er_vector, solver.get_nearest_psd(cov_matrix), rf) * 100
+    return engine.find_best_portfolio(er_vector, cov_matrix, sample_size, rf, 1, seed, sampler)[engine.WEIGHTS][0]
+
+
+def _solve_windows(task: tuple) -> list:
+    """ Pool task: weights of the optimal portfolio of every window of task """
+    windows, rf, sample_size, seed, sampler = task
+    return [solve_window(er_vector, cov_matrix, rf, sample_size, seed, sampler) for er_vector, cov_matrix in windows]
+
+
+def get_tasks(er_vectors: list, cov_matrices: list, rf: float, sample_size: int, seed, sampler: str) -> list:
+    """ Groups the windows into pool tasks of WINDOWS_PER_TASK windows """
+    windows = list(zip(er_vectors, cov_matrices))
+    return [(windows[i:i + WINDOWS_PER_TASK], rf, sample_size, seed, sampler) for i in range(0, len(windows), WINDOWS_PER_TASK)]
+
+
+@TimeTracker.track
+def walk_forward(returns: pd.DataFrame, period: str, rf: float, window_years: float = WINDOW_YEARS, step: str = STEP, workers: int = 1,
+                 sample_size: int = 0, seed=None, sampler: str = Samplers.DEFAULT_SAMPLER, risk_measure: str = DownsideRisk.SD,
+                 target: float = None) -> pd.DataFrame:
+    """
+    Computes the optimal portfolio of every rolling window of returns
+    (dates x tickers, decimal returns at periodicity period, see get_windows)
+
+    sample_size 0 solves the exact tangency portfolio of every window, otherwise
+    the best of sample_size random portfolios is kept (same seed for every window).
+    Windows are spread over a pool of workers processes.
+
+    With a downside risk_measure, windows are optimized on the co-semivariance matrix
+    of their returns below target (annual return in %, default: rf) and the sd column
+    holds the downside deviation of their optimal portfolio (exact with DownsideRisk.DOWNSIDE_EXACT)
+
+    Returns a DataFrame indexed by the last date of every window, with the weights
+    (in %) of every asset class and the E(r), sd and Sharpe ratio of the optimal portfolio
+    """
+    returns = returns.sort_index()
+    values = returns.to_numpy(dtype=np.float64)
+    windows = get_windows(returns.index, window_years, step)
+
+    if target is None:
+        target = rf
+
+    # Moments are updated in order (cheap), only the optimizations are spread over the pool
+    dates, bounds, er_vectors, cov_matrices = [], [], [], []
+    for (start, stop), er_vector, cov_matrix in iter_window_moments(values, windows, period):
+        if er_vector is not None:
+            if risk_measure != DownsideRisk.SD:
+                cov_matrix = DownsideRisk.get_cosemivariance_matrix(returns.iloc[start:stop], target, period)
+            dates.append(returns.index[stop - 1])
+            bounds.append((start, stop))
+            er_vectors.append(er_vector)
+            cov_matrices.append(cov_matrix)
+
+    tasks = get_tasks(er_vectors, cov_matrices, rf, sample_size, seed, sampler)
+    if workers <= 1:
+        results = map(_solve_windows, tasks)
+    else:
+        # Sampled windows run the compiled kernels (see Kernels.py): the workers share the cores
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        initializer = Kernels.set_num_threads if sample_size > 0 else None
+        pool = multiprocessing.Pool(workers, initializer=initializer, initargs=(threads,))
+        results = pool.imap(_solve_windows, tasks)
+
+    try:
+        weights = [w for task_weights in results for w in task_weights]
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+    n = returns.shape[1]
+    weights = np.array(weights).reshape(len(dates), n)
+    er_vectors = np.array(er_vectors).reshape(len(dates), n)
+    cov_matrices = np.array(cov_matrices).reshape(len(dates), n, n)
+
+    Er = np.einsum("ij,ij->i", weights, er_vectors)
+    sd = np.sqrt(np.maximum(np.einsum("ij,ijk,ik->i", weights, cov_matrices, weights), 0))
+    if risk_measure == DownsideRisk.DOWNSIDE_EXACT:
+        sd = np.array([DownsideRisk.compute_batch_downside(w, returns.iloc[start:stop], target, period)[0] for w, (start, stop) in zip(weights, bounds)])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(sd > 0, np.maximum(0, (Er - rf) / sd), 0)
+
+    df = pd.DataFrame(weights, index=pd.DatetimeIndex(dates, name=Returns.DATE_LABEL), columns=[str(c) for c in returns.columns])
+    df[ER] = Er
+    df[SD] = sd
+    df[SHARPE] = sharpe
+    return df
+
+
+def get_args() -> dict:
+    """
+    Obtains the walk forward settings from the command line
+    """
+    args = sys.argv
+    if len(args) < 2 or args[1] in pb.HELP_FLAG_STRS:
+        print(USAGE)
+        exit(0 if len(args) >= 2 else 1)
+
+    settings = {
+        "input"   : args[1],
+        "params"  : None,
+        "output"  : None,
+        "window"  : WINDOW_YEARS,
+        "step"    : STEP,
+        "period"  : None,
+        "workers" : 1,
+        "samples" : 0,
+        "seed"    : None,
+        "sampler" : None,
+        "plot"    : None
+    }
+
+    flags = args[2:]
+    i = 0
+    while i < len(flags):
+        flag = flags[i]
+        if i + 1 >= len(flags):
+            print(f"ERROR : Flag '{flag}' must be followed by a value\n")
+            print(USAGE)
+            exit(1)
+        value = flags[i + 1]
+
+        if flag in ["--params", "--output", "--plot"]:
+            settings[flag[2:]] = value
+        elif flag == "--window":
+            try:
+                settings["window"] = float(value)
+            except ValueError:
+                settings["window"] = 0
+            if settings["window"] <= 0:
+                print(f"ERROR : Flag '{flag}' must be followed by a positive number of years\n")
+                exit(1)
+        elif flag == "--step":
+            settings["step"] = pb.translate_period(value)
+        elif flag == pb.PERIOD_FLAG_STR:
+            settings["period"] = value
+            pb.translate_period(value) # validation
+        elif flag in [pb.WORKERS_FLAG_STR, pb.SAMPLES_FLAG_STR, pb.SEED_FLAG_STR]:
+            settings[flag[2:]] = pb.get_int_flag_value(flags, i)
+        elif flag == pb.SAMPLER_FLAG_STR:
+            settings["sampler"] = Samplers.get_sampler(value)
+            if settings["sampler"] is None:
+                print(f"ERROR : Flag '{flag}' must be followed by a sampler {Samplers.SAMPLERS}\n")
+                exit(1)
+        else:
+            print(f"ERROR : Provided invalid flag '{flag}'\n")
+            print(USAGE)
+            exit(1)
+        i += 2
+
+    if settings["output"] is None:
+        print("ERROR : Please provide an output file with '--output'\n")
+        print(USAGE)
+        exit(1)
+
+    return settings
+
+
+def main():
+    settings = get_args()
+
+    file_type = pb.get_file_type(settings["input"])
+    universe, _, rf, _, period, _, sheet_sampler = pb.read_excel_input(settings["input"], file_type, True, settings["period"], settings["params"])
+    sampler = settings["sampler"] or sheet_sampler or Samplers.DEFAULT_SAMPLER
+
+    start = time.perf_counter()
+    df = walk_forward(universe.returns[universe.names], period, rf, settings["window"], settings["step"], settings["workers"],
+                      settings["samples"], settings["seed"], sampler, universe.risk_measure, universe.target)
+    runtime = time.perf_counter() - start
+
+    if df.empty:
+        print(f"ERROR : No window of {settings['window']} years with enough returns")
+        exit(1)
+
+    df.to_csv(settings["output"], sep=pb.DELIMITER)
+    print(f"{len(df)} windows computed in {runtime:.2f} sec, saved in {settings['output']}")
+
+    if settings["plot"] is not None:
+        import Graphs as gr
+        fig = gr.get_walk_forward_plot(df, universe.names, title=f"Optimal portfolio on rolling {settings['window']:g} year windows ({period.lower()} returns)")
+        gr.save_fig_as_html(fig, settings["plot"])
+        print(f"Plot saved in {settings['plot']}")
+
+
+if __name__ == "__main__":
+    main()
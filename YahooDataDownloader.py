@@ -22,52 +22,235 @@
 
 Use this module to obtain the input data needed for PortfolioBuilder.py
 
-Yahoo Data Downloader will help you obtain historical data from Yahoo Finance and store them in Excel format. 
+Yahoo Data Downloader will help you obtain historical data from Yahoo Finance and store them in Parquet, csv or Excel format. 
+PortfolioBuilder.py reads Parquet and csv returns files directly (no need to paste them into the input workbook):
+    python3 PortfolioBuilder.py Historical_Data.parquet --params input.xlsx
 Works like magic, it's too easy! 
 
 Simply change the #OPTIONS below and run the file. 
 
+Prices are kept in a local store (STORE_DIR, one Parquet file of adjusted closes
+per ticker): later runs only fetch the days after the last stored one, so daily
+refreshes take seconds. Tickers are fetched concurrently (WORKERS threads) and
+failed requests are retried with exponential backoff.
+
+The source of the prices is pluggable: any fetcher(ticker, start, end) returning
+a Series of adjusted closes (DatetimeIndex, start included, end excluded) can
+replace the Yahoo Finance one (yahoo_fetcher), e.g. a local stand-in for tests:
+    update_store(TICKERS, start, end, fetcher=my_fetcher)
+
+Requires yfinance (Yahoo Finance fetcher) and pyarrow (Parquet store)
 """
 # OPTIONS
 TICKERS   = ["VOO", "VXUS", "SCHK", "VRE.TO", "VNQ", "VTV", "SCHD", "VCN.TO", "VTI", "VAB.TO", "VB", "GLD", "QQQ", "VPU", "VCE.TO"]
 YEARS     = 25
 FILE_NAME = "Historical_Data"
+FILE_TYPE = "parquet"     # parquet, csv or xlsx
+STORE_DIR = "price_store" # per-ticker prices, reused by later runs
+WORKERS   = 8             # tickers fetched at once
+RETRIES   = 3             # attempts after a failed request
+BACKOFF   = 1.0           # seconds before the first retry (doubled after every attempt)
 #
 
 
 
-import yfinance as yf
+import Returns
+
+import os
+import time
 import pandas as pd
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# Column of the stored prices
+PRICE_COLUMN = "Adj Close"
+
+# Relative tolerance when comparing the stored and fetched price of the last stored day
+ADJUSTMENT_TOLERANCE = 1e-9
+
+
+def yahoo_fetcher(ticker: str, start: str, end: str) -> pd.Series:
+    """
+    Fetches the daily adjusted closes of ticker from Yahoo Finance between start
+    (included) and end (excluded), as a Series indexed by date
+    """
+    import yfinance as yf
+
+    data = yf.download(ticker, start=start, end=end, auto_adjust=False, progress=False)
+    if data is None or data.empty:
+        return pd.Series(dtype=float)
+
+    prices = data[PRICE_COLUMN]
+    # Recent versions of yfinance return one column per ticker
+    if isinstance(prices, pd.DataFrame):
+        prices = prices.iloc[:, 0]
+    return prices
+
+
+def fetch_with_retry(fetcher, ticker: str, start: str, end: str, retries: int = RETRIES, backoff: float = BACKOFF, sleep=time.sleep) -> pd.Series:
+    """
+    Calls fetcher(ticker, start, end), retrying failed calls up to retries times
+    and waiting backoff, 2 * backoff, 4 * backoff... seconds in between
+
+    Returns the fetched prices sorted by date (tz-naive DatetimeIndex without duplicates)
+    Raises the last error when every attempt failed
+    """
+    for attempt in range(retries + 1):
+        try:
+            prices = fetcher(ticker, start, end)
+            break
+        except Exception:
+            if attempt == retries:
+                raise
+            sleep(backoff * 2**attempt)
+
+    prices = pd.Series(prices, dtype=float).dropna()
+    index = pd.DatetimeIndex(prices.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    prices.index = index.normalize()
+    prices = prices[~prices.index.duplicated(keep="last")].sort_index()
+    prices.index.name = "Date"
+    return prices
+
+
+def get_store_path(ticker: str, store_dir: str = STORE_DIR) -> str:
+    """
+    Returns the path of the stored prices of ticker
+    """
+    return os.path.join(store_dir, f"{ticker}.parquet")
+
+
+def load_prices(ticker: str, store_dir: str = STORE_DIR):
+    """
+    Returns (stored prices of ticker, start date they were requested from),
+    or (None, None) when ticker is not stored
+    """
+    path = get_store_path(ticker, store_dir)
+    if not os.path.exists(path):
+        return None, None
+
+    df = pd.read_parquet(path)
+    prices = df[PRICE_COLUMN]
+    prices.index = pd.DatetimeIndex(prices.index).as_unit("ns")
+    return prices, df.attrs.get("start")
+
+
+def save_prices(ticker: str, prices: pd.Series, start: str, store_dir: str = STORE_DIR) -> None:
+    """
+    Stores the prices of ticker, along with the start date they were requested from
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    df = prices.to_frame(PRICE_COLUMN)
+    df.attrs["start"] = start
+
+    path = get_store_path(ticker, store_dir)
+    # Atomic replace: an interrupted run never leaves a half written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def update_ticker(ticker: str, start: str, end: str, store_dir: str = STORE_DIR, fetcher=yahoo_fetcher,
+                  retries: int = RETRIES, backoff: float = BACKOFF) -> pd.Series:
+    """
+    Brings the stored prices of ticker up to end and returns them from start
+
+    Only the days from the last stored one are fetched. That day is fetched again:
+    Yahoo rescales the whole history of adjusted closes after every dividend or 
+    split, so the stored prices are rescaled by the ratio of the fetched and stored 
+    price of that day (returns are unchanged). Everything is fetched again when 
+    nothing is stored, the store starts after start or that day is missing.
+    """
+    stored, stored_start = load_prices(ticker, store_dir)
+
+    prices = None
+    if stored is not None and not stored.empty and stored_start is not None and stored_start <= start:
+        last_date = stored.index[-1]
+        fetched = fetch_with_retry(fetcher, ticker, last_date.strftime("%Y-%m-%d"), end, retries, backoff)
+
+        if fetched.empty:
+            prices = stored
+        elif last_date in fetched.index:
+            ratio = fetched[last_date] / stored[last_date]
+            if abs(ratio - 1) > ADJUSTMENT_TOLERANCE:
+                stored = stored * ratio
+            prices = pd.concat([stored, fetched[fetched.index > last_date]])
+        stored_start = min(stored_start, start)
+    else:
+        stored_start = start
+
+    if prices is None:
+        prices = fetch_with_retry(fetcher, ticker, stored_start, end, retries, backoff)
+
+    save_prices(ticker, prices, stored_start, store_dir)
+    return prices[prices.index >= pd.Timestamp(start)]
+
+
+def update_store(tickers: list, start: str, end: str, store_dir: str = STORE_DIR, fetcher=yahoo_fetcher, workers: int = WORKERS,
+                 retries: int = RETRIES, backoff: float = BACKOFF) -> tuple:
+    """
+    Updates the stored prices of every ticker over a pool of workers threads
+    (see update_ticker)
+
+    Returns ({ticker : prices from start}, {ticker : error}) in the order of tickers
+    """
+    workers = max(1, min(workers, len(tickers)))
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {ticker : pool.submit(update_ticker, ticker, start, end, store_dir, fetcher, retries, backoff) for ticker in tickers}
+
+    prices = {}
+    errors = {}
+    for ticker, future in futures.items():
+        try:
+            prices[ticker] = future.result()
+        except Exception as e:
+            errors[ticker] = e
+
+    return prices, errors
+
 
+def get_returns(prices: dict) -> pd.DataFrame:
+    """
+    Returns the daily returns of every ticker (dates x tickers)
 
-# Define the list of tickers
-tickers = TICKERS
+    Returns are computed on the trading days of each ticker, days where a ticker
+    did not trade (e.g. Canadian holidays) are left empty (NaN)
+    """
+    returns = {ticker : p.ffill().pct_change() for ticker, p in prices.items()}
+    df = pd.concat(returns, axis=1).sort_index()
+    df.index.name = "Date"
+    return df
 
-# Set the end date as today
-end_date = datetime.today().strftime('%Y-%m-%d')
 
-# Calculate the start date as 10 years ago from today
-start_date = (datetime.today() - timedelta(days=365 * YEARS)).strftime('%Y-%m-%d')
+def main():
+    # Set the end date as today
+    end_date = datetime.today().strftime('%Y-%m-%d')
 
-# Create an empty DataFrame to store the historical returns
-historical_returns = pd.DataFrame()
+    # Calculate the start date as YEARS years ago from today
+    start_date = (datetime.today() - timedelta(days=365 * YEARS)).strftime('%Y-%m-%d')
 
-# Iterate through each ticker and fetch historical data
-for ticker in tickers:
-    # Download historical data
-    data = yf.download(ticker, start=start_date, end=end_date)
-    
+    start = time.perf_counter()
+    prices, errors = update_store(TICKERS, start_date, end_date)
+    for ticker, error in errors.items():
+        print(f"ERROR : Could not download '{ticker}' ({type(error).__name__}: {error})")
+    print(f"{len(prices)}/{len(TICKERS)} tickers up to date in {time.perf_counter() - start:.2f} sec")
 
-    # Calculate quarterly returns
-    quarterly_returns = data['Adj Close'].ffill().pct_change()
-    #quarterly_returns = data['Adj Close'].resample('Q').ffill().pct_change()
+    if not prices:
+        exit(1)
 
-    # Append to the historical_returns DataFrame
-    historical_returns[ticker] = quarterly_returns
+    # Export the returns (Parquet and csv files are read directly by PortfolioBuilder.py)
+    historical_returns = get_returns(prices)
+    file_path = f"{FILE_NAME}.{FILE_TYPE}"
+    if FILE_TYPE == "xlsx":
+        historical_returns.to_excel(file_path, index=True)
+    else:
+        Returns.write_returns_file(historical_returns, file_path)
+    print(f"Returns saved in {file_path}")
 
-# Export the DataFrame to an Excel file
-file_name = FILE_NAME
-historical_returns.to_excel((file_name+'.xlsx'), index=True)
+    if errors:
+        exit(1)
 
 
+if __name__ == "__main__":
+    main()
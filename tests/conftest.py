@@ -0,0 +1,32 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the root of the repository (no package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def moments():
+    """ (E(r) vector, sd vector, correlation matrix, covariance matrix) of 6 random asset classes """
+    rng = np.random.default_rng(7)
+    n = 6
+    er_vector = rng.uniform(0.02, 0.15, n)
+    sd_vector = rng.uniform(0.1, 0.4, n)
+    factors = rng.normal(size=(n, n + 2))
+    cov = factors @ factors.T
+    corr = cov / np.sqrt(np.outer(np.diag(cov), np.diag(cov)))
+    return er_vector, sd_vector, corr, corr * np.outer(sd_vector, sd_vector)
+
+
+@pytest.fixture
+def weekly_returns():
+    """ 4 years of weekly returns (decimal) of 4 tickers, the last one listed after a year """
+    rng = np.random.default_rng(11)
+    index = pd.date_range("2018-01-07", periods=210, freq="W-SUN")
+    df = pd.DataFrame(rng.normal(0.002, 0.025, (len(index), 4)), index=index, columns=["A", "B", "C", "D"])
+    df.iloc[:52, 3] = np.nan
+    return df
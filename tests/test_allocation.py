@@ -0,0 +1,90 @@
+"""
+Kinked CAL allocations: risk of the allocated weights and round trips between targets
+"""
+import numpy as np
+import pytest
+
+import Allocation
+import FrontierSolver as solver
+import PortfolioBuilder as pb
+import PortfolioBuilderObjects as obj
+
+RF = 1.0 # %
+RB = 6.0 # %
+
+
+@pytest.fixture
+def frontier(weekly_returns):
+    """ PortfolioSet of 50 solved frontier portfolios """
+    asset_classes = [obj.AssetClass(name, weekly_returns[name], "weekly") for name in weekly_returns.columns]
+    universe = obj.AssetUniverse(asset_classes, weekly_returns.corr(), returns=weekly_returns)
+    weights = solver.solve_frontier_weights(universe.er_vector, universe.cov_matrix, 50) * 100
+    Er = weights @ universe.er_vector
+    sd = np.sqrt(np.einsum("ij,jk,ik->i", weights, universe.cov_matrix, weights))
+    return obj.PortfolioSet(universe, weekly_returns.corr(), weights, Er, sd)
+
+
+@pytest.fixture
+def cal(frontier):
+    return Allocation.KinkedCAL(obj.get_universe(frontier.asset_classes, frontier.corr_matrix), RF, RB, frontier.weights, frontier.Er, frontier.sd)
+
+
+def get_targets(cal: Allocation.KinkedCAL) -> np.ndarray:
+    """ Target sd on the lending, frontier and borrowing segments """
+    sd_l, sd_b = cal.segment_sd[0], cal.segment_sd[-1]
+    return np.r_[0, np.linspace(0, sd_l, 5)[1:], np.linspace(sd_l, sd_b, 23)[1:-1], sd_b, sd_b * 1.5]
+
+
+def test_segment_has_frontier_portfolios(cal):
+    assert len(cal.segment_sd) > 2
+    assert (np.diff(cal.segment_sd) > 0).all()
+
+
+def test_sd_targets_are_reached(cal):
+    targets = get_targets(cal)
+    df = cal.allocate(targets)
+
+    weights = df[cal.names].to_numpy()
+    np.testing.assert_allclose(df[Allocation.SD], targets, atol=1e-9)
+    np.testing.assert_allclose(df[Allocation.SD], np.sqrt(np.einsum("ij,jk,ik->i", weights, cal.universe.cov_matrix, weights)), atol=1e-9)
+    np.testing.assert_allclose(weights.sum(axis=1) + df[Allocation.RISK_FREE], 100)
+
+    inside = (targets >= cal.segment_sd[0]) & (targets <= cal.segment_sd[-1])
+    np.testing.assert_allclose(df[Allocation.RISKY_SHARE][inside], 100)
+
+
+def test_sd_and_er_targets_round_trip(cal):
+    targets = get_targets(cal)[1:]
+    by_sd = cal.allocate(targets, Allocation.TARGET_SD)
+    by_er = cal.allocate(by_sd[Allocation.ER].to_numpy(), Allocation.TARGET_ER)
+
+    np.testing.assert_allclose(by_er[Allocation.SD], targets, rtol=1e-9)
+    np.testing.assert_allclose(by_er[cal.names].to_numpy(), by_sd[cal.names].to_numpy(), atol=1e-8)
+
+
+def test_er_follows_the_kinked_line(cal):
+    _, er_l, sd_l = cal.get_lending_portfolio()
+    _, er_b, sd_b = cal.get_borrowing_portfolio()
+    df = cal.allocate([sd_l / 2, sd_b * 2])
+    np.testing.assert_allclose(df[Allocation.ER], [RF + (er_l - RF) / 2, RB + 2 * (er_b - RB)])
+
+
+def test_unreachable_targets_are_nan(cal):
+    df = cal.allocate([RF - 1, RF + 1], Allocation.TARGET_ER)
+    assert df.iloc[0].isna().all()
+    assert not df.iloc[1].isna().any()
+
+    assert cal.allocate([-1.0]).iloc[0].isna().all()
+    cal.max_leverage = 150
+    df = cal.allocate([cal.segment_sd[-1] * 1.4, cal.segment_sd[-1] * 1.6])
+    assert not df.iloc[0].isna().any()
+    assert df.iloc[1].isna().all()
+
+
+@pytest.mark.parametrize("rb, warns", [(RF - 0.5, True), (float("nan"), False), (RB, False)])
+def test_borrowing_rate_below_rf(frontier, rb, warns, capsys):
+    optimal_portfolio = frontier.get_portfolio(int(np.argmax((frontier.Er - RF) / frontier.sd)))
+    cal = pb.get_kinked_cal(optimal_portfolio, RF, rb, frontier)
+
+    assert cal.rb == (RB if rb == RB else RF)
+    assert ("WARNING" in capsys.readouterr().out) == warns
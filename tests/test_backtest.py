@@ -0,0 +1,86 @@
+"""
+Vectorized backtest against an explicit simulation of the holdings
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import Backtest
+import PortfolioBuilderObjects as obj
+import Returns
+
+WEIGHTS = np.array([
+    [25.0, 25.0, 25.0, 25.0],
+    [70.0, 0.0, 10.0, 20.0],
+    [0.0, 0.0, 0.0, 100.0]
+])
+
+
+def simulate(returns: pd.DataFrame, weights: np.ndarray, rebalance: str = None) -> np.ndarray:
+    """ Wealth path of one portfolio, date by date: holdings reset to the weights at every new rebalancing period """
+    values = returns.fillna(0).to_numpy()
+    periods = returns.index.to_period(Returns.PERIOD_FREQS[rebalance]) if rebalance is not None else None
+    wealth = 1.0
+    holdings = None
+    path = []
+    for t in range(len(values)):
+        if holdings is None or (periods is not None and periods[t] != periods[t - 1]):
+            holdings = wealth * weights / weights.sum()
+        holdings = holdings * (1 + values[t])
+        wealth = holdings.sum()
+        path.append(wealth)
+    return np.array(path)
+
+
+@pytest.mark.parametrize("rebalance", [None] + Backtest.REBALANCE_PERIODS)
+def test_wealth_matches_simulation(weekly_returns, rebalance, monkeypatch):
+    monkeypatch.setattr(Backtest, "PORTFOLIO_CHUNK", 2)
+    results = Backtest.backtest(weekly_returns, WEIGHTS, "W", rebalance)
+
+    expected = np.column_stack([simulate(weekly_returns, w, rebalance) for w in WEIGHTS])
+    np.testing.assert_allclose(results[Backtest.WEALTH].to_numpy(), expected, rtol=1e-12)
+    np.testing.assert_allclose(results[Backtest.TOTAL_RETURN], (expected[-1] - 1) * 100, rtol=1e-10)
+
+
+def test_metrics_match_loop(weekly_returns):
+    rf = 2.0
+    results = Backtest.backtest(weekly_returns, WEIGHTS, "W", "M", rf)
+
+    for j, w in enumerate(WEIGHTS):
+        path = simulate(weekly_returns, w, "M")
+        period_returns = np.diff(np.r_[1.0, path]) / np.r_[1.0, path][:-1]
+        peak, drawdown = 1.0, 0.0
+        for wealth in path:
+            peak = max(peak, wealth)
+            drawdown = min(drawdown, (wealth / peak - 1) * 100)
+        annual = (path[-1] ** (52 / len(path)) - 1) * 100
+        sd = np.std(period_returns, ddof=1) * np.sqrt(52) * 100
+
+        np.testing.assert_allclose(results[Backtest.MAX_DRAWDOWN][j], drawdown, rtol=1e-10)
+        np.testing.assert_allclose(results[Backtest.RETURN][j], annual, rtol=1e-10)
+        np.testing.assert_allclose(results[Backtest.VOLATILITY][j], sd, rtol=1e-10)
+        np.testing.assert_allclose(results[Backtest.SHARPE][j], (annual - rf) / sd, rtol=1e-10)
+
+
+def test_daily_rebalancing_compounds_portfolio_returns(weekly_returns):
+    # Weekly returns rebalanced every day: every period starts from the weights
+    results = Backtest.backtest(weekly_returns, WEIGHTS[1], "W", "D")
+    expected = np.cumprod(1 + weekly_returns.fillna(0).to_numpy() @ WEIGHTS[1] / 100)
+    np.testing.assert_allclose(results[Backtest.WEALTH][0].to_numpy(), expected, rtol=1e-12)
+
+
+def test_zero_weight_portfolios(weekly_returns, capsys):
+    weights = np.vstack([WEIGHTS, np.zeros(4)])
+    with pytest.raises(ValueError):
+        Backtest.backtest(weekly_returns, weights, "weekly")
+
+    asset_classes = [obj.AssetClass(name, weekly_returns[name], "weekly") for name in weekly_returns.columns]
+    universe = obj.AssetUniverse(asset_classes, weekly_returns.corr(), returns=weekly_returns)
+    portfolio_set = obj.PortfolioSet(universe, weekly_returns.corr(), weights, weights @ universe.er_vector, np.ones(len(weights)))
+    portfolios = [portfolio_set.get_portfolio(i) for i in range(len(weights))]
+
+    table = Backtest.backtest_portfolios(portfolios, universe, "weekly", "M")
+    assert list(table.index) == [p.name for p in portfolios[:-1]]
+    assert table.notna().all().all()
+    assert "WARNING" in capsys.readouterr().out
+    assert Backtest.backtest_portfolios(portfolios[-1:], universe, "weekly").empty
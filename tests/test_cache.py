@@ -0,0 +1,46 @@
+"""
+Frontier cache of PortfolioBuilder runs (csv returns file and Excel parameters)
+"""
+import pandas as pd
+import pytest
+
+import Cache as cache
+import PortfolioBuilder as pb
+import Returns
+
+pytest.importorskip("openpyxl")
+pytest.importorskip("plotly")
+
+
+def write_params(path, rf: float) -> None:
+    """ Parameters and (empty) Portfolios sheets of a workbook """
+    parameters = pd.DataFrame({"Parameter" : ["Risk free rate", "Available borrowing interest rate", "Periodicity"],
+                               "Value"     : [rf, rf + 1, "Weekly"],
+                               "Source (optional)" : [None, None, None]})
+    with pd.ExcelWriter(path) as writer:
+        parameters.to_excel(writer, sheet_name="Parameters", index=False)
+        pd.DataFrame(columns=["Portfolio Name", "Color"]).to_excel(writer, sheet_name="Portfolios", index=False)
+
+
+@pytest.mark.parametrize("seed", [None, 3])
+def test_changing_rf_reuses_the_frontier(weekly_returns, tmp_path, seed, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / ".cache"))
+    returns_file = str(tmp_path / "returns.csv")
+    Returns.write_returns_file(weekly_returns, returns_file)
+
+    sampled = []
+    create_portfolios = pb.create_portfolios
+    def spy(*args, **kwargs):
+        batch = create_portfolios(*args, **kwargs)
+        sampled.append(batch)
+        return batch
+    monkeypatch.setattr(pb, "create_portfolios", spy)
+
+    for rf in [1.0, 2.0]:
+        params_file = str(tmp_path / f"params_{rf:g}.xlsx")
+        write_params(params_file, rf)
+        _, _, _, risk_free_rate, _, _ = pb.build_efficient_frontier(returns_file, pb.CSV, 2000, seed=seed, params_file=params_file)
+        assert risk_free_rate == rf
+
+    # The second run loads the portfolios of the first one
+    assert len(sampled) == 1
@@ -0,0 +1,106 @@
+"""
+Price store of YahooDataDownloader, with local fetchers instead of Yahoo Finance
+"""
+import pytest
+import numpy as np
+import pandas as pd
+
+import YahooDataDownloader as ydd
+
+pytest.importorskip("pyarrow")
+
+
+def get_history(periods: int = 30, scale: float = 1.0) -> pd.Series:
+    """ Adjusted closes on business days, multiplied by scale (dividend adjustment) """
+    dates = pd.bdate_range("2024-01-01", periods=periods)
+    return pd.Series(np.linspace(100, 130, periods) * scale, index=dates)
+
+
+class FakeFetcher:
+    """ Serves history between start (included) and end (excluded), after failing failures times """
+
+    def __init__(self, history: pd.Series, failures: int = 0):
+        self.history = history
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, ticker: str, start: str, end: str) -> pd.Series:
+        self.calls.append((ticker, start, end))
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("Too Many Requests")
+        index = self.history.index
+        return self.history[(index >= pd.Timestamp(start)) & (index < pd.Timestamp(end))]
+
+
+def test_fetch_with_retry_backs_off_then_succeeds():
+    history = get_history()
+    fetcher = FakeFetcher(history.iloc[::-1], failures=2)
+    sleeps = []
+
+    prices = ydd.fetch_with_retry(fetcher, "VOO", "2024-01-01", "2025-01-01", retries=3, backoff=0.5, sleep=sleeps.append)
+
+    assert len(fetcher.calls) == 3
+    assert sleeps == [0.5, 1.0]
+    pd.testing.assert_series_equal(prices, history, check_names=False, check_freq=False, check_index_type=False)
+    assert prices.index.is_monotonic_increasing
+
+
+def test_fetch_with_retry_raises_last_error():
+    fetcher = FakeFetcher(get_history(), failures=10)
+    sleeps = []
+
+    with pytest.raises(ConnectionError):
+        ydd.fetch_with_retry(fetcher, "VOO", "2024-01-01", "2025-01-01", retries=2, backoff=1.0, sleep=sleeps.append)
+    assert len(fetcher.calls) == 3
+    assert sleeps == [1.0, 2.0]
+
+
+def test_update_ticker_appends_and_rescales(tmp_path):
+    start = "2024-01-01"
+    first = FakeFetcher(get_history())
+    ydd.update_ticker("VOO", start, "2024-01-20", str(tmp_path), first, retries=0, backoff=0)
+    stored, stored_start = ydd.load_prices("VOO", str(tmp_path))
+    last_date = stored.index[-1]
+    assert stored_start == start
+    assert last_date == pd.Timestamp("2024-01-19")
+
+    # A dividend rescales the whole history of adjusted closes, the fetched range overlaps the last stored day
+    second = FakeFetcher(get_history(scale=0.5), failures=1)
+    prices = ydd.update_ticker("VOO", start, "2024-02-01", str(tmp_path), second, retries=1, backoff=0)
+
+    assert [call[1] for call in second.calls] == [last_date.strftime("%Y-%m-%d")] * 2
+    expected = get_history(scale=0.5)
+    expected = expected[expected.index < pd.Timestamp("2024-02-01")]
+    stored, stored_start = ydd.load_prices("VOO", str(tmp_path))
+    assert stored_start == start
+    assert not stored.index.has_duplicates
+    np.testing.assert_array_equal(stored.index, expected.index)
+    np.testing.assert_allclose(stored.to_numpy(), expected.to_numpy(), rtol=1e-12)
+    pd.testing.assert_series_equal(prices, stored, check_names=False)
+
+
+def test_update_ticker_refetches_earlier_start(tmp_path):
+    history = get_history()
+    ydd.update_ticker("VOO", "2024-01-10", "2024-01-20", str(tmp_path), FakeFetcher(history), retries=0, backoff=0)
+
+    fetcher = FakeFetcher(history)
+    prices = ydd.update_ticker("VOO", "2024-01-01", "2024-01-20", str(tmp_path), fetcher, retries=0, backoff=0)
+
+    assert fetcher.calls == [("VOO", "2024-01-01", "2024-01-20")]
+    assert prices.index[0] == pd.Timestamp("2024-01-01")
+
+
+def test_update_store_reports_errors(tmp_path):
+    history = get_history()
+    fetchers = {"VOO": FakeFetcher(history, failures=1), "GLD": FakeFetcher(history, failures=5)}
+
+    prices, errors = ydd.update_store(["VOO", "GLD"], "2024-01-01", "2024-02-01", str(tmp_path),
+                                      lambda ticker, start, end: fetchers[ticker](ticker, start, end), workers=2, retries=2, backoff=0)
+
+    assert list(prices) == ["VOO"]
+    assert list(errors) == ["GLD"]
+    assert isinstance(errors["GLD"], ConnectionError)
+    assert ydd.load_prices("GLD", str(tmp_path)) == (None, None)
+    stored, _ = ydd.load_prices("VOO", str(tmp_path))
+    np.testing.assert_allclose(stored.to_numpy(), history[history.index < pd.Timestamp("2024-02-01")].to_numpy())
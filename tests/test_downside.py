@@ -0,0 +1,69 @@
+"""
+Downside deviation (co-semivariance and exact modes) against explicit loops
+"""
+import numpy as np
+import pytest
+
+import DownsideRisk
+import PortfolioBuilderObjects as obj
+
+TARGET = 4.0 # % per year
+
+
+def downside_loop(series: list, target: float, m: float) -> float:
+    """ Annualized downside deviation in % of a series of period returns (decimal) """
+    period_target = (1 + target / 100) ** (1 / m) - 1
+    total = 0.0
+    for r in series:
+        total += min(r - period_target, 0) ** 2
+    return (total / len(series) * m) ** 0.5 * 100
+
+
+def test_cosemivariance_matches_loop(weekly_returns):
+    S = DownsideRisk.get_cosemivariance_matrix(weekly_returns, TARGET, "weekly")
+    values = weekly_returns.fillna(0).to_numpy()
+    period_target = (1 + TARGET / 100) ** (1 / 52) - 1
+
+    for i in range(values.shape[1]):
+        for j in range(values.shape[1]):
+            total = sum(min(r[i] - period_target, 0) * min(r[j] - period_target, 0) for r in values)
+            assert S[i, j] == pytest.approx(total / len(values) * 52, rel=1e-12)
+
+
+@pytest.mark.parametrize("chunk_elements", [1, 1000, DownsideRisk.EXACT_CHUNK_ELEMENTS])
+def test_exact_downside_matches_loop(weekly_returns, chunk_elements, monkeypatch):
+    monkeypatch.setattr(DownsideRisk, "EXACT_CHUNK_ELEMENTS", chunk_elements)
+    weights = np.random.default_rng(2).dirichlet(np.ones(4), 25) * 100
+    values = weekly_returns.fillna(0).to_numpy()
+
+    expected = [downside_loop(values @ w / 100, TARGET, 52) for w in weights]
+    np.testing.assert_allclose(DownsideRisk.compute_batch_downside(weights, weekly_returns, TARGET, "weekly"), expected, rtol=1e-12)
+
+
+def test_single_asset_modes_agree(weekly_returns):
+    # With a single asset class, the co-semivariance approximation is exact
+    S = DownsideRisk.get_cosemivariance_matrix(weekly_returns, TARGET, "weekly")
+    exact = DownsideRisk.compute_batch_downside(np.eye(4) * 100, weekly_returns, TARGET, "weekly")
+    np.testing.assert_allclose(np.sqrt(np.diag(S)) * 100, exact, rtol=1e-12)
+
+
+@pytest.mark.parametrize("risk_measure", [DownsideRisk.DOWNSIDE, DownsideRisk.DOWNSIDE_EXACT])
+def test_portfolio_risk(weekly_returns, risk_measure):
+    asset_classes = [obj.AssetClass(name, weekly_returns[name], "weekly") for name in weekly_returns.columns]
+    universe = obj.AssetUniverse(asset_classes, weekly_returns.corr(), returns=weekly_returns)
+    universe.use_downside_risk(risk_measure, TARGET, "weekly")
+    composition = dict(zip(universe, [10.0, 20.0, 30.0, 40.0]))
+    portfolio = obj.Portfolio("P", composition, universe)
+
+    w = np.array([10.0, 20.0, 30.0, 40.0])
+    if risk_measure == DownsideRisk.DOWNSIDE_EXACT:
+        expected = downside_loop(weekly_returns.fillna(0).to_numpy() @ w / 100, TARGET, 52)
+    else:
+        expected = np.sqrt(w @ DownsideRisk.get_cosemivariance_matrix(weekly_returns, TARGET, "weekly") @ w)
+    assert portfolio.sd == pytest.approx(expected, rel=1e-12)
+
+
+def test_get_risk_measure():
+    assert DownsideRisk.get_risk_measure(" Downside_Exact ") == DownsideRisk.DOWNSIDE_EXACT
+    assert DownsideRisk.get_risk_measure("SD") == DownsideRisk.SD
+    assert DownsideRisk.get_risk_measure("variance") is None
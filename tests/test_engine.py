@@ -0,0 +1,51 @@
+"""
+Batch portfolio engine against the per-portfolio computations it replaced
+"""
+import numpy as np
+import pytest
+
+import PortfolioEngine as engine
+import Samplers
+
+
+def test_compute_batch_sd_matches_double_loop(moments, monkeypatch):
+    _, sd_vector, corr, cov = moments
+    weights = engine.get_random_weights_batch(250, len(sd_vector), np.random.default_rng(1))
+    # Several chunks, the last one partial
+    monkeypatch.setattr(engine, "CHUNK_SIZE", 64)
+
+    expected = []
+    for w in weights:
+        variance = 0
+        for i in range(len(w)):
+            for j in range(len(w)):
+                variance += w[i] * w[j] * sd_vector[i] * sd_vector[j] * corr[i][j]
+        expected.append(variance ** 0.5)
+
+    np.testing.assert_allclose(engine.compute_batch_sd(weights, cov), expected, rtol=1e-12)
+
+
+def test_compute_batch_er_matches_loop(moments):
+    er_vector = moments[0]
+    weights = engine.get_random_weights_batch(100, len(er_vector), np.random.default_rng(2))
+    expected = [sum(w[i] * er_vector[i] for i in range(len(w))) for w in weights]
+    np.testing.assert_allclose(engine.compute_batch_er(weights, er_vector), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("sampler", Samplers.SAMPLERS)
+def test_random_weights_on_simplex(sampler):
+    weights = engine.get_random_weights_batch(1000, 6, np.random.default_rng(3), sampler=sampler)
+    assert weights.shape == (1000, 6)
+    assert (weights >= 0).all()
+    np.testing.assert_allclose(weights.sum(axis=1), 100)
+
+
+def test_parallel_batch_matches_serial(moments):
+    er_vector, _, _, cov = moments
+    sample_size = engine.SHARD_SIZE + 500
+    serial = engine.create_portfolio_batch_parallel(er_vector, cov, sample_size, workers=1, seed=11)
+    parallel = engine.create_portfolio_batch_parallel(er_vector, cov, sample_size, workers=2, seed=11)
+
+    for column in [engine.WEIGHTS, engine.ER, engine.SD]:
+        np.testing.assert_array_equal(serial[column], parallel[column])
+    np.testing.assert_allclose(serial[engine.SD], engine.compute_batch_sd(serial[engine.WEIGHTS], cov))
@@ -0,0 +1,46 @@
+"""
+Fused best-Sharpe search: NumPy version against brute force, compiled version against NumPy
+"""
+import numpy as np
+import pytest
+
+import Kernels
+import Samplers
+
+RF = 3.0 # %
+
+
+@pytest.mark.parametrize("sampler", Samplers.SAMPLERS)
+def test_numpy_search_matches_brute_force(moments, sampler, monkeypatch):
+    er_vector, _, _, cov = moments
+    monkeypatch.setattr(Kernels, "CHUNK_SIZE", 1000)
+    start, stop = 123, 5000
+    key = Kernels.get_key(4)
+    sobol = Kernels.get_sobol_state(len(er_vector), 4) if sampler == Samplers.SOBOL else None
+
+    best_sharpe, best_row = Kernels._find_best_sharpe_numpy(er_vector, cov, RF, start, stop, key, sampler, sobol)
+
+    rows = np.arange(start, stop)
+    weights = Kernels.get_weights_at(rows, len(er_vector), 4, sampler)
+    np.testing.assert_allclose(weights.sum(axis=1), 100)
+    sharpe = (weights @ er_vector - RF) / np.sqrt(np.einsum("ij,jk,ik->i", weights, cov, weights))
+    assert best_row == rows[np.argmax(sharpe)]
+    np.testing.assert_allclose(best_sharpe, sharpe.max(), rtol=1e-12)
+
+
+@pytest.mark.parametrize("sampler", Samplers.SAMPLERS)
+def test_compiled_search_matches_numpy(moments, sampler):
+    pytest.importorskip("numba")
+    kernels = Kernels.get_kernels()
+    if kernels is None:
+        pytest.skip("Numba JIT is disabled")
+    er_vector, _, _, cov = moments
+    start, stop = 1000, 1000 + 3 * Kernels.BLOCK_SIZE + 17
+    key = Kernels.get_key(9)
+    sobol = Kernels.get_sobol_state(len(er_vector), 9) if sampler == Samplers.SOBOL else None
+
+    expected = Kernels._find_best_sharpe_numpy(er_vector, cov, RF, start, stop, key, sampler, sobol)
+    best_sharpe, best_row = Kernels.find_best_sharpe(er_vector, cov, RF, start, stop, 9, sampler)
+
+    assert best_row == expected[1]
+    np.testing.assert_allclose(best_sharpe, expected[0], rtol=1e-12)
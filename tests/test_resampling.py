@@ -0,0 +1,50 @@
+"""
+Bootstrap resampling: vectorized moments against resampled returns built explicitly
+"""
+import numpy as np
+import pytest
+
+import DownsideRisk
+import PortfolioBuilderObjects as obj
+import Resampling
+
+
+@pytest.fixture
+def counts(weekly_returns):
+    return Resampling.get_bootstrap_counts(5, len(weekly_returns), np.random.default_rng(8))
+
+
+def test_bootstrap_counts(counts, weekly_returns):
+    assert counts.shape == (5, len(weekly_returns))
+    np.testing.assert_array_equal(counts.sum(axis=1), len(weekly_returns))
+
+
+def test_moments_match_resampled_universe(weekly_returns, counts):
+    er_vectors, cov_matrices = Resampling.estimate_moments(weekly_returns.to_numpy(), counts, "weekly")
+
+    for sample, er_vector, cov_matrix in zip(counts, er_vectors, cov_matrices):
+        resampled = weekly_returns.iloc[np.repeat(np.arange(len(weekly_returns)), sample.astype(int))]
+        asset_classes = [obj.AssetClass(name, resampled[name], "weekly") for name in resampled.columns]
+        universe = obj.AssetUniverse(asset_classes, resampled.corr())
+        np.testing.assert_allclose(er_vector, universe.er_vector, rtol=1e-10)
+        np.testing.assert_allclose(cov_matrix, universe.cov_matrix, rtol=1e-9, atol=1e-12)
+
+
+def test_downside_moments_match_cosemivariance(weekly_returns, counts):
+    target = 4.0
+    _, cov_matrices = Resampling.estimate_moments(weekly_returns.to_numpy(), counts, "weekly", target)
+
+    for sample, cov_matrix in zip(counts, cov_matrices):
+        resampled = weekly_returns.iloc[np.repeat(np.arange(len(weekly_returns)), sample.astype(int))]
+        np.testing.assert_allclose(cov_matrix, DownsideRisk.get_cosemivariance_matrix(resampled, target, "weekly"), rtol=1e-10, atol=1e-15)
+
+
+def test_weights_independent_of_workers(weekly_returns, monkeypatch):
+    monkeypatch.setattr(Resampling, "RESAMPLES_PER_TASK", 7)
+    values = weekly_returns.to_numpy()
+    serial = Resampling.resample_tangency_weights(values, "weekly", 2.0, 30, workers=1, seed=3)
+    parallel = Resampling.resample_tangency_weights(values, "weekly", 2.0, 30, workers=2, seed=3)
+
+    assert serial.shape == (30, 4)
+    np.testing.assert_allclose(serial.sum(axis=1), 100)
+    np.testing.assert_array_equal(serial, parallel)
@@ -0,0 +1,44 @@
+"""
+Vectorized compounding resampler against pandas resample()
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import Returns
+
+# Resample codes -> pandas offsets of df.resample()
+PANDAS_FREQS = {"D": "D", "W": "W-SUN", "M": "ME", "Y": "YE"}
+
+
+@pytest.fixture
+def daily_returns():
+    """ Business day returns over 3 years with missing returns and a gap of a month """
+    rng = np.random.default_rng(5)
+    index = pd.bdate_range("2019-12-25", "2022-03-10")
+    index = index[(index < "2020-06-01") | (index >= "2020-07-01")]
+    df = pd.DataFrame(rng.normal(0.0005, 0.01, (len(index), 3)), index=index, columns=["A", "B", "C"])
+    df.iloc[rng.choice(len(df), 40, replace=False), 1] = np.nan
+    df.iloc[:30, 2] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("resample_period", list(Returns.PERIOD_FREQS))
+def test_compound_resample_matches_pandas(daily_returns, resample_period):
+    expected = (1 + daily_returns.fillna(0)).resample(PANDAS_FREQS[resample_period]).prod() - 1
+    resampled = Returns.compound_resample(daily_returns, resample_period)
+
+    np.testing.assert_array_equal(resampled.index, expected.index)
+    np.testing.assert_allclose(resampled.to_numpy(), expected.to_numpy(), rtol=1e-12, atol=1e-15)
+
+
+def test_compound_resample_all_matches_single(daily_returns):
+    resampled = Returns.compound_resample_all(daily_returns)
+    assert list(resampled) == list(Returns.PERIOD_FREQS)
+    for resample_period, df in resampled.items():
+        pd.testing.assert_frame_equal(df, Returns.compound_resample(daily_returns, resample_period))
+
+
+def test_compound_resample_unsorted_dates(daily_returns):
+    shuffled = daily_returns.sample(frac=1, random_state=0)
+    pd.testing.assert_frame_equal(Returns.compound_resample(shuffled, "M"), Returns.compound_resample(daily_returns, "M"), rtol=1e-12)
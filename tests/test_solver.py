@@ -0,0 +1,94 @@
+"""
+Active-set mean-variance solver: KKT conditions, brute force and scipy
+"""
+import numpy as np
+import pytest
+
+import FrontierSolver as solver
+import PortfolioEngine as engine
+
+RF = 3.0 # %
+
+
+def assert_kkt(G: np.ndarray, A: np.ndarray, b: np.ndarray, x: np.ndarray, tol: float = 1e-9) -> None:
+    """
+    KKT conditions of minimize ½ xᵀGx subject to A x = b, x >= 0:
+    G x = Aᵀλ + μ with μ >= 0 and μ = 0 where x > 0
+    """
+    np.testing.assert_allclose(A @ x, b, atol=tol)
+    assert (x >= 0).all()
+    free = x > 1e-9
+    gradient = G @ x
+    lam = np.linalg.lstsq(A[:, free].T, gradient[free], rcond=None)[0]
+    mu = gradient - A.T @ lam
+    np.testing.assert_allclose(mu[free], 0, atol=tol)
+    assert (mu >= -tol).all()
+
+
+def get_sharpe(weights: np.ndarray, er_vector: np.ndarray, cov: np.ndarray) -> np.ndarray:
+    weights = np.atleast_2d(weights)
+    return (weights @ er_vector - RF / 100) / np.sqrt(np.einsum("ij,jk,ik->i", weights, cov, weights))
+
+
+def test_min_variance_kkt(moments):
+    cov = moments[3]
+    x = solver.solve_min_variance(cov)
+    n = len(x)
+    assert_kkt(cov, np.ones((1, n)), np.ones(1), x)
+
+
+def test_tangency_kkt(moments):
+    er_vector, _, _, cov = moments
+    x = solver.solve_tangency(er_vector, cov, RF)
+    excess = er_vector - RF / 100
+    z = x / (excess @ x)
+    assert_kkt(cov, excess.reshape(1, -1), np.ones(1), z)
+    np.testing.assert_allclose(x.sum(), 1)
+
+
+def test_tangency_beats_random_portfolios(moments):
+    er_vector, _, _, cov = moments
+    best = get_sharpe(solver.solve_tangency(er_vector, cov, RF), er_vector, cov)[0]
+    weights = engine.get_random_weights_batch(200_000, len(er_vector), np.random.default_rng(0)) / 100
+    assert get_sharpe(weights, er_vector, cov).max() <= best + 1e-12
+
+
+def test_tangency_matches_scipy(moments):
+    optimize = pytest.importorskip("scipy.optimize")
+    er_vector, _, _, cov = moments
+    n = len(er_vector)
+    result = optimize.minimize(lambda x: -get_sharpe(x, er_vector, cov)[0], np.full(n, 1 / n), method="SLSQP",
+                               bounds=[(0, 1)] * n, constraints=[{"type": "eq", "fun": lambda x: x.sum() - 1}],
+                               options={"ftol": 1e-14, "maxiter": 1000})
+    x = solver.solve_tangency(er_vector, cov, RF)
+    assert get_sharpe(x, er_vector, cov)[0] >= -result.fun - 1e-9
+    np.testing.assert_allclose(x, result.x, atol=1e-4)
+
+
+def test_tangency_without_excess_return_is_min_variance(moments):
+    er_vector, _, _, cov = moments
+    rf = er_vector.max() * 100 + 1
+    np.testing.assert_allclose(solver.solve_tangency(er_vector, cov, rf), solver.solve_min_variance(cov))
+
+
+def test_frontier_weights_kkt(moments):
+    er_vector, _, _, cov = moments
+    weights = solver.solve_frontier_weights(er_vector, cov, 20)
+    A = np.vstack([np.ones(len(er_vector)), er_vector])
+    targets = np.linspace(er_vector @ solver.solve_min_variance(cov), er_vector.max(), 20)
+    # The last point (highest E(r) asset class alone) has no unique multipliers
+    for x, target in zip(weights[:-1], targets[:-1]):
+        assert_kkt(cov, A, np.array([1.0, target]), x)
+
+    sd = engine.compute_batch_sd(weights, cov)
+    assert (np.diff(sd) > 0).all()
+
+
+def test_nearest_psd():
+    cov = np.array([[1.0, 0.9, -0.9], [0.9, 1.0, 0.9], [-0.9, 0.9, 1.0]])
+    psd = solver.get_nearest_psd(cov)
+    assert np.linalg.eigvalsh(psd).min() >= -1e-12
+    np.testing.assert_allclose(psd, psd.T)
+
+    identity = np.eye(3)
+    assert solver.get_nearest_psd(identity) is identity
@@ -0,0 +1,15 @@
+"""
+Import-time budget of the CLI (see Benchmark.py)
+"""
+import Benchmark
+
+
+def test_startup_within_budget():
+    startup = Benchmark.measure_startup()
+    violations = Benchmark.check_startup(startup)
+    assert not violations, violations
+
+
+def test_check_startup_reports_violations():
+    violations = Benchmark.check_startup({"import_sec": Benchmark.IMPORT_BUDGET_SEC + 1, "modules": ["plotly"]})
+    assert len(violations) == 2
@@ -0,0 +1,79 @@
+"""
+Rolling window moments against AssetClass objects and df.corr() built from scratch
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import PortfolioBuilderObjects as obj
+import DownsideRisk
+import FrontierSolver as solver
+import WalkForward
+
+
+def get_universe(window: pd.DataFrame) -> obj.AssetUniverse:
+    """ Asset universe of a window, built the way read_excel_input builds it """
+    asset_classes = [obj.AssetClass(name, window[name], "weekly") for name in window.columns]
+    return obj.AssetUniverse(asset_classes, window.corr())
+
+
+@pytest.mark.parametrize("resync_steps", [1, 7, WalkForward.RESYNC_STEPS])
+def test_window_moments_match_universe(weekly_returns, resync_steps, monkeypatch):
+    monkeypatch.setattr(WalkForward, "RESYNC_STEPS", resync_steps)
+    windows = WalkForward.get_windows(weekly_returns.index, 1, "W")
+    assert len(windows) > 100
+
+    skipped = 0
+    for (start, stop), er_vector, cov_matrix in WalkForward.iter_window_moments(weekly_returns.to_numpy(), windows, "weekly"):
+        window = weekly_returns.iloc[start:stop]
+        if window.count().min() < WalkForward.MIN_OBSERVATIONS:
+            assert er_vector is None and cov_matrix is None
+            skipped += 1
+            continue
+        universe = get_universe(window)
+        np.testing.assert_allclose(er_vector, universe.er_vector, rtol=1e-10)
+        np.testing.assert_allclose(cov_matrix, universe.cov_matrix, rtol=1e-9, atol=1e-12)
+    assert skipped > 0
+
+
+def test_windows_cover_the_window_length(weekly_returns):
+    index = weekly_returns.index
+    windows = WalkForward.get_windows(index, 2, "M")
+
+    month_ends = pd.Series(index, index=index).groupby(index.to_period("M")).max()
+    expected = [date for date in month_ends if date - pd.DateOffset(years=2) >= index[0]]
+    assert [index[stop - 1] for _, stop in windows] == expected
+    for start, stop in windows:
+        first_date = index[stop - 1] - pd.DateOffset(years=2)
+        assert index[start] > first_date
+        assert start == 0 or index[start - 1] <= first_date
+
+
+def test_walk_forward_matches_window_solution(weekly_returns):
+    rf = 2.0
+    df = WalkForward.walk_forward(weekly_returns, "weekly", rf, window_years=2, step="M")
+    window_end = df.index[-1]
+    window = weekly_returns[weekly_returns.index > window_end - pd.DateOffset(years=2)]
+    universe = get_universe(window)
+
+    expected = solver.solve_tangency(universe.er_vector, solver.get_nearest_psd(universe.cov_matrix), rf) * 100
+    np.testing.assert_allclose(df.iloc[-1][weekly_returns.columns].to_numpy(dtype=float), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("risk_measure", [DownsideRisk.DOWNSIDE, DownsideRisk.DOWNSIDE_EXACT])
+def test_walk_forward_on_downside_risk(weekly_returns, risk_measure):
+    rf, target = 2.0, 4.0
+    df = WalkForward.walk_forward(weekly_returns, "weekly", rf, window_years=2, step="M", risk_measure=risk_measure, target=target)
+    window_end = df.index[-1]
+    window = weekly_returns[weekly_returns.index > window_end - pd.DateOffset(years=2)]
+    asset_classes = [obj.AssetClass(name, window[name], "weekly") for name in window.columns]
+    universe = obj.AssetUniverse(asset_classes, window.corr(), returns=window)
+    universe.use_downside_risk(risk_measure, target, "weekly")
+
+    expected = solver.solve_tangency(universe.er_vector, solver.get_nearest_psd(universe.cov_matrix), rf) * 100
+    weights = df.iloc[-1][weekly_returns.columns].to_numpy(dtype=float)
+    np.testing.assert_allclose(weights, expected, atol=1e-6)
+    if risk_measure == DownsideRisk.DOWNSIDE_EXACT:
+        np.testing.assert_allclose(df.iloc[-1][WalkForward.SD], universe.compute_exact_risk(weights)[0], rtol=1e-9)
+    else:
+        np.testing.assert_allclose(df.iloc[-1][WalkForward.SD], np.sqrt(weights @ universe.cov_matrix @ weights), rtol=1e-9)